@@ -0,0 +1,72 @@
+import os
+import secrets
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Request
+from app.profiling import slow_requests
+from app.rate_engine import get_rate_table
+from app.rate_store import get_rate_store
+from app.reload import rate_reloader
+from app.schemas import RateTier, TierQuery
+from typing import List, Optional
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# most tier lookups answered per request
+MAX_TIER_LOOKUPS = int(os.getenv("MAX_TIER_LOOKUPS", "10000"))
+
+
+def is_admin(token: Optional[str]) -> bool:
+    # admin access is disabled unless a token is configured
+    return bool(ADMIN_TOKEN) and token is not None and secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+router = APIRouter(prefix="/v1/admin", dependencies=[Depends(require_admin)])
+
+
+@router.get("/rates")
+async def get_rates_status():
+    table = get_rate_table()
+    return {
+        "version": table.tag if table is not None else None,
+        "content_hash": table.content_hash if table is not None else None,
+        "fee_rules_hash": table.fees.content_hash if table is not None else None,
+        "lanes": len(table) if table is not None else 0,
+        "last_reload": rate_reloader.last_reload,
+        "store": get_rate_store().status(),
+    }
+
+
+@router.post("/rates/reload", status_code=202)
+async def reload_rates(request: Request, background_tasks: BackgroundTasks):
+    """Reload rates in the background from the uploaded sheet, or from the rate file if the body is empty."""
+    body = await request.body()
+    if body.strip():
+        background_tasks.add_task(rate_reloader.reload_bytes, body, "upload")
+    else:
+        background_tasks.add_task(rate_reloader.reload_file)
+    table = get_rate_table()
+    return {"status": "accepted", "active_version": table.tag if table is not None else None}
+
+
+@router.post("/rates/tiers", response_model=List[Optional[RateTier]])
+async def lookup_stored_tiers(queries: List[TierQuery]):
+    """The stored tier covering each (origin, destination, channel, weight); null where none does.
+
+    Answered from the database in one indexed query per ``TIER_LOOKUP_BATCH``, so it shows the sheet
+    as stored, which is ahead of the active rates while a reload compiles.
+    """
+    if len(queries) > MAX_TIER_LOOKUPS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_TIER_LOOKUPS} lookups per request")
+    tiers = await get_rate_store().lookup_tiers_async([
+        (query.starting_country, query.destination_country, query.shipping_channel, query.weight_kg)
+        for query in queries])
+    return [tier._asdict() if tier is not None else None for tier in tiers]
+
+
+@router.get("/slow-requests")
+async def get_slow_requests():
+    """Stack samples of the latest requests slower than ``SLOW_REQUEST_MS``, newest first."""
+    return {"threshold_ms": slow_requests.threshold_ms, "requests": slow_requests.entries()}
@@ -0,0 +1,313 @@
+"""Write-behind audit log of the quotes handed out.
+
+Routes hand each quote request and its quotes to ``quote_audit.record``
+(a manifest quote is logged with the manifest's digest and totals in place
+of its box lines, an optimize request with its plans), which only appends them to a bounded in-memory queue. A background thread
+drains the queue in batches and writes them to a sink: gzip compressed
+NDJSON files in a directory, rotated by size, or bulk inserts into the
+``quote_audit`` table. Nothing is encoded or written on the request path.
+When the queue is full, entries are dropped and counted instead of
+slowing the request down.
+
+The log can be replayed against the current rates to see which prices
+have changed since they were quoted:
+
+    python -m app.audit replay audit/ --rates "data/rates (1).json" > diffs.ndjson
+"""
+import argparse
+import glob
+import gzip
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import count
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.models import QuoteAudit
+from app.responses import dumps
+
+# "" disables the log, otherwise "file" or "database"
+QUOTE_AUDIT_SINK = os.getenv("QUOTE_AUDIT_SINK", "")
+QUOTE_AUDIT_DIR = os.getenv("QUOTE_AUDIT_DIR", "audit")
+QUOTE_AUDIT_ROTATE_BYTES = int(os.getenv("QUOTE_AUDIT_ROTATE_BYTES", str(64 << 20)))
+QUOTE_AUDIT_QUEUE_SIZE = int(os.getenv("QUOTE_AUDIT_QUEUE_SIZE", "100000"))
+QUOTE_AUDIT_BATCH_SIZE = int(os.getenv("QUOTE_AUDIT_BATCH_SIZE", "1000"))
+QUOTE_AUDIT_FLUSH_INTERVAL = float(os.getenv("QUOTE_AUDIT_FLUSH_INTERVAL", "1"))
+
+_STOP = object()
+
+
+def audit_entry(logged_at: float, rate_version: str, quote_request, quotes) -> dict:
+    return {"logged_at": logged_at, "rate_version": rate_version, "request": quote_request, "quotes": quotes}
+
+
+class GzipFileSink:
+    """Appends batches to ``quotes-<time>-<pid>-<n>.ndjson.gz`` files in ``directory``.
+
+    Every batch is written as its own gzip member, so a file is readable up
+    to the last complete batch even if the process dies mid-write. A new file
+    is started once the current one reaches ``rotate_bytes``.
+    """
+
+    def __init__(self, directory: str = QUOTE_AUDIT_DIR, rotate_bytes: int = QUOTE_AUDIT_ROTATE_BYTES):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.path: Optional[str] = None
+        self._files = count()
+        os.makedirs(directory, exist_ok=True)
+
+    def _next_path(self) -> str:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        return os.path.join(self.directory, f"quotes-{stamp}-{os.getpid()}-{next(self._files)}.ndjson.gz")
+
+    def write(self, entries: List[dict]) -> None:
+        if self.path is None or os.path.getsize(self.path) >= self.rotate_bytes:
+            self.path = self._next_path()
+        member = gzip.compress(b"".join(dumps(entry) + b"\n" for entry in entries))
+        with open(self.path, "ab") as log_file:
+            log_file.write(member)
+
+
+class DatabaseSink:
+    """Bulk inserts batches into the ``quote_audit`` table."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        QuoteAudit.__table__.create(engine, checkfirst=True)
+
+    def write(self, entries: List[dict]) -> None:
+        rows = []
+        for entry in entries:
+            quote_request = entry["request"]
+            rows.append({
+                "created_at": datetime.fromtimestamp(entry["logged_at"], timezone.utc).replace(tzinfo=None),
+                "starting_country": quote_request.starting_country,
+                "destination_country": quote_request.destination_country,
+                "rate_version": entry["rate_version"],
+                # the JSON column wants plain data, not models
+                "request": orjson.loads(dumps(quote_request)),
+                "quotes": orjson.loads(dumps(entry["quotes"])),
+            })
+        with self.engine.begin() as conn:
+            conn.execute(insert(QuoteAudit), rows)
+
+
+class QuoteAuditLog:
+    """Bounded queue of quotes waiting to be written, and the thread writing them."""
+
+    def __init__(self, max_queued: int = QUOTE_AUDIT_QUEUE_SIZE, batch_size: int = QUOTE_AUDIT_BATCH_SIZE,
+                 flush_interval: float = QUOTE_AUDIT_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queued)
+        self._sink = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def record(self, quote_request, quotes, rate_version: str) -> bool:
+        """Queue the quotes given for ``quote_request``; False if the entry was dropped."""
+        if self._thread is None:
+            return False
+        try:
+            self._queue.put_nowait((time.time(), rate_version, quote_request, quotes))
+        except queue.Full:
+            metrics.QUOTE_AUDIT_ENTRIES.inc("dropped")
+            return False
+        return True
+
+    def start(self, sink) -> None:
+        self._sink = sink
+        self._thread = threading.Thread(target=self._run, name="quote-audit", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write out everything queued so far and stop the writer thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._thread = None
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(audit_entry(*item))
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: List[dict]) -> None:
+        try:
+            self._sink.write(batch)
+        except Exception as exc:
+            metrics.QUOTE_AUDIT_ENTRIES.inc("failed", amount=len(batch))
+            print(f"Quote audit write failed, {len(batch)} entries lost: {exc}")
+            return
+        metrics.QUOTE_AUDIT_ENTRIES.inc("written", amount=len(batch))
+
+
+quote_audit = QuoteAuditLog()
+
+
+def start_audit_log(sink_name: str = QUOTE_AUDIT_SINK, engine=None, sink=None) -> Optional[QuoteAuditLog]:
+    """Start ``quote_audit`` writing to the named sink; None if the audit log is off.
+
+    ``sink`` (anything with a ``write(entries)`` method) is used instead of the named one.
+    """
+    if sink is None:
+        if sink_name == "file":
+            sink = GzipFileSink()
+        elif sink_name == "database":
+            if engine is None:
+                raise ValueError("QUOTE_AUDIT_SINK=database needs a SQL DATABASE_URL")
+            sink = DatabaseSink(engine)
+        elif not sink_name:
+            return None
+        else:
+            raise ValueError(f"unknown QUOTE_AUDIT_SINK {sink_name!r}, expected 'file' or 'database'")
+    quote_audit.start(sink)
+    return quote_audit
+
+
+def iter_log_files(paths: Iterable[str]) -> Iterator[dict]:
+    """Entries of the given log files, or of every log file in the given directories, oldest first."""
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.ndjson.gz"))) if os.path.isdir(path) else [path]
+        for file_path in files:
+            with gzip.open(file_path, "rb") as log_file:
+                for line in log_file:
+                    if line.strip():
+                        yield orjson.loads(line)
+
+
+def iter_log_table(engine, batch_size: int = 1000) -> Iterator[dict]:
+    """Entries of the ``quote_audit`` table, oldest first."""
+    query = select(QuoteAudit).order_by(QuoteAudit.id).execution_options(yield_per=batch_size)
+    with sessionmaker(bind=engine)() as session:
+        for row in session.scalars(query):
+            yield {"logged_at": row.created_at.replace(tzinfo=timezone.utc).timestamp(),
+                   "rate_version": row.rate_version, "request": row.request, "quotes": row.quotes}
+
+
+def diff_entry(entry: dict, rate_table, tolerance: float = 1e-9) -> List[dict]:
+    """Channels whose total cost for the logged request differs under ``rate_table``.
+
+    A channel quoted then but not now (or the other way around) is reported
+    with ``None`` for the missing side. Manifest quotes are re-priced from
+    their logged totals. Optimize plans are not replayed: the search stops
+    at a time budget, so a new run is no fixed price to compare against.
+    """
+    from app.controllers import get_shipping_quotes, quote_box_totals
+    from app.schemas import ManifestQuoteRequest, QuoteRequest
+
+    if isinstance(entry["quotes"], dict):
+        return []
+    manifest = "manifest_sha256" in entry["request"]
+    if manifest:
+        quote_request = ManifestQuoteRequest.model_validate(entry["request"])
+    else:
+        quote_request = QuoteRequest.model_validate(entry["request"])
+    try:
+        if manifest:
+            totals = (quote_request.chargeable_weight_kg, quote_request.oversized_fee, quote_request.overweight_fee)
+            current = quote_box_totals(quote_request.starting_country, quote_request.destination_country, totals,
+                                       rate_table)
+        else:
+            current = get_shipping_quotes(quote_request, rate_table)
+    except HTTPException:
+        current = []
+    logged_totals = {quote["shipping_channel"]: quote["total_cost"] for quote in entry["quotes"]}
+    current_totals = {quote.shipping_channel: quote.total_cost for quote in current}
+
+    diffs = []
+    for channel in list(logged_totals) + [channel for channel in current_totals if channel not in logged_totals]:
+        logged, now = logged_totals.get(channel), current_totals.get(channel)
+        if logged is not None and now is not None and abs(now - logged) <= tolerance * max(abs(logged), 1.0):
+            continue
+        diffs.append({
+            "logged_at": entry["logged_at"],
+            "starting_country": quote_request.starting_country,
+            "destination_country": quote_request.destination_country,
+            "shipping_channel": channel,
+            "logged_rate_version": entry["rate_version"],
+            "logged_total_cost": logged,
+            "current_total_cost": now,
+            "delta": now - logged if logged is not None and now is not None else None,
+        })
+    return diffs
+
+
+def _current_rate_table(args):
+    from app.rate_engine import build_rate_table, load_rate_table
+
+    if args.rates:
+        from app.loader import content_hash_bytes
+        from app.reload import parse_rate_sheet
+
+        with open(args.rates, "rb") as rate_file:
+            raw = rate_file.read()
+        return build_rate_table(parse_rate_sheet(raw), content_hash=content_hash_bytes(raw))
+    with sessionmaker(bind=create_engine(args.database_url))() as session:
+        return load_rate_table(session)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    from app.database import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Quote audit log tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay = commands.add_parser("replay", help="re-price logged quotes with the current rates and print the "
+                                                "changed ones as NDJSON")
+    replay.add_argument("paths", nargs="*", help="log files or directories; reads the quote_audit table if empty")
+    replay.add_argument("--rates", help="rate sheet to price with instead of the rates in the database")
+    replay.add_argument("--database-url", default=DATABASE_URL)
+    replay.add_argument("--tolerance", type=float, default=1e-9, help="relative difference ignored as rounding")
+    args = parser.parse_args(argv)
+
+    rate_table = _current_rate_table(args)
+    entries = iter_log_files(args.paths) if args.paths else iter_log_table(create_engine(args.database_url))
+    replayed = changed = 0
+    for entry in entries:
+        replayed += 1
+        diffs = diff_entry(entry, rate_table, args.tolerance)
+        changed += bool(diffs)
+        for diff in diffs:
+            sys.stdout.buffer.write(dumps(diff) + b"\n")
+    sys.stdout.flush()
+    print(f"Replayed {replayed} quotes against rate version {rate_table.tag}, {changed} changed",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
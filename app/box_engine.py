@@ -0,0 +1,50 @@
+import numpy as np
+from typing import Optional, Sequence, Tuple
+from app.fees import OriginFees
+from app.rate_engine import origin_fees
+
+
+def calculate_box_line_costs(count: np.ndarray, weight_kg: np.ndarray, length: np.ndarray,
+                             width: np.ndarray, height: np.ndarray, starting_country: str,
+                             fees: Optional[OriginFees] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Array version of ``calculate_shipping_cost`` for every box line of a request.
+
+    Operations are done in the same order as the scalar path so each element
+    is bit-for-bit identical to what ``calculate_shipping_cost`` returns for
+    that line. ``fees`` defaults to the active fee rules of ``starting_country``.
+    """
+    if fees is None:
+        fees = origin_fees(starting_country)
+    count_f = count.astype(np.float64)
+    gross_weight = count_f * weight_kg
+    volumetric_weight = (length * width * height * count_f) / 6000
+    chargeable_weight = np.maximum(gross_weight, volumetric_weight)
+
+    max_dimension = np.maximum(np.maximum(length, width), height)
+    oversized_fee, overweight_fee = fees.line_fees(count_f, weight_kg, max_dimension)
+
+    return chargeable_weight, oversized_fee, overweight_fee
+
+
+def builtin_sum(values: np.ndarray) -> float:
+    # np.sum uses pairwise summation, which rounds differently from the builtin
+    # sum the scalar path uses (itself compensated from python 3.12 on)
+    return sum(values.tolist())
+
+
+def calculate_box_totals(count: Sequence[int], weight_kg: Sequence[float], length: Sequence[float],
+                         width: Sequence[float], height: Sequence[float],
+                         starting_country: str, fees: Optional[OriginFees] = None) -> Tuple[float, float, float]:
+    """Total chargeable weight, oversized fee and overweight fee of all box lines."""
+    if len(count) == 0:
+        raise ValueError("a quote needs at least one box")
+    weights, oversized_fees, overweight_fees = calculate_box_line_costs(
+        np.asarray(count, dtype=np.int64),
+        np.asarray(weight_kg, dtype=np.float64),
+        np.asarray(length, dtype=np.float64),
+        np.asarray(width, dtype=np.float64),
+        np.asarray(height, dtype=np.float64),
+        starting_country,
+        fees,
+    )
+    return builtin_sum(weights), builtin_sum(oversized_fees), builtin_sum(overweight_fees)
@@ -1,5 +1,6 @@
 # constants.py
 
+# fee rules used when data/fee_rules.json (FEE_RULES_PATH) is missing; see app.fees.DEFAULT_FEE_RULES
 MAX_BOX_WEIGHT = 30
 MAX_BOX_DIMENSION = 120
 MAX_BOX_WEIGHT_INDIA = 15
@@ -9,4 +10,8 @@ SERVICE_FEE_CHINA = 300
 OVERWEIGHT_FEE = 80
 OVERSIZED_FEE = 100
 
+# number of batch requests grouped by lane before results are streamed
+BATCH_WINDOW = 256
 
+# requests with at least this many box lines are priced with the numpy engine
+VECTORIZE_MIN_BOXES = 64
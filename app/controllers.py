@@ -1,14 +1,19 @@
 from app.schemas import QuoteRequest, Quote, Box
-from app.schemas import ShippingTimeRange, CostBreakdown
-from app.models import ShippingRate, Rate
-from app.database import SessionLocal
-from app.constants import MAX_BOX_WEIGHT, MAX_BOX_DIMENSION, MAX_BOX_WEIGHT_INDIA, MAX_BOX_DIMENSION_VIETNAM, SERVICE_FEE_CHINA, OVERWEIGHT_FEE, OVERSIZED_FEE
-from typing import List, Tuple
+from app.schemas import ShippingTimeRange, CostBreakdown, CompareRequest, LaneQuotes
+from app.schemas import OptimizeRequest, ShipmentPlans
+from app.rate_engine import LaneRates, RateTable, ensure_rate_table, origin_fees
+from app.fees import OriginFees
+from app.rate_store import get_rate_store
+from app.quote_cache import canonical_key, quote_cache
+from app.constants import BATCH_WINDOW, VECTORIZE_MIN_BOXES
+from app import box_engine, metrics, optimizer
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple, Union
 from fastapi import HTTPException
+from pydantic import ValidationError
 
 
-def calculate_shipping_cost(box: Box, starting_country: str) -> Tuple[float, float, float]:
-    session = SessionLocal()
+def calculate_shipping_cost(box: Box, starting_country: str,
+                            fees: Optional[OriginFees] = None) -> Tuple[float, float, float]:
     # Calculate gross weight and volumetric weight
     gross_weight = box.count * box.weight_kg
     volumetric_weight = (box.length * box.width *
@@ -20,129 +25,265 @@ def calculate_shipping_cost(box: Box, starting_country: str) -> Tuple[float, flo
     # Calculate the shipping cost based on chargeable weight and per-kg rate
     total_weight = chargeable_weight
 
-    oversized_fee = 0.0
-    overweight_fee = 0.0
+    # Apply the origin's fee rules (data/fee_rules.json)
+    if fees is None:
+        fees = origin_fees(starting_country)
+    oversized_fee, overweight_fee = fees.box_fees(
+        box.weight_kg, max(box.length, box.width, box.height), box.count)
 
-    if box.weight_kg > MAX_BOX_WEIGHT:
-        overweight_fee += (OVERWEIGHT_FEE * box.count)
-    if max(box.length, box.width, box.height) > MAX_BOX_DIMENSION:
-        oversized_fee += (OVERSIZED_FEE * box.count)
-
-    # Apply country-specific fees
-    if starting_country == "India" and box.weight_kg >= MAX_BOX_WEIGHT_INDIA and overweight_fee == 0.0:
-        overweight_fee += (OVERWEIGHT_FEE * box.count)
-    elif starting_country == "Vietnam" and max(box.length, box.width, box.height) > MAX_BOX_DIMENSION_VIETNAM:
-        oversized_fee += (OVERSIZED_FEE * box.count)
-
-    session.close()
     return total_weight, oversized_fee, overweight_fee
 
 
-def get_shipping_quotes(quote_request: QuoteRequest) -> List[Quote]:
-    try:
-        session = SessionLocal()
-        quotes = []
-        total_shipping_weight = 0.0
-        service_fee = 0.0
-        total_oversized_fee = 0.0
-        total_overweight_fee = 0.0
-
-        # service fee
-        if quote_request.starting_country == "China":
-            service_fee += SERVICE_FEE_CHINA
+def calculate_box_totals(quote_request: QuoteRequest,
+                         fees: Optional[OriginFees] = None) -> Tuple[float, float, float]:
+    """Total chargeable weight, oversized fee and overweight fee of a request.
 
+    Small requests go through ``calculate_shipping_cost`` box by box; large
+    or columnar ones are computed as arrays, with identical results.
+    """
+    boxes = quote_request.boxes
+    columns = quote_request.box_columns
+    if fees is None:
+        fees = origin_fees(quote_request.starting_country)
+    if columns is None and len(boxes) < VECTORIZE_MIN_BOXES:
         weight_and_costs = [calculate_shipping_cost(
-            box, quote_request.starting_country, ) for box in quote_request.boxes]
+            box, quote_request.starting_country, fees) for box in boxes]
         weight_list, oversized_fee_list, overweight_fee_list = zip(
             *weight_and_costs)
-        total_shipping_weight = sum(weight_list)
-        total_oversized_fee = sum(oversized_fee_list)
-        total_overweight_fee = sum(overweight_fee_list)
-
-        shipping_rate = (
-            session.query(ShippingRate)
-            .filter(
-                ShippingRate.starting_country == quote_request.starting_country,
-                ShippingRate.destination_country == quote_request.destination_country,
-                ShippingRate.shipping_channel == "air"
-            )
-            .first()
-        )
-        # rates are min exclusive, max inclusive
-        per_kg_rate = (
-            session.query(Rate)
-            .filter(
-                Rate.shipping_rate_id == shipping_rate.id,
-                Rate.min_weight_kg < total_shipping_weight,
-                Rate.max_weight_kg >= total_shipping_weight
-            )
-            .first()
-        )
-
-        shipping_cost_air = total_shipping_weight * per_kg_rate.per_kg_rate
-
-        total_cost_air = shipping_cost_air + service_fee + \
-            total_overweight_fee + total_oversized_fee
-
-        shipping_time_range_air = ShippingTimeRange(
-            min_days=shipping_rate.min_days, max_days=shipping_rate.max_days)
-        cost_breakdown_air = CostBreakdown(
-            shipping_cost=shipping_cost_air,
-            service_fee=service_fee,
-            oversized_fee=total_oversized_fee,
-            overweight_fee=total_overweight_fee
-        )
-
-        quote = Quote(
-            shipping_channel="air",
-            total_cost=total_cost_air,
-            cost_breakdown=cost_breakdown_air,
-            shipping_time_range=shipping_time_range_air
-        )
-        quotes.append(quote)
-
-        # check ocean fare
-        shipping_rate_ocean = (
-            session.query(ShippingRate)
-            .filter(
-                ShippingRate.starting_country == quote_request.starting_country,
-                ShippingRate.destination_country == quote_request.destination_country,
-                ShippingRate.shipping_channel == "ocean"
-            )
-            .first()
-        )
-
-        per_kg_rate_ocean = (
-            session.query(Rate)
-            .filter(
-                Rate.shipping_rate_id == shipping_rate_ocean.id,
-                Rate.min_weight_kg < total_shipping_weight,
-                Rate.max_weight_kg >= total_shipping_weight
-            )
-            .first()
-        )
+        return sum(weight_list), sum(oversized_fee_list), sum(overweight_fee_list)
+
+    return box_engine.calculate_box_totals(*box_line_columns(quote_request), quote_request.starting_country, fees)
+
+
+def box_line_columns(quote_request: QuoteRequest) -> Tuple[List[int], List[float], List[float], List[float], List[float]]:
+    """Count, weight and dimensions of every box line: ``boxes`` first, then ``box_columns``."""
+    boxes = quote_request.boxes
+    columns = quote_request.box_columns
+    count = [box.count for box in boxes]
+    weight_kg = [box.weight_kg for box in boxes]
+    length = [box.length for box in boxes]
+    width = [box.width for box in boxes]
+    height = [box.height for box in boxes]
+    if columns is not None:
+        count += columns.count
+        weight_kg += columns.weight_kg
+        length += columns.length
+        width += columns.width
+        height += columns.height
+    return count, weight_kg, length, width, height
+
+
+def get_shipping_quotes(quote_request: QuoteRequest, rate_table: Optional[RateTable] = None) -> List[Quote]:
+    try:
+        with metrics.stage("rate_lookup"):
+            if rate_table is None:
+                rate_table = ensure_rate_table(get_rate_store())
+            lanes = rate_table.channels(
+                quote_request.starting_country, quote_request.destination_country)
+        return build_quotes(quote_request, lanes, rate_table.origin_fees(quote_request.starting_country))
+    except Exception as exc:
+        metrics.QUOTE_ERRORS.inc(type(exc).__name__)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def get_cached_shipping_quotes(quote_request: QuoteRequest, rate_table: RateTable) -> List[Quote]:
+    """``get_shipping_quotes`` behind the shared quote cache."""
+    return quote_cache.get_or_compute(
+        canonical_key(quote_request), rate_table.version,
+        lambda: get_shipping_quotes(quote_request, rate_table))
+
+
+def build_quotes(quote_request: QuoteRequest, lanes: List[LaneRates],
+                 fees: Optional[OriginFees] = None) -> List[Quote]:
+    """Quote every channel in ``lanes`` that has a tier for the shipment's weight."""
+    if fees is None:
+        fees = origin_fees(quote_request.starting_country)
+    with metrics.stage("box_fees"):
+        totals = calculate_box_totals(quote_request, fees)
+
+    quotes = price_lanes(quote_request.starting_country, totals, lanes, fees)
+    if not quotes:
+        raise ValueError("no channel has a rate for this shipment")
+    return quotes
+
+
+def price_lanes(starting_country: str, totals: Tuple[float, float, float],
+                lanes: Iterable[LaneRates], fees: Optional[OriginFees] = None) -> List[Quote]:
+    total_shipping_weight, total_oversized_fee, total_overweight_fee = totals
+    if fees is None:
+        fees = origin_fees(starting_country)
+    service_fee = fees.service_fee
+
+    with metrics.stage("rate_lookup"):
+        priced = []
+        for lane in lanes:
+            # rates are min exclusive, max inclusive; channels without a matching tier are skipped
+            per_kg_rate = lane.per_kg_rate(total_shipping_weight)
+            if per_kg_rate is None:
+                continue
 
-        if per_kg_rate_ocean:
-            shipping_cost_ocean = total_shipping_weight * per_kg_rate_ocean.per_kg_rate
-            total_cost_ocean = shipping_cost_ocean + service_fee + \
+            shipping_cost = total_shipping_weight * per_kg_rate
+            total_cost = shipping_cost + service_fee + \
                 total_overweight_fee + total_oversized_fee
-            shipping_time_range_ocean = ShippingTimeRange(
-                min_days=shipping_rate_ocean.min_days, max_days=shipping_rate_ocean.max_days)
-            cost_breakdown_ocean = CostBreakdown(
-                shipping_cost=shipping_cost_ocean,
-                service_fee=service_fee,
-                oversized_fee=total_oversized_fee,
-                overweight_fee=total_overweight_fee
-            )
-            quote_ocean = Quote(
-                shipping_channel="ocean",
-                total_cost=total_cost_ocean,
-                cost_breakdown=cost_breakdown_ocean,
-                shipping_time_range=shipping_time_range_ocean,
+            priced.append((lane, shipping_cost, total_cost))
+
+    with metrics.stage("response_model"):
+        # inputs are validated already, so skip validating the output again
+        return [
+            Quote.model_construct(
+                shipping_channel=lane.shipping_channel,
+                total_cost=total_cost,
+                cost_breakdown=CostBreakdown.model_construct(
+                    shipping_cost=shipping_cost,
+                    service_fee=service_fee,
+                    oversized_fee=total_oversized_fee,
+                    overweight_fee=total_overweight_fee
+                ),
+                shipping_time_range=ShippingTimeRange.model_construct(
+                    min_days=lane.min_days, max_days=lane.max_days),
             )
-            quotes.append(quote_ocean)
+            for lane, shipping_cost, total_cost in priced
+        ]
+
 
-        session.close()
+def quote_box_totals(starting_country: str, destination_country: str, totals: Tuple[float, float, float],
+                     rate_table: RateTable) -> List[Quote]:
+    """``get_shipping_quotes`` for box totals added up elsewhere, e.g. from a streamed manifest."""
+    try:
+        with metrics.stage("rate_lookup"):
+            lanes = rate_table.channels(starting_country, destination_country)
+        quotes = price_lanes(starting_country, totals, lanes, rate_table.origin_fees(starting_country))
+        if not quotes:
+            raise ValueError("no channel has a rate for this shipment")
         return quotes
-    except Exception:
+    except Exception as exc:
+        metrics.QUOTE_ERRORS.inc(type(exc).__name__)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def optimize_shipment(optimize_request: OptimizeRequest, rate_table: RateTable) -> ShipmentPlans:
+    """Cheapest split of the request's boxes over the route's channels, overall and within the transit limit."""
+    try:
+        lanes = rate_table.channels(optimize_request.starting_country, optimize_request.destination_country)
+        fees = rate_table.origin_fees(optimize_request.starting_country)
+        with metrics.stage("box_fees"):
+            totals = calculate_box_totals(optimize_request, fees)
+        time_budget_ms = min(optimize_request.time_budget_ms or optimizer.OPTIMIZER_TIME_BUDGET_MS,
+                             optimizer.OPTIMIZER_MAX_TIME_BUDGET_MS)
+        # every channel used is a shipment of its own, with its own service fee
+        cheapest, within_limit, complete = optimizer.plan_shipment(
+            *box_line_columns(optimize_request), optimize_request.starting_country, lanes, totals,
+            fees.service_fee,
+            optimize_request.max_transit_days, time_budget_ms)
+    except Exception as exc:
+        metrics.QUOTE_ERRORS.inc(type(exc).__name__)
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    if cheapest is None:
+        detail = "No channel quotes this shipment" if complete else "No plan found within the time budget"
+        raise HTTPException(status_code=404, detail=detail)
+    return ShipmentPlans(cheapest=cheapest, within_transit_limit=within_limit, complete=complete)
+
+
+def compare_shipping_quotes(compare_request: CompareRequest, rate_table: RateTable) -> List[LaneQuotes]:
+    """Quote every route matching the request, where either country may be left open.
+
+    Box totals depend on the origin's fee rules, so they are computed once per
+    origin and shared by all of its destinations. Routes that can't carry the
+    shipment are left out.
+    """
+    try:
+        results = []
+        totals_by_origin = {}
+        for starting_country, destination_country in rate_table.routes(
+                compare_request.starting_country, compare_request.destination_country):
+            fees = rate_table.origin_fees(starting_country)
+            totals = totals_by_origin.get(starting_country)
+            if totals is None:
+                origin_request = QuoteRequest(
+                    starting_country=starting_country, destination_country=destination_country,
+                    boxes=compare_request.boxes, box_columns=compare_request.box_columns)
+                with metrics.stage("box_fees"):
+                    totals = totals_by_origin[starting_country] = calculate_box_totals(origin_request, fees)
+            quotes = price_lanes(starting_country, totals,
+                                 rate_table.channels(starting_country, destination_country), fees)
+            if quotes:
+                results.append(LaneQuotes.model_construct(starting_country=starting_country,
+                                                          destination_country=destination_country,
+                                                          quotes=quotes))
+        return results
+    except Exception as exc:
+        metrics.QUOTE_ERRORS.inc(type(exc).__name__)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def iter_batch_quotes(quote_requests: Iterable[Union[QuoteRequest, Exception]],
+                      rate_table: Optional[RateTable] = None,
+                      window: int = BATCH_WINDOW) -> Iterator[dict]:
+    """Quote a stream of requests, yielding one result per request as it is done.
+
+    Requests are consumed ``window`` at a time and grouped by lane inside the
+    window, so every lane is resolved once per window and memory does not grow
+    with the size of the batch. Results carry the position of the request in
+    the batch because grouping changes the order they are produced in.
+    Items that are already an exception (e.g. failed validation) are reported
+    as errors in place.
+    """
+    if rate_table is None:
+        rate_table = ensure_rate_table(get_rate_store())
+    pending = []
+    for index, quote_request in enumerate(quote_requests):
+        pending.append((index, quote_request))
+        if len(pending) >= window:
+            yield from _quote_window(pending, rate_table)
+            pending = []
+    if pending:
+        yield from _quote_window(pending, rate_table)
+
+
+async def aiter_batch_quotes(quote_requests: AsyncIterable[Union[QuoteRequest, Exception]],
+                             rate_table: Optional[RateTable] = None,
+                             window: int = BATCH_WINDOW) -> AsyncIterator[dict]:
+    """Async counterpart of ``iter_batch_quotes`` for requests read off a socket."""
+    if rate_table is None:
+        rate_table = ensure_rate_table(get_rate_store())
+    pending = []
+    index = 0
+    async for quote_request in quote_requests:
+        pending.append((index, quote_request))
+        index += 1
+        if len(pending) >= window:
+            for result in _quote_window(pending, rate_table):
+                yield result
+            pending = []
+    for result in _quote_window(pending, rate_table):
+        yield result
+
+
+def _quote_window(pending: List[Tuple[int, Union[QuoteRequest, Exception]]], rate_table: RateTable) -> Iterator[dict]:
+    by_lane = {}
+    for index, quote_request in pending:
+        if isinstance(quote_request, Exception):
+            yield batch_error(index, quote_request)
+            continue
+        lane = (quote_request.starting_country, quote_request.destination_country)
+        by_lane.setdefault(lane, []).append((index, quote_request))
+
+    for (starting_country, destination_country), group in by_lane.items():
+        lanes = rate_table.channels(starting_country, destination_country)
+        fees = rate_table.origin_fees(starting_country)
+        for index, quote_request in group:
+            try:
+                quotes = build_quotes(quote_request, lanes, fees)
+            except Exception as exc:
+                yield batch_error(index, exc)
+                continue
+            yield {"index": index, "quotes": quotes}
+
+
+def batch_error(index: int, exc: Exception) -> dict:
+    if isinstance(exc, ValidationError):
+        return {"index": index, "status_code": 422,
+                "detail": exc.errors(include_url=False, include_context=False, include_input=False)}
+    if isinstance(exc, HTTPException):
+        return {"index": index, "status_code": exc.status_code, "detail": exc.detail}
+    return {"index": index, "status_code": 500, "detail": "Internal Server Error"}
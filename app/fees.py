@@ -0,0 +1,169 @@
+"""Fee rules, compiled per origin.
+
+``data/fee_rules.json`` lists the service, oversized and overweight fees
+and the origins they apply to. When a rate table is built, the rules that
+apply to each origin are compiled into an ``OriginFees``: a function
+pricing one box line and numpy masks pricing many. The work per box then
+depends only on that origin's rules, not on how many countries have rules.
+Every ``RateTable`` carries the ``FeeSchedule`` it was built with, so rule
+changes go live with a rate reload.
+"""
+import hashlib
+import json
+import operator
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pydantic import TypeAdapter
+
+from app.constants import (MAX_BOX_DIMENSION, MAX_BOX_DIMENSION_VIETNAM, MAX_BOX_WEIGHT, MAX_BOX_WEIGHT_INDIA,
+                           OVERSIZED_FEE, OVERWEIGHT_FEE, SERVICE_FEE_CHINA)
+from app.schemas import FeeRule
+
+FEE_RULES_PATH = os.getenv("FEE_RULES_PATH", "data/fee_rules.json")
+
+# the rules in effect when there is no rules file
+DEFAULT_FEE_RULES = [
+    {"name": "service_china", "fee": "service", "origins": ["China"], "amount": SERVICE_FEE_CHINA},
+    {"name": "overweight", "fee": "overweight", "field": "weight_kg", "op": ">", "threshold": MAX_BOX_WEIGHT,
+     "amount": OVERWEIGHT_FEE},
+    {"name": "oversized", "fee": "oversized", "field": "max_dimension", "op": ">", "threshold": MAX_BOX_DIMENSION,
+     "amount": OVERSIZED_FEE},
+    {"name": "overweight_india", "fee": "overweight", "origins": ["India"], "field": "weight_kg", "op": ">=",
+     "threshold": MAX_BOX_WEIGHT_INDIA, "amount": OVERWEIGHT_FEE, "overrides": ["overweight"]},
+    {"name": "oversized_vietnam", "fee": "oversized", "origins": ["Vietnam"], "field": "max_dimension", "op": ">",
+     "threshold": MAX_BOX_DIMENSION_VIETNAM, "amount": OVERSIZED_FEE},
+]
+
+_fee_rules = TypeAdapter(List[FeeRule])
+_TESTS = {">": operator.gt, ">=": operator.ge}
+_FIELDS = ("weight_kg", "max_dimension")
+# box fees, in the order they are returned
+_BOX_FEES = ("oversized", "overweight")
+
+
+class OriginFees:
+    """The fee rules of one origin, ready to apply."""
+
+    __slots__ = ("service_fee", "rules", "box_fees")
+
+    def __init__(self, rules: Iterable[FeeRule]):
+        rules = list(rules)
+        self.service_fee = 0.0
+        for rule in rules:
+            if rule.fee == "service":
+                self.service_fee += rule.amount
+
+        box_rules = [rule for rule in rules if rule.fee != "service"]
+        # (fee index, field index, test, threshold, amount, indexes of the rules overriding this one)
+        self.rules = tuple(
+            (_BOX_FEES.index(rule.fee), _FIELDS.index(rule.field), _TESTS[rule.op], rule.threshold, rule.amount,
+             tuple(index for index, other in enumerate(box_rules) if rule.name in other.overrides))
+            for rule in box_rules
+        )
+        self.box_fees = self._compile_box_fees()
+
+    def _compile_box_fees(self):
+        rules = self.rules
+
+        if not any(overridden_by for *_, overridden_by in rules):
+            def box_fees(weight_kg: float, max_dimension: float, count: int) -> Tuple[float, float]:
+                values = (weight_kg, max_dimension)
+                fees = [0.0, 0.0]
+                for fee, field, test, threshold, amount, _ in rules:
+                    if test(values[field], threshold):
+                        fees[fee] += amount * count
+                return fees[0], fees[1]
+            return box_fees
+
+        def box_fees(weight_kg: float, max_dimension: float, count: int) -> Tuple[float, float]:
+            values = (weight_kg, max_dimension)
+            hits = [test(values[field], threshold) for _, field, test, threshold, _, _ in rules]
+            fees = [0.0, 0.0]
+            for (fee, _, _, _, amount, overridden_by), hit in zip(rules, hits):
+                if hit and not any(hits[index] for index in overridden_by):
+                    fees[fee] += amount * count
+            return fees[0], fees[1]
+        return box_fees
+
+    def line_fees(self, count: np.ndarray, weight_kg: np.ndarray,
+                  max_dimension: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """``box_fees`` for every box line at once; ``count`` is a float array.
+
+        Fees are added up in the same order as ``box_fees`` so every element
+        is bit-for-bit identical to it.
+        """
+        values = (weight_kg, max_dimension)
+        hits = [test(values[field], threshold) for _, field, test, threshold, _, _ in self.rules]
+        fees = [np.zeros(count.shape), np.zeros(count.shape)]
+        for (fee, _, _, _, amount, overridden_by), hit in zip(self.rules, hits):
+            for index in overridden_by:
+                hit = hit & ~hits[index]
+            fees[fee] = fees[fee] + np.where(hit, amount * count, 0.0)
+        return fees[0], fees[1]
+
+
+class FeeSchedule:
+    """Fee rules compiled for every origin they name, plus the rules of all other origins."""
+
+    def __init__(self, rules: Iterable[FeeRule], content_hash: Optional[str] = None):
+        rules = list(rules)
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError("fee rule names must be unique")
+        for rule in rules:
+            unknown = set(rule.overrides) - set(names)
+            if unknown:
+                raise ValueError(f"fee rule {rule.name!r} overrides unknown rules {sorted(unknown)}")
+
+        self.rules = rules
+        self.content_hash = content_hash
+        self._default = OriginFees(rule for rule in rules if rule.origins is None)
+        self._origins: Dict[str, OriginFees] = {
+            origin: OriginFees(rule for rule in rules if rule.origins is None or origin in rule.origins)
+            for origin in sorted({origin for rule in rules for origin in rule.origins or ()})
+        }
+
+    def for_origin(self, starting_country: str) -> OriginFees:
+        return self._origins.get(starting_country, self._default)
+
+
+def parse_fee_rules(raw: bytes, content_hash: Optional[str] = None) -> FeeSchedule:
+    """Validate and compile fee rules; raises ``ValueError`` if they are malformed.
+
+    ``content_hash`` defaults to the hash of ``raw``.
+    """
+    if content_hash is None:
+        content_hash = hashlib.sha256(raw).hexdigest()
+    return FeeSchedule(_fee_rules.validate_json(raw), content_hash)
+
+
+def dump_fee_rules(schedule: FeeSchedule) -> bytes:
+    return _fee_rules.dump_json(schedule.rules)
+
+
+_loaded: Dict[str, Tuple[Optional[Tuple[int, int]], FeeSchedule]] = {}
+
+
+def load_fee_schedule(path: str = FEE_RULES_PATH) -> FeeSchedule:
+    """The compiled rules in ``path``, compiled again only when the file changes.
+
+    Without the file, ``DEFAULT_FEE_RULES`` apply.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        state = None
+    else:
+        state = (stat.st_mtime_ns, stat.st_size)
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    if state is None:
+        schedule = parse_fee_rules(json.dumps(DEFAULT_FEE_RULES).encode())
+    else:
+        with open(path, "rb") as rules_file:
+            schedule = parse_fee_rules(rules_file.read())
+    _loaded[path] = (state, schedule)
+    return schedule
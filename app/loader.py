@@ -0,0 +1,223 @@
+"""Idempotent bulk loader for the rate sheet.
+
+Only one process loads at a time: on Postgres the load runs under a
+transaction-scoped advisory lock, elsewhere under a file lock. Schema
+migrations (``app.migrations``) are applied under the same lock. Processes
+that were waiting find the content hash already stored and skip the load.
+A load can also be told to leave a sheet stored after a given time in
+place, so a restart does not put the rate file back over a sheet uploaded
+through the admin API since the file last changed.
+The sheet is replaced in a single transaction, using COPY when the driver
+supports it and batched multi-row inserts otherwise.
+
+Usage: python -m app.loader [path] [--force] [--database-url URL]
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from sqlalchemy import create_engine, delete, insert, select, text, update
+from sqlalchemy.engine import Connection, Engine
+
+from app.models import Base, RateSheetMeta, ShippingRate, Rate
+from app.migrations import migrate
+
+RATES_PATH = "data/rates (1).json"
+# arbitrary, but fixed: every process must agree on it
+ADVISORY_LOCK_KEY = 7305416309
+INSERT_BATCH_SIZE = 5000
+META_ID = 1
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as rate_file:
+        for chunk in iter(lambda: rate_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_rate_sheet(path: str) -> List[dict]:
+    """The rate sheet in the JSON file at ``path``, unvalidated."""
+    with open(path, "r") as json_file:
+        return json.load(json_file)
+
+
+def flatten_rate_sheet(data: Iterable[dict]):
+    """Split a rate sheet into ``shipping_rates`` and ``rates`` rows with ids assigned."""
+    shipping_rates = []
+    rates = []
+    for shipping_rate_id, item in enumerate(data, start=1):
+        shipping_rates.append({
+            "id": shipping_rate_id,
+            "starting_country": item["starting_country"],
+            "destination_country": item["destination_country"],
+            "shipping_channel": item["shipping_channel"],
+            "min_days": item["shipping_time_range"]["min_days"],
+            "max_days": item["shipping_time_range"]["max_days"],
+        })
+        for rate_data in item["rates"]:
+            rates.append({
+                "id": len(rates) + 1,
+                "min_weight_kg": rate_data["min_weight_kg"],
+                "max_weight_kg": rate_data["max_weight_kg"],
+                "per_kg_rate": rate_data["per_kg_rate"],
+                "shipping_rate_id": shipping_rate_id,
+            })
+    return shipping_rates, rates
+
+
+@contextmanager
+def _file_lock(name: str):
+    import fcntl
+
+    lock_path = os.path.join(tempfile.gettempdir(), name)
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def _no_lock():
+    yield
+
+
+def _acquire_lock(conn: Connection) -> None:
+    # released automatically when the transaction ends
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+
+
+def _copy_rows(conn: Connection, table, rows: List[dict]) -> bool:
+    """COPY rows in through the raw driver connection; False if the driver can't."""
+    if not rows:
+        return True
+    columns = list(rows[0])
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([row[column] for column in columns] for row in rows)
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            return True
+        if hasattr(cursor, "copy"):  # psycopg 3
+            with cursor.copy(statement.replace("WITH (FORMAT csv)", "")) as copy:
+                for row in rows:
+                    copy.write_row([row[column] for column in columns])
+            return True
+        return False
+    finally:
+        cursor.close()
+
+
+def _insert_rows(conn: Connection, table, rows: Sequence[dict], batch_size: int) -> None:
+    for start in range(0, len(rows), batch_size):
+        conn.execute(insert(table), rows[start:start + batch_size])
+
+
+def _replace_rows(conn: Connection, shipping_rates: List[dict], rates: List[dict], batch_size: int) -> None:
+    conn.execute(delete(Rate))
+    conn.execute(delete(ShippingRate))
+    postgres = conn.dialect.name == "postgresql"
+    for table, rows in ((ShippingRate.__table__, shipping_rates), (Rate.__table__, rates)):
+        if not (postgres and _copy_rows(conn, table, rows)):
+            _insert_rows(conn, table, rows, batch_size)
+        if postgres:
+            # ids were assigned here, move the serial sequence past them
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"GREATEST((SELECT MAX(id) FROM {table.name}), 1))"))
+
+
+def content_hash_bytes(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def stored_content_hash(conn: Connection) -> Optional[str]:
+    return conn.execute(
+        select(RateSheetMeta.content_hash).where(RateSheetMeta.id == META_ID)).scalar()
+
+
+def file_modified_at(path: str) -> datetime:
+    """Last modification of ``path``, as naive UTC like ``RateSheetMeta.loaded_at``."""
+    return datetime.fromtimestamp(os.stat(path).st_mtime, timezone.utc).replace(tzinfo=None)
+
+
+def load_rate_sheet(engine: Engine, path: str = RATES_PATH, force: bool = False,
+                    batch_size: int = INSERT_BATCH_SIZE, keep_newer: bool = False) -> bool:
+    """Load ``path`` into the database unless it is already loaded.
+
+    Returns True if the tables were (re)loaded, False if the stored content
+    hash already matched. With ``keep_newer``, a sheet stored after ``path``
+    was last modified (e.g. one uploaded through the admin API) is kept too.
+    """
+    return load_rate_data(engine, lambda: read_rate_sheet(path), content_hash(path),
+                          os.path.basename(path), force=force, batch_size=batch_size,
+                          loaded_before=file_modified_at(path) if keep_newer else None)
+
+
+def load_rate_data(engine: Engine, data: Callable[[], List[dict]], sheet_hash: str, source: str,
+                   force: bool = False, batch_size: int = INSERT_BATCH_SIZE,
+                   loaded_before: Optional[datetime] = None) -> bool:
+    """``load_rate_sheet`` for a sheet that is already in memory.
+
+    ``data`` is only called when the load is not skipped. Unless ``force``, a
+    stored sheet loaded at or after ``loaded_before`` is left in place.
+    """
+    postgres = engine.dialect.name == "postgresql"
+
+    lock = _file_lock("shipping-rates-load.lock") if not postgres else _no_lock()
+    with lock, engine.begin() as conn:
+        if postgres:
+            _acquire_lock(conn)
+        Base.metadata.create_all(conn)
+        migrate(conn)
+
+        stored_hash, stored_at = conn.execute(
+            select(RateSheetMeta.content_hash, RateSheetMeta.loaded_at)
+            .where(RateSheetMeta.id == META_ID)).first() or (None, None)
+        if not force and (stored_hash == sheet_hash or (
+                loaded_before is not None and stored_at is not None and stored_at >= loaded_before)):
+            return False
+
+        shipping_rates, rates = flatten_rate_sheet(data())
+        _replace_rows(conn, shipping_rates, rates, batch_size)
+
+        values = {"content_hash": sheet_hash, "source": source,
+                  "loaded_at": datetime.now(timezone.utc).replace(tzinfo=None)}
+        if stored_hash is None:
+            conn.execute(insert(RateSheetMeta).values(id=META_ID, **values))
+        else:
+            conn.execute(update(RateSheetMeta).where(RateSheetMeta.id == META_ID).values(**values))
+        return True
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    from app.database import DATABASE_URL
+
+    parser = argparse.ArgumentParser(description="Load a rate sheet into the database.")
+    parser.add_argument("path", nargs="?", default=RATES_PATH)
+    parser.add_argument("--force", action="store_true", help="reload even if the content hash matches")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--batch-size", type=int, default=INSERT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.database_url)
+    loaded = load_rate_sheet(engine, args.path, force=args.force, batch_size=args.batch_size)
+    print(f"Loaded {args.path}" if loaded else f"{args.path} is already loaded, skipping")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Streamed packing manifests: box lines as CSV or NDJSON, totalled in one pass.
+
+A manifest can have hundreds of thousands of box lines, so lines are
+validated one at a time as they arrive, and the lines are priced with
+``box_engine`` a window at a time. Only the window and the running
+totals are kept, so memory stays flat whatever the size of the
+manifest. Each window is summed on top of the running totals with the
+builtin ``sum``, which gives the totals ``/v1/quotes`` computes for the
+same boxes (bit for bit before python 3.12, where ``sum`` started
+compensating rounding errors).
+
+CSV manifests start with a header naming the ``count``, ``weight_kg``,
+``length``, ``width`` and ``height`` columns, in any order; other columns
+are ignored. NDJSON manifests have one ``Box`` object per line.
+"""
+import csv
+import hashlib
+from typing import AsyncIterable, AsyncIterator, List, Optional, Tuple
+
+import numpy as np
+from pydantic import ValidationError
+
+from app import box_engine
+from app.fees import OriginFees
+from app.schemas import Box, ManifestQuoteRequest
+from app.streaming import aiter_lines
+
+BOX_FIELDS = ("count", "weight_kg", "length", "width", "height")
+# box lines priced at once
+MANIFEST_WINDOW = 4096
+# a manifest with this many invalid lines stops being read
+MANIFEST_MAX_ERRORS = 100
+
+
+class ManifestTotals:
+    """Running chargeable weight and box fees of the lines added so far, and a digest of the manifest read."""
+
+    def __init__(self, starting_country: str, fees: OriginFees, window: int = MANIFEST_WINDOW):
+        self.starting_country = starting_country
+        self.fees = fees
+        self.window = window
+        self.box_lines = 0
+        self._columns: Tuple[List, ...] = tuple([] for _ in BOX_FIELDS)
+        self._totals = [0, 0, 0]
+        self.digest = hashlib.sha256()
+
+    def add(self, box: Box) -> None:
+        for column, field in zip(self._columns, BOX_FIELDS):
+            column.append(getattr(box, field))
+        self.box_lines += 1
+        if len(self._columns[0]) >= self.window:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._columns[0]:
+            return
+        count, weight_kg, length, width, height = self._columns
+        line_costs = box_engine.calculate_box_line_costs(
+            np.asarray(count, dtype=np.int64),
+            np.asarray(weight_kg, dtype=np.float64),
+            np.asarray(length, dtype=np.float64),
+            np.asarray(width, dtype=np.float64),
+            np.asarray(height, dtype=np.float64),
+            self.starting_country,
+            self.fees,
+        )
+        # continue the same left to right sum calculate_box_totals does over all lines
+        self._totals = [sum(values.tolist(), total) for values, total in zip(line_costs, self._totals)]
+        for column in self._columns:
+            column.clear()
+
+    def totals(self) -> Tuple[float, float, float]:
+        """Total chargeable weight, oversized fee and overweight fee, as ``calculate_box_totals`` returns them."""
+        self._flush()
+        if not self.box_lines:
+            raise ValueError("a quote needs at least one box")
+        return tuple(self._totals)
+
+    def audit_request(self, destination_country: str) -> ManifestQuoteRequest:
+        """The request to log for the quotes of these totals."""
+        chargeable_weight_kg, oversized_fee, overweight_fee = self.totals()
+        return ManifestQuoteRequest(
+            starting_country=self.starting_country, destination_country=destination_country,
+            manifest_sha256=self.digest.hexdigest(), box_lines=self.box_lines,
+            chargeable_weight_kg=chargeable_weight_kg, oversized_fee=oversized_fee, overweight_fee=overweight_fee)
+
+
+def _line_errors(line_number: int, exc: ValidationError) -> List[dict]:
+    return [{"loc": ["body", "line", line_number, *error["loc"]], "msg": error["msg"], "type": error["type"]}
+            for error in exc.errors(include_url=False, include_context=False, include_input=False)]
+
+
+async def _digested(chunks: AsyncIterable[bytes], digest) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def _csv_row(line: bytes) -> List[str]:
+    return next(csv.reader([line.decode("utf-8-sig")]))
+
+
+async def read_manifest(chunks: AsyncIterable[bytes], is_csv: bool, totals: ManifestTotals) -> List[dict]:
+    """Validate the manifest in ``chunks`` and add its boxes to ``totals``.
+
+    Returns validation errors in FastAPI's format, with the manifest line in
+    ``loc``; reading stops after ``MANIFEST_MAX_ERRORS`` of them.
+    """
+    errors: List[dict] = []
+    columns: Optional[List[int]] = None
+    async for line_number, line in aiter_lines(_digested(chunks, totals.digest)):
+        try:
+            if not is_csv:
+                box = Box.model_validate_json(line)
+            elif columns is None:
+                header = [name.strip() for name in _csv_row(line)]
+                missing = [field for field in BOX_FIELDS if field not in header]
+                if missing:
+                    errors.append({"loc": ["body", "line", line_number], "type": "missing",
+                                   "msg": f"CSV header is missing {', '.join(missing)}"})
+                    break
+                columns = [header.index(field) for field in BOX_FIELDS]
+                continue
+            else:
+                row = _csv_row(line)
+                box = Box.model_validate({field: row[index] if index < len(row) else None
+                                          for field, index in zip(BOX_FIELDS, columns)})
+        except ValidationError as exc:
+            errors.extend(_line_errors(line_number, exc))
+        except (UnicodeDecodeError, csv.Error) as exc:
+            errors.append({"loc": ["body", "line", line_number], "msg": str(exc), "type": "value_error"})
+        else:
+            if not errors:
+                totals.add(box)
+            continue
+        if len(errors) >= MANIFEST_MAX_ERRORS:
+            break
+    if not errors and not totals.box_lines:
+        errors.append({"loc": ["body"], "msg": "manifest has no box lines", "type": "missing"})
+    return errors
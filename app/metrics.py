@@ -0,0 +1,225 @@
+"""In-process request metrics rendered in the Prometheus text format.
+
+Each HTTP request gets a ``RequestTimings`` in a context variable. Code on
+the quote path times its stages with ``stage(...)``, database queries are
+counted through SQLAlchemy cursor events, and ``MetricsMiddleware`` turns
+it all into histograms once the response has been sent. Outside a request
+``stage`` costs one context variable lookup.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestTimings:
+    __slots__ = ("started_at", "stages", "db_queries", "lane", "handler_done_at")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.db_queries = 0
+        self.lane: Optional[str] = None
+        self.handler_done_at: Optional[float] = None
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.stages[name] = timings.stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def record_since_start(name: str) -> None:
+    """Record the time from the start of the request until now as stage ``name``."""
+    timings = _current.get()
+    if timings is not None:
+        timings.stages[name] = time.perf_counter() - timings.started_at
+
+
+def handler_done() -> None:
+    """Mark the end of the handler; the rest until the response starts is serialization."""
+    timings = _current.get()
+    if timings is not None:
+        timings.handler_done_at = time.perf_counter()
+
+
+def set_lane(rate_table, starting_country: str, destination_country: str) -> None:
+    """Label the request with its route; routes ``rate_table`` doesn't have share ``UNKNOWN_LANE``.
+
+    The countries come from the client, so only real routes get a series of their own.
+    """
+    timings = _current.get()
+    if timings is not None:
+        if rate_table.channels(starting_country, destination_country):
+            timings.lane = f"{starting_country}->{destination_country}"
+        else:
+            timings.lane = UNKNOWN_LANE
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # one slot per bucket, then +Inf, sum and count
+                series = self._series[labelvalues] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labelvalues, list(values)) for labelvalues, values in self._series.items()]
+        for labelvalues, values in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), values):
+                cumulative += bucket_count
+                le = '"+Inf"' if bound == float("inf") else f'"{bound!r}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labelvalues, 'le=' + le)} {int(cumulative)}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {values[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labelvalues)} {int(values[-1])}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {value}"
+
+
+REQUEST_SECONDS = Histogram(
+    "shipping_request_seconds", "Time to handle an HTTP request.", ("route", "method", "status"))
+STAGE_SECONDS = Histogram(
+    "shipping_request_stage_seconds", "Time spent in each stage of a request.", ("route", "stage"))
+# lane label of quote requests for a route the rate table doesn't have
+UNKNOWN_LANE = "unknown"
+LANE_SECONDS = Histogram(
+    "shipping_quote_lane_seconds", "Time to handle a quote request, per lane.", ("lane",))
+DB_QUERIES = Histogram(
+    "shipping_db_queries_per_request", "Database queries issued per request.", ("route",), COUNT_BUCKETS)
+DB_QUERIES_TOTAL = Counter("shipping_db_queries_total", "Database queries issued.")
+QUOTE_ERRORS = Counter("shipping_quote_errors_total", "Quote computations that failed, by exception.",
+                       ("exception",))
+QUOTE_AUDIT_ENTRIES = Counter("shipping_quote_audit_entries_total",
+                              "Quote audit log entries by outcome (written, dropped, failed).", ("outcome",))
+DB_READ_FAILOVERS = Counter("shipping_db_read_failovers_total",
+                            "Rate reads that failed on a replica and moved on, by replica.", ("replica",))
+
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, LANE_SECONDS, DB_QUERIES, DB_QUERIES_TOTAL, QUOTE_ERRORS,
+            QUOTE_AUDIT_ENTRIES, DB_READ_FAILOVERS]
+
+
+def render(extra_lines: Iterable[str] = ()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+def _count_query(*_):
+    DB_QUERIES_TOTAL.inc()
+    timings = _current.get()
+    if timings is not None:
+        timings.db_queries += 1
+
+
+def instrument_engine(engine) -> None:
+    """Count the queries run through ``engine`` (sync, or the sync side of an async engine)."""
+    event.listen(getattr(engine, "sync_engine", engine), "before_cursor_execute", _count_query)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request, stage, lane and query count metrics."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+                if timings.handler_done_at is not None:
+                    timings.stages["serialize"] = time.perf_counter() - timings.handler_done_at
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - timings.started_at
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(elapsed, path, scope["method"], status[0])
+            for name, seconds in timings.stages.items():
+                STAGE_SECONDS.observe(seconds, path, name)
+            if timings.lane is not None:
+                LANE_SECONDS.observe(elapsed, timings.lane)
+            DB_QUERIES.observe(timings.db_queries, path)
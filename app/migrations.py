@@ -0,0 +1,87 @@
+"""Schema changes for databases created by earlier versions.
+
+``Base.metadata.create_all`` creates missing tables with their indexes but
+leaves existing tables alone, so changes to existing tables are made here.
+Migrations run in order, each once, and are recorded in
+``schema_migrations``. The loader runs them right after ``create_all``,
+under its load lock and in the same transaction; they can also be run by
+hand:
+
+    python -m app.migrations [--database-url URL]
+"""
+import argparse
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.engine import Connection
+
+from app.models import Rate, SchemaMigration, ShippingRate
+
+TIER_OVERLAP_CONSTRAINT = "rates_tiers_do_not_overlap"
+
+
+def _lane_and_tier_indexes(conn: Connection) -> None:
+    # ix_shipping_rates_lane and ix_rates_shipping_rate_id
+    for index in list(ShippingRate.__table__.indexes) + list(Rate.__table__.indexes):
+        index.create(conn, checkfirst=True)
+
+
+def _tier_ranges(conn: Connection) -> None:
+    if conn.dialect.name != "postgresql":
+        return
+    # lets the GiST index compare shipping_rate_id with =
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+    # a range over float8 compares weights exactly like LaneRates.per_kg_rate; float8 -> numeric rounds
+    # to 15 digits, so a numrange could pick a different tier near a bound
+    conn.execute(text(
+        "DO $$ BEGIN CREATE TYPE float8range AS RANGE (subtype = float8, subtype_diff = float8mi); "
+        "EXCEPTION WHEN duplicate_object THEN NULL; END $$"))
+    # tiers are min exclusive, max inclusive
+    conn.execute(text(
+        "ALTER TABLE rates ADD COLUMN IF NOT EXISTS weight_range float8range "
+        "GENERATED ALWAYS AS (float8range(min_weight_kg, max_weight_kg, '(]')) STORED"))
+    conn.execute(text(
+        f"ALTER TABLE rates ADD CONSTRAINT {TIER_OVERLAP_CONSTRAINT} "
+        "EXCLUDE USING gist (shipping_rate_id WITH =, weight_range WITH &&)"))
+
+
+# (version, description, migration); append only
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "composite lane index and rates.shipping_rate_id index", _lane_and_tier_indexes),
+    (2, "rates.weight_range float8range with a GiST exclusion constraint against overlapping tiers", _tier_ranges),
+]
+
+
+def migrate(conn: Connection) -> List[int]:
+    """Apply the migrations this database doesn't have yet; returns their versions."""
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+    done = []
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration(conn)
+        conn.execute(insert(SchemaMigration).values(
+            version=version, description=description,
+            applied_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+        done.append(version)
+    return done
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    from app.database import DATABASE_URL
+    from app.models import Base
+
+    parser = argparse.ArgumentParser(description="Bring the database schema up to date.")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    with create_engine(args.database_url).begin() as conn:
+        Base.metadata.create_all(conn)
+        done = migrate(conn)
+    print(f"Applied migrations {done}" if done else "Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -7,6 +7,11 @@ Base = declarative_base()
 
 class ShippingRate(Base):
     __tablename__ = "shipping_rates"
+    # lanes are looked up by all three together
+    __table_args__ = (
+        Index("ix_shipping_rates_lane", "starting_country", "destination_country", "shipping_channel",
+              unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     starting_country = Column(String, index=True)
@@ -20,6 +25,8 @@ class ShippingRate(Base):
 
 class Rate(Base):
     __tablename__ = "rates"
+    # on Postgres, app.migrations adds weight_range, a float8range (min_weight_kg, max_weight_kg]
+    # generated from the bounds, and an exclusion constraint keeping a lane's tiers from overlapping
 
     id = Column(Integer, primary_key=True, index=True)
     min_weight_kg = Column(Float)
@@ -27,10 +34,42 @@ class Rate(Base):
     per_kg_rate = Column(Float)
 
     # Define the foreign key relationship to the 'ShippingRate' model
-    shipping_rate_id = Column(Integer, ForeignKey("shipping_rates.id"))
+    shipping_rate_id = Column(Integer, ForeignKey("shipping_rates.id"), index=True)
 
     # Define the relationship back to the 'ShippingRate' model
     shipping_rate = relationship("ShippingRate", back_populates="rates")
 
 
+class RateSheetMeta(Base):
+    __tablename__ = "rate_sheet_meta"
+
+    # single row describing the rate sheet currently loaded
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String, nullable=False)
+    source = Column(String)
+    loaded_at = Column(DateTime)
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    # one row per migration in app.migrations applied to this database
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime)
+
+
+class QuoteAudit(Base):
+    __tablename__ = "quote_audit"
+
+    # append-only record of every quote handed out, written by app.audit
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, index=True)
+    starting_country = Column(String)
+    destination_country = Column(String)
+    rate_version = Column(String)
+    request = Column(JSON)
+    quotes = Column(JSON)
+
+
 __all__ = [Base]
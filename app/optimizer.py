@@ -0,0 +1,243 @@
+"""Cheapest way to split a shipment's boxes over the channels of a route.
+
+Per kg rates drop as the chargeable weight of a channel goes up, so
+sending part of a shipment by ocean can push the rest into a cheaper air
+tier, or the other way around. Box fees don't depend on the channel, but
+every channel used is its own shipment with its own service fee.
+
+The search is a subset-sum dynamic program over a weight grid: box lines
+are split into chunks of 1, 2, 4, ... boxes (so any count of a line can be
+picked), and a boolean array records which grid weights a subset of chunks
+can reach. The reachable weights don't depend on the channels, so the
+program runs once and every pair of channels is priced over all reachable
+splits at once with ``LaneRates.costs_at``. The most promising splits are
+then rebuilt from the program's history and priced exactly, which keeps
+the answer right at tier boundaries the grid can't resolve. Plans use at
+most two channels.
+"""
+import os
+import time
+from itertools import combinations
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app import box_engine
+from app.rate_engine import LaneRates
+from app.schemas import BoxAllocation, ChannelAllocation, ShipmentPlan, ShippingTimeRange
+
+OPTIMIZER_GRID_CELLS = int(os.getenv("OPTIMIZER_GRID_CELLS", "4096"))
+OPTIMIZER_TIME_BUDGET_MS = float(os.getenv("OPTIMIZER_TIME_BUDGET_MS", "200"))
+# longest budget a request may ask for; larger time_budget_ms values are lowered to it
+OPTIMIZER_MAX_TIME_BUDGET_MS = float(os.getenv("OPTIMIZER_MAX_TIME_BUDGET_MS", "1000"))
+# upper bound on the size of the program's history (chunks x grid cells)
+OPTIMIZER_MAX_HISTORY = 50_000_000
+# splits per channel pair priced exactly after the grid search
+OPTIMIZER_CANDIDATES = 16
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def _check_deadline(deadline: float) -> None:
+    if time.perf_counter() > deadline:
+        raise BudgetExceeded()
+
+
+def chunk_box_lines(count: Sequence[int], weight_kg: Sequence[float], length: Sequence[float],
+                    width: Sequence[float], height: Sequence[float],
+                    starting_country: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split every box line into chunks of 1, 2, 4, ... boxes plus a remainder.
+
+    Returns the line of each chunk, its box count and its chargeable weight.
+    Any number of boxes of a line is the sum of some of its chunks.
+    """
+    count = np.asarray(count, dtype=np.int64)
+    # a line of n boxes has the powers of two below the bit length of n + 1, then what is left over
+    powers = np.frexp((count + 1).astype(np.float64))[1].astype(np.int64) - 1
+    remainder = count - ((np.int64(1) << powers) - 1)
+    per_line = powers + (remainder > 0)
+    lines = np.repeat(np.arange(len(count), dtype=np.int64), per_line)
+    position = np.arange(len(lines), dtype=np.int64) - np.repeat(np.cumsum(per_line) - per_line, per_line)
+    sizes = np.where(position < powers[lines], np.int64(1) << position, remainder[lines])
+    weights, _, _ = box_engine.calculate_box_line_costs(
+        sizes,
+        np.asarray(weight_kg, dtype=np.float64)[lines],
+        np.asarray(length, dtype=np.float64)[lines],
+        np.asarray(width, dtype=np.float64)[lines],
+        np.asarray(height, dtype=np.float64)[lines],
+        starting_country,
+    )
+    return lines, sizes, weights
+
+
+class SubsetSums:
+    """Grid weights reachable by a subset of the chunks, and how to reach them."""
+
+    def __init__(self, weights: np.ndarray, total_weight: float, deadline: float,
+                 cells: int = OPTIMIZER_GRID_CELLS):
+        step = max(total_weight / cells, total_weight * len(weights) / OPTIMIZER_MAX_HISTORY, 1e-9)
+        self.step = step
+        self.deadline = deadline
+        self.units = np.rint(weights / step).astype(np.int64)
+        size = int(self.units.sum()) + 1
+        # row j: weights reachable with the first j chunks
+        self.history = np.zeros((len(weights) + 1, size), dtype=bool)
+        self.history[0, 0] = True
+        for index, unit in enumerate(self.units.tolist()):
+            _check_deadline(deadline)
+            previous, current = self.history[index], self.history[index + 1]
+            current[:] = previous
+            if unit:
+                current[unit:] |= previous[:-unit]
+        self.reachable = np.flatnonzero(self.history[-1])
+
+    def subset(self, target: int) -> np.ndarray:
+        """Mask of chunks adding up to grid weight ``target``."""
+        taken = np.zeros(len(self.units), dtype=bool)
+        units = self.units.tolist()
+        for index in range(len(units) - 1, -1, -1):
+            if not index & 1023:
+                _check_deadline(self.deadline)
+            if not self.history[index, target]:
+                taken[index] = True
+                target -= units[index]
+        return taken
+
+
+class _Part(NamedTuple):
+    """The boxes one channel carries: chunk (or line) ``lines`` with ``sizes`` boxes each."""
+    lane: LaneRates
+    weight: float
+    per_kg_rate: float
+    lines: np.ndarray
+    sizes: np.ndarray
+
+
+class _Plan(NamedTuple):
+    total_cost: float
+    max_days: int
+    parts: Tuple[_Part, ...]
+
+
+def _part(lane: LaneRates, weight: float, lines: np.ndarray, sizes: np.ndarray) -> Optional[_Part]:
+    per_kg_rate = lane.per_kg_rate(weight)
+    if per_kg_rate is None:
+        return None
+    return _Part(lane, weight, per_kg_rate, lines, sizes)
+
+
+def _priced(parts: Tuple[_Part, ...], service_fee: float, oversized_fee: float, overweight_fee: float) -> _Plan:
+    return _Plan(
+        total_cost=sum(part.weight * part.per_kg_rate + service_fee for part in parts)
+        + overweight_fee + oversized_fee,
+        max_days=max(part.lane.max_days for part in parts),
+        parts=parts,
+    )
+
+
+def _allocation(part: _Part, service_fee: float) -> ChannelAllocation:
+    lane = part.lane
+    counts = (np.bincount(part.lines, weights=part.sizes).astype(np.int64) if len(part.lines)
+              else np.zeros(0, np.int64))
+    return ChannelAllocation(
+        shipping_channel=lane.shipping_channel,
+        chargeable_weight_kg=part.weight,
+        per_kg_rate=part.per_kg_rate,
+        shipping_cost=part.weight * part.per_kg_rate,
+        service_fee=service_fee,
+        shipping_time_range=ShippingTimeRange(min_days=lane.min_days, max_days=lane.max_days),
+        boxes=[BoxAllocation(line=line, count=int(counts[line])) for line in np.flatnonzero(counts).tolist()],
+    )
+
+
+def _shipment_plan(plan: _Plan, service_fee: float, oversized_fee: float,
+                   overweight_fee: float) -> ShipmentPlan:
+    return ShipmentPlan(
+        total_cost=plan.total_cost,
+        oversized_fee=oversized_fee,
+        overweight_fee=overweight_fee,
+        max_days=plan.max_days,
+        allocations=[_allocation(part, service_fee) for part in plan.parts],
+    )
+
+
+def _add_splits(plans: List[_Plan], sums: SubsetSums, first: LaneRates, second: LaneRates, lines: np.ndarray,
+                sizes: np.ndarray, weights: np.ndarray, total_weight: float, service_fee: float,
+                oversized_fee: float, overweight_fee: float) -> None:
+    """Price the most promising splits between two channels exactly and add them to ``plans``."""
+    first_weights = sums.reachable * sums.step
+    costs = first.costs_at(first_weights) + second.costs_at(total_weight - first_weights)
+    costs[np.isnan(costs)] = np.inf
+    count = min(OPTIMIZER_CANDIDATES, len(costs))
+    candidates = np.argpartition(costs, count - 1)[:count]
+    # cheapest on the grid first, in case the budget runs out part way
+    candidates = candidates[np.argsort(costs[candidates], kind="stable")]
+
+    for candidate in candidates.tolist():
+        _check_deadline(sums.deadline)
+        if costs[candidate] == np.inf:
+            break
+        taken = sums.subset(int(sums.reachable[candidate]))
+        if taken.all() or not taken.any():
+            continue
+        parts = []
+        for lane, mask in ((first, taken), (second, ~taken)):
+            part = _part(lane, box_engine.builtin_sum(weights[mask]), lines[mask], sizes[mask])
+            if part is None:
+                break
+            parts.append(part)
+        else:
+            plans.append(_priced(tuple(parts), service_fee, oversized_fee, overweight_fee))
+
+
+def plan_shipment(count: Sequence[int], weight_kg: Sequence[float], length: Sequence[float],
+                  width: Sequence[float], height: Sequence[float], starting_country: str,
+                  lanes: Sequence[LaneRates], totals: Tuple[float, float, float], service_fee: float,
+                  max_transit_days: Optional[int] = None,
+                  time_budget_ms: float = OPTIMIZER_TIME_BUDGET_MS
+                  ) -> Tuple[Optional[ShipmentPlan], Optional[ShipmentPlan], bool]:
+    """The cheapest plan, the cheapest one within ``max_transit_days`` and whether the search finished.
+
+    ``totals`` are the request's box totals as ``calculate_box_totals``
+    returns them, so a plan sending everything by one channel costs exactly
+    what ``get_shipping_quotes`` quotes for that channel. If the time budget
+    runs out, the best plans found so far are returned; sending everything by
+    one channel is always considered. Only the plans returned are built as
+    models.
+    """
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    total_weight, oversized_fee, overweight_fee = totals
+
+    plans: List[_Plan] = []
+    every_line = np.arange(len(count), dtype=np.int64)
+    for lane in lanes:
+        part = _part(lane, total_weight, every_line, np.asarray(count, dtype=np.int64))
+        if part is not None:
+            plans.append(_priced((part,), service_fee, oversized_fee, overweight_fee))
+
+    complete = True
+    try:
+        if len(lanes) > 1:
+            lines, sizes, weights = chunk_box_lines(count, weight_kg, length, width, height, starting_country)
+            if len(weights) > 1:
+                sums = SubsetSums(weights, total_weight, deadline)
+                for first, second in combinations(lanes, 2):
+                    _check_deadline(deadline)
+                    _add_splits(plans, sums, first, second, lines, sizes, weights, total_weight,
+                                service_fee, oversized_fee, overweight_fee)
+    except BudgetExceeded:
+        complete = False
+
+    cheapest = min(plans, key=lambda plan: plan.total_cost, default=None)
+    within_limit = None
+    if max_transit_days is not None:
+        within_limit = min((plan for plan in plans if plan.max_days <= max_transit_days),
+                           key=lambda plan: plan.total_cost, default=None)
+
+    def build(plan: Optional[_Plan]) -> Optional[ShipmentPlan]:
+        return _shipment_plan(plan, service_fee, oversized_fee, overweight_fee) if plan is not None else None
+
+    cheapest_plan = build(cheapest)
+    return cheapest_plan, cheapest_plan if within_limit is cheapest else build(within_limit), complete
@@ -0,0 +1,267 @@
+"""On-demand request profiles and stack samples of slow requests.
+
+An admin can profile a single request by sending ``X-Profile: 1`` (or
+``?profile=1``) together with a valid ``X-Admin-Token``. The request then
+runs under cProfile, and the response is replaced by a JSON report. The
+report holds the original response and the profile's self time split into
+SQLAlchemy, pydantic, controller (this package) and other code, plus the
+most expensive functions. cProfile sees everything that runs on the event
+loop while the request is in flight, so profile on a quiet worker. Only
+one request is profiled at a time.
+
+With ``SLOW_REQUEST_MS`` set, a sampler thread takes a stack sample of the
+event loop every ``SLOW_REQUEST_SAMPLE_MS`` and charges it to the request
+whose task is running. When a request takes longer than the threshold, its
+samples are kept in a ring buffer of the last ``SLOW_REQUEST_BUFFER`` slow
+requests, which ``GET /v1/admin/slow-requests`` returns. The sampler
+needs the GIL to take a sample, so CPU-bound code is sampled about every
+``sys.getswitchinterval()`` (5ms) at best. With both features off, the
+middleware only looks for the profile flag.
+"""
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+import orjson
+
+from app import metrics
+
+# 0 disables slow request sampling
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_SAMPLE_MS = float(os.getenv("SLOW_REQUEST_SAMPLE_MS", "5"))
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "50"))
+# functions listed in a profile report, stacks kept per slow request
+PROFILE_TOP_FUNCTIONS = 25
+SLOW_REQUEST_TOP_STACKS = 10
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+_APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+def _is_set(value: bytes) -> bool:
+    return value.strip().lower() in (b"1", b"true", b"yes")
+
+
+def profile_requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return _is_set(value)
+    query = scope.get("query_string", b"")
+    if b"profile=" not in query:
+        return False
+    return any(_is_set(pair[len(b"profile="):]) for pair in query.split(b"&") if pair.startswith(b"profile="))
+
+
+def code_group(filename: str, function: str) -> str:
+    """Which part of the stack a profiled function belongs to."""
+    if "sqlalchemy" in filename or "asyncpg" in filename or "psycopg" in filename:
+        return "sqlalchemy"
+    if "pydantic" in filename or "pydantic" in function:
+        return "pydantic"
+    if filename.startswith(_APP_DIR):
+        return "controller"
+    return "other"
+
+
+def profile_report(stats: pstats.Stats, elapsed: float,
+                   timings: Optional[metrics.RequestTimings] = None) -> dict:
+    groups = {"sqlalchemy": 0.0, "pydantic": 0.0, "controller": 0.0, "other": 0.0}
+    functions = []
+    for (filename, line, function), (_, calls, self_time, cumulative_time, _) in stats.stats.items():
+        groups[code_group(filename, function)] += self_time
+        functions.append((self_time, cumulative_time, calls, f"{filename}:{line}({function})"))
+    functions.sort(reverse=True)
+    return {
+        "elapsed_seconds": elapsed,
+        "self_seconds": groups,
+        "stages": dict(timings.stages) if timings is not None else {},
+        "db_queries": timings.db_queries if timings is not None else None,
+        "functions": [
+            {"function": name, "calls": calls, "self_seconds": self_time, "cumulative_seconds": cumulative_time}
+            for self_time, cumulative_time, calls, name in functions[:PROFILE_TOP_FUNCTIONS]
+        ],
+    }
+
+
+def folded_stack(frame) -> str:
+    """The stack under ``frame``, outermost call first, as ``module:function`` separated by ``;``."""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestSamples:
+    __slots__ = ("method", "path", "started_at", "stacks")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.stacks: Counter = Counter()
+
+
+class StackSampler(threading.Thread):
+    """Samples the event loop's stack and charges it to the request task that is running."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.loop = loop
+        self.thread_id = thread_id
+        self.interval = interval
+        self.active: Dict[asyncio.Task, RequestSamples] = {}
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def sample(self) -> None:
+        task = asyncio.current_task(self.loop)
+        samples = self.active.get(task) if task is not None else None
+        if samples is None:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            samples.stacks[folded_stack(frame)] += 1
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                # the request may finish while it is being sampled
+                continue
+
+
+class SlowRequestLog:
+    """The last ``size`` requests slower than the threshold, with their stack samples."""
+
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_MS, size: int = SLOW_REQUEST_BUFFER):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, samples: RequestSamples, elapsed: float, status: str,
+            timings: Optional[metrics.RequestTimings] = None) -> None:
+        entry = {
+            "logged_at": time.time(),
+            "method": samples.method,
+            "path": samples.path,
+            "status": status,
+            "elapsed_seconds": elapsed,
+            "lane": timings.lane if timings is not None else None,
+            "stages": dict(timings.stages) if timings is not None else {},
+            "db_queries": timings.db_queries if timings is not None else None,
+            "samples": sum(samples.stacks.values()),
+            "stacks": [{"stack": stack, "samples": count}
+                       for stack, count in samples.stacks.most_common(SLOW_REQUEST_TOP_STACKS)],
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> List[dict]:
+        """Newest first."""
+        with self._lock:
+            return list(reversed(self._entries))
+
+
+slow_requests = SlowRequestLog()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware serving profile reports to admins and feeding ``slow_requests``.
+
+    ``authorize`` gets the ``X-Admin-Token`` header and returns whether it is
+    an admin's; without it profiling is refused.
+    """
+
+    def __init__(self, app, authorize: Optional[Callable[[Optional[str]], bool]] = None,
+                 slow_log: SlowRequestLog = slow_requests, sample_ms: float = SLOW_REQUEST_SAMPLE_MS):
+        self.app = app
+        self.authorize = authorize
+        self.slow_log = slow_log
+        self.sample_ms = sample_ms
+        self._sampler: Optional[StackSampler] = None
+        self._profiling = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+        elif profile_requested(scope):
+            await self._profile(scope, receive, send)
+        elif self.slow_log.threshold_ms > 0:
+            await self._sample(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _respond(self, send, status: int, body: dict) -> None:
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": orjson.dumps(body)})
+
+    async def _profile(self, scope, receive, send):
+        token = dict(scope["headers"]).get(ADMIN_TOKEN_HEADER)
+        if self.authorize is None or not self.authorize(token.decode("latin-1") if token is not None else None):
+            await self._respond(send, 403, {"detail": "Forbidden"})
+            return
+        if not self._profiling.acquire(blocking=False):
+            await self._respond(send, 409, {"detail": "Another request is being profiled"})
+            return
+
+        start, chunks = {}, []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, capture)
+            finally:
+                profiler.disable()
+        finally:
+            self._profiling.release()
+        elapsed = time.perf_counter() - started
+
+        body = b"".join(chunks)
+        try:
+            response = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            response = body.decode("utf-8", "replace")
+        report = profile_report(pstats.Stats(profiler), elapsed, metrics.current_timings())
+        await self._respond(send, 200, {"status_code": start.get("status", 500), "response": response,
+                                        "profile": report})
+
+    async def _sample(self, scope, receive, send):
+        if self._sampler is None:
+            self._sampler = StackSampler(asyncio.get_running_loop(), threading.get_ident(), self.sample_ms / 1000)
+            self._sampler.start()
+        task = asyncio.current_task()
+        samples = self._sampler.active[task] = RequestSamples(scope["method"], scope["path"])
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            del self._sampler.active[task]
+            elapsed = time.perf_counter() - samples.started_at
+            if elapsed * 1000 >= self.slow_log.threshold_ms:
+                self.slow_log.add(samples, elapsed, status[0], metrics.current_timings())
@@ -0,0 +1,130 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from app.schemas import QuoteRequest
+
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", "10000"))
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", "300"))
+# requests with more box lines than this are not cached, to keep keys small
+QUOTE_CACHE_MAX_LINES = int(os.getenv("QUOTE_CACHE_MAX_LINES", "256"))
+
+
+def canonical_key(quote_request: QuoteRequest) -> Optional[Tuple]:
+    """Key shared by equivalent requests: the lane plus the multiset of boxes.
+
+    Box lines are merged by their dimensions and weight and sorted, so the
+    same boxes in a different order or split over duplicate lines share an
+    entry. Equivalent requests are priced the same up to float rounding of
+    the totals. Returns None for requests too large to cache.
+    """
+    boxes: Dict[Tuple[float, float, float, float], int] = {}
+    lines = 0
+    for box in quote_request.boxes:
+        shape = (box.weight_kg, box.length, box.width, box.height)
+        boxes[shape] = boxes.get(shape, 0) + box.count
+        lines += 1
+    columns = quote_request.box_columns
+    if columns is not None:
+        lines += len(columns)
+        if lines > QUOTE_CACHE_MAX_LINES:
+            return None
+        for count, shape in zip(columns.count, zip(columns.weight_kg, columns.length, columns.width, columns.height)):
+            boxes[shape] = boxes.get(shape, 0) + count
+    if lines > QUOTE_CACHE_MAX_LINES:
+        return None
+    return (quote_request.starting_country, quote_request.destination_country,
+            tuple(sorted(boxes.items())))
+
+
+class QuoteCache:
+    """Bounded LRU cache with a TTL.
+
+    Entries belong to one rate table version; the first lookup with a newer
+    version drops everything cached for the old one. Versions only move
+    forward: lookups with an older version bypass the cache.
+
+    Misses are computed by the caller, on the event loop, so concurrent
+    requests for the same key cannot overlap and are not coalesced.
+    """
+
+    def __init__(self, max_entries: int = QUOTE_CACHE_SIZE, ttl: float = QUOTE_CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        self._version = None
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_compute(self, key: Hashable, version: int, compute: Callable[[], object]):
+        if self.max_entries <= 0 or key is None:
+            return compute()
+
+        with self._lock:
+            if self._version is None or version > self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+            elif version < self._version:
+                # a request still holding an older rate table; its quotes are neither served nor cached
+                self.stale += 1
+                return compute()
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (self._clock() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "rate_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+quote_cache = QuoteCache()
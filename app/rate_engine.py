@@ -0,0 +1,395 @@
+import asyncio
+import hashlib
+from bisect import bisect_left
+from itertools import count
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Float, Integer, String, and_, cast, column, literal_column, select, values
+from app.fees import FeeSchedule, OriginFees, load_fee_schedule
+from app.models import RateSheetMeta, ShippingRate, Rate
+
+LaneKey = Tuple[str, str, str]
+# (starting country, destination country, shipping channel, weight)
+TierLookup = Tuple[str, str, str, float]
+
+# tier lookups per query, five bound parameters each
+TIER_LOOKUP_BATCH = 5000
+
+_versions = count(1)
+
+
+class Tier(NamedTuple):
+    min_weight_kg: float
+    max_weight_kg: float
+    per_kg_rate: float
+
+
+class LaneRates:
+    """Weight tiers of a single (origin, destination, channel) lane.
+
+    Tiers are stored as parallel float64 arrays sorted by their upper bound
+    so the min exclusive / max inclusive lookup is a single bisect. A lane
+    read from the rate snapshot keeps the read-only views into the mapping
+    and never copies them. Scalar lookups bisect over plain float tuples of
+    the same tiers instead, made on first use, so they create no numpy scalars.
+    """
+
+    __slots__ = ("starting_country", "destination_country", "shipping_channel",
+                 "min_days", "max_days", "min_weights", "max_weights", "per_kg_rates", "_disjoint",
+                 "_scalar_tiers")
+
+    def __init__(self, starting_country: str, destination_country: str, shipping_channel: str,
+                 min_days: int, max_days: int, tiers: Iterable[Tier]):
+        self.starting_country = starting_country
+        self.destination_country = destination_country
+        self.shipping_channel = shipping_channel
+        self.min_days = min_days
+        self.max_days = max_days
+
+        ordered = sorted(tiers, key=lambda tier: (tier.max_weight_kg, tier.min_weight_kg))
+        self._set_tiers(np.array([tier.min_weight_kg for tier in ordered], dtype=np.float64),
+                        np.array([tier.max_weight_kg for tier in ordered], dtype=np.float64),
+                        np.array([tier.per_kg_rate for tier in ordered], dtype=np.float64))
+
+    @classmethod
+    def from_arrays(cls, starting_country: str, destination_country: str, shipping_channel: str,
+                    min_days: int, max_days: int, min_weights: np.ndarray, max_weights: np.ndarray,
+                    per_kg_rates: np.ndarray) -> "LaneRates":
+        """A lane over tier arrays already sorted by upper bound, used as they are (e.g. mmap views)."""
+        lane = cls.__new__(cls)
+        lane.starting_country = starting_country
+        lane.destination_country = destination_country
+        lane.shipping_channel = shipping_channel
+        lane.min_days = min_days
+        lane.max_days = max_days
+        lane._set_tiers(min_weights, max_weights, per_kg_rates)
+        return lane
+
+    def _set_tiers(self, min_weights: np.ndarray, max_weights: np.ndarray, per_kg_rates: np.ndarray) -> None:
+        self.min_weights = min_weights
+        self.max_weights = max_weights
+        self.per_kg_rates = per_kg_rates
+        self._disjoint = bool(np.all(min_weights[1:] >= max_weights[:-1]))
+        self._scalar_tiers = None
+
+    @property
+    def key(self) -> LaneKey:
+        return (self.starting_country, self.destination_country, self.shipping_channel)
+
+    @property
+    def tiers(self) -> List[Tier]:
+        return [Tier(*tier) for tier in zip(self.min_weights.tolist(), self.max_weights.tolist(),
+                                            self.per_kg_rates.tolist())]
+
+    def _tiers_as_floats(self) -> Tuple[Tuple[float, ...], Tuple[float, ...], Tuple[float, ...]]:
+        # (max weights, min weights, rates); racing threads build equal tuples
+        if self._scalar_tiers is None:
+            self._scalar_tiers = (tuple(self.max_weights.tolist()), tuple(self.min_weights.tolist()),
+                                  tuple(self.per_kg_rates.tolist()))
+        return self._scalar_tiers
+
+    def _tier_index(self, weight: float) -> Optional[int]:
+        # rates are min exclusive, max inclusive
+        max_weights, min_weights, _ = self._tiers_as_floats()
+        index = bisect_left(max_weights, weight)
+        while index < len(max_weights):
+            if min_weights[index] < weight:
+                return index
+            index += 1
+        return None
+
+    def per_kg_rate(self, weight: float) -> Optional[float]:
+        index = self._tier_index(weight)
+        return None if index is None else self._tiers_as_floats()[2][index]
+
+    def tier_at(self, weight: float) -> Optional[Tier]:
+        """The tier ``per_kg_rate`` takes its rate from."""
+        index = self._tier_index(weight)
+        if index is None:
+            return None
+        max_weights, min_weights, rates = self._tiers_as_floats()
+        return Tier(min_weights[index], max_weights[index], rates[index])
+
+    def breakpoints(self) -> List[dict]:
+        """The piecewise-linear cost curve: one segment per tier with its end costs."""
+        return [
+            {
+                "min_weight_kg": min_weight,
+                "max_weight_kg": max_weight,
+                "per_kg_rate": rate,
+                "min_cost": min_weight * rate,
+                "max_cost": max_weight * rate,
+            }
+            for min_weight, max_weight, rate in self.tiers
+        ]
+
+    def per_kg_rates_at(self, weights: np.ndarray) -> np.ndarray:
+        """Vectorized ``per_kg_rate``; NaN where no tier covers the weight."""
+        weights = np.asarray(weights, dtype=np.float64)
+        rates = np.full(weights.shape, np.nan)
+        if not len(self.per_kg_rates):
+            return rates
+        if not self._disjoint:
+            # overlapping tiers need the scalar scan to pick the same tier
+            for position, weight in np.ndenumerate(weights):
+                rate = self.per_kg_rate(float(weight))
+                if rate is not None:
+                    rates[position] = rate
+            return rates
+        index = np.searchsorted(self.max_weights, weights, side="left")
+        in_range = index < len(self.max_weights)
+        clipped = np.minimum(index, len(self.max_weights) - 1)
+        found = in_range & (self.min_weights[clipped] < weights)
+        rates[found] = self.per_kg_rates[clipped[found]]
+        return rates
+
+    def costs_at(self, weights: np.ndarray) -> np.ndarray:
+        """Shipping cost (weight times per kg rate) at every weight; NaN where unquotable."""
+        weights = np.asarray(weights, dtype=np.float64)
+        return weights * self.per_kg_rates_at(weights)
+
+
+class RateTable:
+    """Immutable, compiled snapshot of every lane in the rate sheet and the fee rules.
+
+    ``fees`` defaults to the rules in ``data/fee_rules.json``.
+    """
+
+    def __init__(self, lanes: Iterable[LaneRates], version: Optional[int] = None,
+                 content_hash: Optional[str] = None, fees: Optional[FeeSchedule] = None):
+        self.version = next(_versions) if version is None else version
+        self.content_hash = content_hash
+        self.fees = load_fee_schedule() if fees is None else fees
+        self._lanes: Dict[LaneKey, LaneRates] = {}
+        self._routes: Dict[Tuple[str, str], List[LaneRates]] = {}
+        for lane in lanes:
+            if lane.key not in self._lanes:
+                self._lanes[lane.key] = lane
+                self._routes.setdefault((lane.starting_country, lane.destination_country), []).append(lane)
+
+    def __len__(self) -> int:
+        return len(self._lanes)
+
+    def __iter__(self):
+        return iter(self._lanes.values())
+
+    @property
+    def tag(self) -> str:
+        """Version label that is the same in every worker serving the same rate sheet."""
+        if self.content_hash is None:
+            return str(self.version)
+        if self.fees.content_hash is None:
+            return self.content_hash[:16]
+        # fee rules change prices too
+        return hashlib.sha256(f"{self.content_hash}:{self.fees.content_hash}".encode()).hexdigest()[:16]
+
+    def origin_fees(self, starting_country: str) -> OriginFees:
+        return self.fees.for_origin(starting_country)
+
+    def lane(self, starting_country: str, destination_country: str, shipping_channel: str) -> Optional[LaneRates]:
+        return self._lanes.get((starting_country, destination_country, shipping_channel))
+
+    def channels(self, starting_country: str, destination_country: str) -> List[LaneRates]:
+        """Every channel between two countries, in rate sheet order."""
+        return self._routes.get((starting_country, destination_country), [])
+
+    def routes(self, starting_country: Optional[str] = None,
+               destination_country: Optional[str] = None) -> List[Tuple[str, str]]:
+        """(origin, destination) pairs with at least one channel; None matches any country."""
+        if starting_country is not None and destination_country is not None:
+            route = (starting_country, destination_country)
+            return [route] if route in self._routes else []
+        return [(origin, destination) for origin, destination in self._routes
+                if starting_country in (None, origin) and destination_country in (None, destination)]
+
+    def cheapest_channel(self, starting_country: str, destination_country: str,
+                         weight: float) -> Optional[Tuple[LaneRates, float]]:
+        """The channel with the lowest shipping cost at ``weight`` and its per kg rate.
+
+        Fees do not depend on the channel, so they don't change the answer.
+        Ties go to the channel listed first.
+        """
+        best = None
+        for lane in self.channels(starting_country, destination_country):
+            rate = lane.per_kg_rate(weight)
+            if rate is not None and (best is None or rate < best[1]):
+                best = (lane, rate)
+        return best
+
+
+def build_rate_table(data: Iterable[dict], version: Optional[int] = None,
+                     content_hash: Optional[str] = None, fees: Optional[FeeSchedule] = None) -> RateTable:
+    """Compile a rate sheet in the ``data/rates (1).json`` layout."""
+    lanes = []
+    for item in data:
+        lanes.append(LaneRates(
+            starting_country=item["starting_country"],
+            destination_country=item["destination_country"],
+            shipping_channel=item["shipping_channel"],
+            min_days=item["shipping_time_range"]["min_days"],
+            max_days=item["shipping_time_range"]["max_days"],
+            tiers=[Tier(rate["min_weight_kg"], rate["max_weight_kg"], rate["per_kg_rate"])
+                   for rate in item["rates"]],
+        ))
+    return RateTable(lanes, version, content_hash, fees)
+
+
+def _lanes_query():
+    return (
+        select(ShippingRate, Rate)
+        .outerjoin(Rate, Rate.shipping_rate_id == ShippingRate.id)
+        .order_by(ShippingRate.id)
+    )
+
+
+def _content_hash_query():
+    return select(RateSheetMeta.content_hash).where(RateSheetMeta.id == 1)
+
+
+def _compile_rows(rows, content_hash: Optional[str] = None) -> RateTable:
+    shipping_rates: Dict[int, ShippingRate] = {}
+    tiers: Dict[int, List[Tier]] = {}
+    for shipping_rate, rate in rows:
+        shipping_rates.setdefault(shipping_rate.id, shipping_rate)
+        lane_tiers = tiers.setdefault(shipping_rate.id, [])
+        if rate is not None:
+            lane_tiers.append(Tier(rate.min_weight_kg, rate.max_weight_kg, rate.per_kg_rate))
+
+    return RateTable((
+        LaneRates(
+            starting_country=shipping_rate.starting_country,
+            destination_country=shipping_rate.destination_country,
+            shipping_channel=shipping_rate.shipping_channel,
+            min_days=shipping_rate.min_days,
+            max_days=shipping_rate.max_days,
+            tiers=tiers[shipping_rate_id],
+        )
+        for shipping_rate_id, shipping_rate in shipping_rates.items()
+    ), content_hash=content_hash)
+
+
+def load_rate_table(session) -> RateTable:
+    """Compile the ``shipping_rates``/``rates`` tables with a single joined query."""
+    content_hash = session.execute(_content_hash_query()).scalar()
+    return _compile_rows(session.execute(_lanes_query()).all(), content_hash)
+
+
+async def load_rate_table_async(session) -> RateTable:
+    """``load_rate_table`` for an ``AsyncSession``."""
+    content_hash = (await session.execute(_content_hash_query())).scalar()
+    result = await session.execute(_lanes_query())
+    return _compile_rows(result.all(), content_hash)
+
+
+def _tier_lookup_query(lookups: Sequence[TierLookup], postgres: bool):
+    wanted = values(
+        column("position", Integer), column("starting_country", String), column("destination_country", String),
+        column("shipping_channel", String), column("weight_kg", Float), name="wanted",
+    ).data([(position, *lookup) for position, lookup in enumerate(lookups)]).cte("wanted")
+    if postgres:
+        # answered from the GiST index behind the tier exclusion constraint (app.migrations); the
+        # float8range compares the weight exactly like the bounds in the other branch
+        in_tier = literal_column("rates.weight_range").op("@>")(cast(wanted.c.weight_kg, Float))
+    else:
+        in_tier = and_(Rate.min_weight_kg < wanted.c.weight_kg, wanted.c.weight_kg <= Rate.max_weight_kg)
+    return (
+        select(wanted.c.position, Rate.min_weight_kg, Rate.max_weight_kg, Rate.per_kg_rate)
+        .select_from(wanted)
+        .join(ShippingRate, and_(ShippingRate.starting_country == wanted.c.starting_country,
+                                 ShippingRate.destination_country == wanted.c.destination_country,
+                                 ShippingRate.shipping_channel == wanted.c.shipping_channel))
+        .join(Rate, and_(Rate.shipping_rate_id == ShippingRate.id, in_tier))
+        # overlapping tiers (outside Postgres) resolve like LaneRates.per_kg_rate
+        .order_by(wanted.c.position, Rate.max_weight_kg, Rate.min_weight_kg)
+    )
+
+
+def _first_tiers(rows, found: List[Optional[Tier]], offset: int) -> None:
+    for position, min_weight_kg, max_weight_kg, per_kg_rate in rows:
+        if found[offset + position] is None:
+            found[offset + position] = Tier(min_weight_kg, max_weight_kg, per_kg_rate)
+
+
+def lookup_tiers(session, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+    """The tier covering each (origin, destination, channel, weight), straight from the database.
+
+    All lookups are answered by one query per ``TIER_LOOKUP_BATCH`` through
+    the lane and tier indexes; None where no tier covers the weight.
+    """
+    postgres = session.get_bind().dialect.name == "postgresql"
+    found: List[Optional[Tier]] = [None] * len(lookups)
+    for offset in range(0, len(lookups), TIER_LOOKUP_BATCH):
+        batch = lookups[offset:offset + TIER_LOOKUP_BATCH]
+        _first_tiers(session.execute(_tier_lookup_query(batch, postgres)).all(), found, offset)
+    return found
+
+
+async def lookup_tiers_async(session, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+    """``lookup_tiers`` for an ``AsyncSession``."""
+    postgres = session.bind.dialect.name == "postgresql"
+    found: List[Optional[Tier]] = [None] * len(lookups)
+    for offset in range(0, len(lookups), TIER_LOOKUP_BATCH):
+        batch = lookups[offset:offset + TIER_LOOKUP_BATCH]
+        _first_tiers((await session.execute(_tier_lookup_query(batch, postgres))).all(), found, offset)
+    return found
+
+
+_active_table: Optional[RateTable] = None
+_install_lock = Lock()
+_async_install_lock: Optional[asyncio.Lock] = None
+
+
+def get_rate_table() -> Optional[RateTable]:
+    return _active_table
+
+
+def origin_fees(starting_country: str) -> OriginFees:
+    """Fee rules of an origin from the active table, or from the rules file before one is installed."""
+    table = _active_table
+    if table is None:
+        return load_fee_schedule().for_origin(starting_country)
+    return table.origin_fees(starting_country)
+
+
+def set_rate_table(table: Optional[RateTable]) -> Optional[RateTable]:
+    """Atomically swap the active table; quotes already running keep their snapshot."""
+    global _active_table
+    with _install_lock:
+        _active_table = table
+    return table
+
+
+def reload_rate_table(store) -> RateTable:
+    """Compile a fresh table from the primary of a ``RateStore`` and make it the active one."""
+    return set_rate_table(store.load_table(primary=True))
+
+
+def ensure_rate_table(store) -> RateTable:
+    """Return the active table, compiling it from a ``RateStore`` on first use."""
+    global _active_table
+    table = _active_table
+    if table is not None:
+        return table
+    with _install_lock:
+        if _active_table is None:
+            _active_table = store.load_table()
+        return _active_table
+
+
+async def ensure_rate_table_async(store) -> RateTable:
+    """``ensure_rate_table`` for async routes; concurrent cold requests share one load."""
+    global _active_table, _async_install_lock
+    table = _active_table
+    if table is not None:
+        return table
+    if _async_install_lock is None:
+        _async_install_lock = asyncio.Lock()
+    async with _async_install_lock:
+        if _active_table is None:
+            table = await store.load_table_async()
+            with _install_lock:
+                if _active_table is None:
+                    _active_table = table
+        return _active_table
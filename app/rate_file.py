@@ -0,0 +1,226 @@
+"""Compiled rate tables as memory-mapped binary files.
+
+One process writes the compiled lanes, tiers and fee rules to a snapshot
+file; every worker on the host maps it read-only. Tier bounds and rates
+are used in place as numpy views of the mapping, so the workers share one
+physical copy of them through the page cache. A worker can also start
+from the file without querying the database. A new version is published
+by writing a temporary file and ``os.replace``-ing it over the old one.
+Workers that mapped the old file keep it until they switch.
+
+Layout, little endian::
+
+    header    magic "SHPRATES", format version u32, section count u32,
+              payload length u64, sha256 of the payload (32 bytes)
+    payload   section directory: (name 8s, offset u64, length u64) per section,
+              then the sections, each aligned to 8 bytes
+
+Sections: ``meta`` (JSON: content hashes, counts), ``strings`` (JSON list of
+the country and channel names), ``lanes`` (int32 rows of origin,
+destination, channel, min days, max days, first tier, tier count),
+``tiermin``/``tiermax``/``tierrate`` (float64, each lane's tiers sorted by
+upper bound) and ``fees`` (the fee rules as JSON).
+
+    python -m app.rate_file write rates.bin
+    python -m app.rate_file info rates.bin
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.fees import FEE_RULES_PATH, dump_fee_rules, load_fee_schedule, parse_fee_rules
+from app.rate_engine import LaneRates, RateTable
+
+RATES_SNAPSHOT_PATH = os.getenv("RATES_SNAPSHOT_PATH", "")
+
+MAGIC = b"SHPRATES"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQ32s")
+_SECTION = struct.Struct("<8sQQ")
+_LANE_COLUMNS = 7
+
+
+class RateFileError(ValueError):
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def encode_rate_table(table: RateTable) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    lanes = list(table)
+    rows = np.zeros((len(lanes), _LANE_COLUMNS), dtype="<i4")
+    tier_min, tier_max, tier_rate = [np.empty(0)], [np.empty(0)], [np.empty(0)]
+    first_tier = 0
+    for row, lane in zip(rows, lanes):
+        row[:] = (string_id(lane.starting_country), string_id(lane.destination_country),
+                  string_id(lane.shipping_channel), lane.min_days, lane.max_days,
+                  first_tier, len(lane.per_kg_rates))
+        first_tier += len(lane.per_kg_rates)
+        tier_min.append(lane.min_weights)
+        tier_max.append(lane.max_weights)
+        tier_rate.append(lane.per_kg_rates)
+
+    meta = {
+        "content_hash": table.content_hash,
+        "fee_rules_hash": table.fees.content_hash,
+        "lanes": len(lanes),
+        "tiers": first_tier,
+        "written_at": datetime.now(timezone.utc).isoformat(),
+    }
+    sections = [
+        (b"meta", json.dumps(meta).encode()),
+        (b"strings", json.dumps(list(strings)).encode()),
+        (b"lanes", rows.tobytes()),
+        (b"tiermin", np.concatenate(tier_min).astype("<f8").tobytes()),
+        (b"tiermax", np.concatenate(tier_max).astype("<f8").tobytes()),
+        (b"tierrate", np.concatenate(tier_rate).astype("<f8").tobytes()),
+        (b"fees", dump_fee_rules(table.fees)),
+    ]
+
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    directory, body = [], bytearray()
+    for name, data in sections:
+        directory.append(_SECTION.pack(name, offset, len(data)))
+        body += data + b"\0" * (_align(len(data)) - len(data))
+        offset += _align(len(data))
+    payload = b"".join(directory)
+    payload += b"\0" * (_align(_HEADER.size + len(payload)) - _HEADER.size - len(payload)) + body
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), len(payload), hashlib.sha256(payload).digest())
+    return header + payload
+
+
+def write_rate_file(table: RateTable, path: str) -> None:
+    """Atomically replace ``path`` with a snapshot of ``table``."""
+    data = encode_rate_table(table)
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(prefix=".rates-", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _sections(buffer) -> Dict[str, Tuple[int, int]]:
+    if len(buffer) < _HEADER.size:
+        raise RateFileError("rate file is truncated")
+    magic, version, section_count, payload_length, checksum = _HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise RateFileError("not a rate file")
+    if version != FORMAT_VERSION:
+        raise RateFileError(f"unsupported rate file version {version}, expected {FORMAT_VERSION}")
+    if len(buffer) != _HEADER.size + payload_length:
+        raise RateFileError("rate file is truncated")
+    if hashlib.sha256(memoryview(buffer)[_HEADER.size:]).digest() != checksum:
+        raise RateFileError("rate file checksum mismatch")
+    sections = {}
+    for index in range(section_count):
+        name, offset, length = _SECTION.unpack_from(buffer, _HEADER.size + index * _SECTION.size)
+        sections[name.rstrip(b"\0").decode()] = (offset, length)
+    return sections
+
+
+def decode_rate_table(buffer) -> RateTable:
+    """Rate table over ``buffer`` (bytes or a mmap); tier arrays are views into it."""
+    sections = _sections(buffer)
+
+    def raw(name: str) -> bytes:
+        offset, length = sections[name]
+        return bytes(buffer[offset:offset + length])
+
+    def array(name: str, dtype: str) -> np.ndarray:
+        offset, length = sections[name]
+        return np.frombuffer(buffer, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    meta = json.loads(raw("meta"))
+    strings: List[str] = json.loads(raw("strings"))
+    rows = array("lanes", "<i4").reshape(-1, _LANE_COLUMNS)
+    tier_min, tier_max, tier_rate = array("tiermin", "<f8"), array("tiermax", "<f8"), array("tierrate", "<f8")
+    fees = parse_fee_rules(raw("fees"), meta["fee_rules_hash"])
+
+    lanes = []
+    for origin, destination, channel, min_days, max_days, start, count in rows.tolist():
+        end = start + count
+        lanes.append(LaneRates.from_arrays(strings[origin], strings[destination], strings[channel],
+                                           min_days, max_days, tier_min[start:end], tier_max[start:end],
+                                           tier_rate[start:end]))
+    return RateTable(lanes, content_hash=meta["content_hash"], fees=fees)
+
+
+def read_rate_file(path: str) -> RateTable:
+    """Map ``path`` read-only and decode it; raises ``RateFileError`` if it is corrupt."""
+    with open(path, "rb") as rate_file:
+        # the numpy views keep the mapping alive after the file is closed
+        mapping = mmap.mmap(rate_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode_rate_table(mapping)
+
+
+def file_state(path: str) -> Optional[Tuple[int, int]]:
+    """Identity of the file at ``path``; changes when it is replaced."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def load_current_snapshot(path: str, rates_path: str, fee_rules_path: str = FEE_RULES_PATH) -> Optional[RateTable]:
+    """The snapshot at ``path`` if it was built from the current rate and fee rules files, else None."""
+    from app.loader import content_hash
+
+    try:
+        table = read_rate_file(path)
+        current = (content_hash(rates_path), load_fee_schedule(fee_rules_path).content_hash)
+    except (OSError, ValueError):
+        return None
+    if (table.content_hash, table.fees.content_hash) != current:
+        return None
+    return table
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.database import DATABASE_URL
+    from app.rate_engine import load_rate_table
+
+    parser = argparse.ArgumentParser(description="Write or inspect memory-mapped rate files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    write = commands.add_parser("write", help="compile the rates in the database into a rate file")
+    write.add_argument("path", nargs="?", default=RATES_SNAPSHOT_PATH or "rates.bin")
+    write.add_argument("--database-url", default=DATABASE_URL)
+    info = commands.add_parser("info", help="check a rate file and print what it holds")
+    info.add_argument("path", nargs="?", default=RATES_SNAPSHOT_PATH or "rates.bin")
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        with sessionmaker(bind=create_engine(args.database_url))() as session:
+            table = load_rate_table(session)
+        write_rate_file(table, args.path)
+    else:
+        table = read_rate_file(args.path)
+    print(f"{args.path}: version {table.tag}, {len(table)} lanes, "
+          f"{sum(len(lane.per_kg_rates) for lane in table)} tiers")
+
+
+if __name__ == "__main__":
+    main()
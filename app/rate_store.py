@@ -0,0 +1,262 @@
+"""Where the rate sheet is stored: a SQL database with optional read replicas, or memory.
+
+``DATABASE_URL`` picks the backend. ``postgresql://...`` and
+``sqlite:///...`` keep the sheet in the ``shipping_rates``/``rates`` tables.
+``memory://`` keeps it in the process and starts from the rate file, which
+is enough for tests, benchmarks and a single worker without a database.
+
+Loads, reloads and the rate watcher's content hash checks go to the
+primary. Quote reads (compiling the rate table, tier lookups) go to the
+replicas in ``DATABASE_REPLICA_URLS``, taking turns, and to the primary
+when no replica answers. A replica that cannot answer (connection errors and
+timeouts) is skipped for ``DB_REPLICA_RETRY_SECONDS`` before it is tried
+again; errors in the query itself are raised as they are.
+"""
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import count
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.database import DATABASE_REPLICA_URLS, DATABASE_URL, connect_async_engine, connect_engine
+from app.loader import RATES_PATH, content_hash, file_modified_at, load_rate_data, read_rate_sheet
+from app.loader import stored_content_hash
+from app.rate_engine import RateTable, Tier, TierLookup, build_rate_table, load_rate_table, load_rate_table_async
+from app.rate_engine import lookup_tiers, lookup_tiers_async
+
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+MEMORY_URL = "memory://"
+
+# errors that mean the database could not answer (lost connection, pool timeout), as opposed to a bug in
+# the query or bad data, which would fail on every database alike
+_UNAVAILABLE = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, OSError)
+
+
+class RateStore(ABC):
+    """Interface of the rate store backends."""
+
+    backend = ""
+    # engine of the primary database for other tables (e.g. the quote audit log); None without a database
+    engine = None
+
+    def engines(self) -> list:
+        """Every engine the store uses, to instrument them."""
+        return []
+
+    def load_sheet(self, path: str = RATES_PATH, force: bool = False, keep_newer: bool = False) -> bool:
+        """Store the sheet in ``path`` unless it is already stored; see ``load_rate_sheet``."""
+        return self.load_data(lambda: read_rate_sheet(path), content_hash(path), os.path.basename(path), force,
+                              loaded_before=file_modified_at(path) if keep_newer else None)
+
+    @abstractmethod
+    def load_data(self, data: Callable[[], List[dict]], sheet_hash: str, source: str, force: bool = False,
+                  loaded_before: Optional[datetime] = None) -> bool:
+        """Store the sheet ``data()`` unless ``sheet_hash`` is already stored (or ``force``).
+
+        Unless ``force``, a sheet stored at or after ``loaded_before`` is kept as well.
+        """
+
+    @abstractmethod
+    def content_hash(self) -> Optional[str]:
+        """Content hash of the stored sheet, from the primary."""
+
+    @abstractmethod
+    def load_table(self, primary: bool = False) -> RateTable:
+        """Compile the stored sheet, from a replica unless ``primary``."""
+
+    @abstractmethod
+    async def load_table_async(self) -> RateTable:
+        """``load_table`` for the event loop."""
+
+    @abstractmethod
+    def lookup_tiers(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        """The tier covering each (origin, destination, channel, weight); see ``rate_engine.lookup_tiers``."""
+
+    @abstractmethod
+    async def lookup_tiers_async(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        """``lookup_tiers`` for the event loop."""
+
+    def status(self) -> dict:
+        return {"backend": self.backend}
+
+
+class MemoryRateStore(RateStore):
+    """Keeps the sheet in the process; it starts out holding the rate file at ``path``."""
+
+    backend = "memory"
+
+    def __init__(self, path: Optional[str] = RATES_PATH):
+        self.path = path
+        self._data: Optional[List[dict]] = None
+        self._hash: Optional[str] = None
+        self._loaded_at: Optional[datetime] = None
+        self._table: Optional[RateTable] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> None:
+        if self._hash is None and self.path:
+            self.load_sheet(self.path)
+
+    def load_data(self, data: Callable[[], List[dict]], sheet_hash: str, source: str, force: bool = False,
+                  loaded_before: Optional[datetime] = None) -> bool:
+        with self._lock:
+            if not force and (self._hash == sheet_hash or (
+                    loaded_before is not None and self._loaded_at is not None and self._loaded_at >= loaded_before)):
+                return False
+            self._data, self._hash, self._table = data(), sheet_hash, None
+            self._loaded_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            return True
+
+    def content_hash(self) -> Optional[str]:
+        self._ensure_loaded()
+        return self._hash
+
+    def load_table(self, primary: bool = False) -> RateTable:
+        self._ensure_loaded()
+        with self._lock:
+            data, sheet_hash = self._data, self._hash
+        return build_rate_table(data or [], content_hash=sheet_hash)
+
+    async def load_table_async(self) -> RateTable:
+        return self.load_table()
+
+    def lookup_tiers(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        table = self._table
+        if table is None:
+            table = self._table = self.load_table()
+        found = []
+        for starting_country, destination_country, shipping_channel, weight in lookups:
+            lane = table.lane(starting_country, destination_country, shipping_channel)
+            found.append(lane.tier_at(weight) if lane is not None else None)
+        return found
+
+    async def lookup_tiers_async(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        return self.lookup_tiers(lookups)
+
+
+class Database:
+    """One database of a ``SQLRateStore``, and whether it is answering."""
+
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = connect_engine(url)
+        self.async_engine = connect_async_engine(url)
+        self.session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.async_session = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        self.down_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+
+class SQLRateStore(RateStore):
+    """Rate sheet in a SQL database (Postgres or SQLite), read through its replicas."""
+
+    def __init__(self, url: str, replica_urls: Sequence[str] = (),
+                 retry_seconds: float = DB_REPLICA_RETRY_SECONDS):
+        self.primary = Database(url)
+        self.replicas = [Database(replica_url) for replica_url in replica_urls]
+        self.retry_seconds = retry_seconds
+        self.backend = self.primary.engine.dialect.name
+        self.engine = self.primary.engine
+        self._turn = count()
+
+    def engines(self) -> list:
+        return [engine for database in [self.primary] + self.replicas
+                for engine in (database.engine, database.async_engine)]
+
+    def load_data(self, data: Callable[[], List[dict]], sheet_hash: str, source: str, force: bool = False,
+                  loaded_before: Optional[datetime] = None) -> bool:
+        return load_rate_data(self.engine, data, sheet_hash, source, force=force, loaded_before=loaded_before)
+
+    def content_hash(self) -> Optional[str]:
+        with self.engine.connect() as conn:
+            return stored_content_hash(conn)
+
+    def read_order(self) -> List[Database]:
+        """Healthy replicas, starting with the next one in turn, then the primary."""
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.healthy(now)]
+        if healthy:
+            start = next(self._turn) % len(healthy)
+            healthy = healthy[start:] + healthy[:start]
+        return healthy + [self.primary]
+
+    def _failed(self, database: Database, error: Exception) -> None:
+        if database is self.primary:
+            raise error
+        database.down_until = time.monotonic() + self.retry_seconds
+        metrics.DB_READ_FAILOVERS.inc(database.name)
+
+    def _read(self, query: Callable, primary: bool = False):
+        """``query(session)`` on the first database in ``read_order`` that answers."""
+        for database in [self.primary] if primary else self.read_order():
+            try:
+                with database.session() as session:
+                    return query(session)
+            except _UNAVAILABLE as error:
+                self._failed(database, error)
+
+    async def _read_async(self, query: Callable[..., Awaitable]):
+        for database in self.read_order():
+            try:
+                async with database.async_session() as session:
+                    return await query(session)
+            except _UNAVAILABLE as error:
+                self._failed(database, error)
+
+    def load_table(self, primary: bool = False) -> RateTable:
+        return self._read(load_rate_table, primary)
+
+    async def load_table_async(self) -> RateTable:
+        return await self._read_async(load_rate_table_async)
+
+    def lookup_tiers(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        return self._read(lambda session: lookup_tiers(session, lookups))
+
+    async def lookup_tiers_async(self, lookups: Sequence[TierLookup]) -> List[Optional[Tier]]:
+        return await self._read_async(lambda session: lookup_tiers_async(session, lookups))
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "backend": self.backend,
+            "primary": self.primary.name,
+            "replicas": [{"name": replica.name, "healthy": replica.healthy(now)} for replica in self.replicas],
+        }
+
+
+def create_rate_store(url: str = DATABASE_URL, replica_urls: Sequence[str] = DATABASE_REPLICA_URLS) -> RateStore:
+    if url == MEMORY_URL:
+        return MemoryRateStore()
+    return SQLRateStore(url, replica_urls)
+
+
+_store: Optional[RateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_rate_store() -> RateStore:
+    """The configured store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_rate_store()
+    return _store
+
+
+def set_rate_store(store: Optional[RateStore]) -> Optional[RateStore]:
+    """Replace the store, e.g. with a ``MemoryRateStore`` in tests; returns the previous one."""
+    global _store
+    with _store_lock:
+        previous, _store = _store, store
+    return previous
@@ -0,0 +1,174 @@
+"""Hot reload of the rate sheet.
+
+A new sheet is validated, written to the database and compiled into a
+fresh ``RateTable`` off the request path, then swapped in with
+``set_rate_table``. Every reload also compiles the fee rules file again.
+Quotes already running keep the table they started with. An optional
+watcher thread picks up changes to the rate or fee rules file and reloads
+done by other workers (seen through the content hash in the rate store's
+primary, or a new rate snapshot file when ``RATES_SNAPSHOT_PATH`` is set).
+"""
+import os
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pydantic import TypeAdapter
+
+from app.fees import FEE_RULES_PATH
+from app.loader import RATES_PATH, content_hash_bytes
+from app.rate_engine import RateTable, build_rate_table, get_rate_table, set_rate_table
+from app.rate_file import RATES_SNAPSHOT_PATH, file_state, read_rate_file, write_rate_file
+from app.rate_store import RateStore, get_rate_store
+from app.schemas import RateSheetLane
+
+RATES_WATCH_INTERVAL = float(os.getenv("RATES_WATCH_INTERVAL", "0"))
+
+_rate_sheet = TypeAdapter(List[RateSheetLane])
+
+
+def parse_rate_sheet(raw: bytes) -> List[dict]:
+    """Validate a rate sheet; raises ``pydantic.ValidationError`` if it is malformed."""
+    lanes = _rate_sheet.validate_json(raw)
+    seen = set()
+    for lane in lanes:
+        key = (lane.starting_country, lane.destination_country, lane.shipping_channel)
+        if key in seen:
+            raise ValueError(f"duplicate lane {key}")
+        seen.add(key)
+    return [lane.model_dump() for lane in lanes]
+
+
+class RateReloader:
+    """Serializes reloads and remembers how the last one went."""
+
+    def __init__(self, store: Optional[RateStore] = None, snapshot_path: str = RATES_SNAPSHOT_PATH):
+        self._store = store
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self.last_reload: Optional[dict] = None
+
+    @property
+    def store(self) -> RateStore:
+        """The store given, or the configured one."""
+        return self._store or get_rate_store()
+
+    def publish(self, table: RateTable) -> dict:
+        """Install ``table`` and share it with the other workers through the snapshot file, if any."""
+        set_rate_table(table)
+        result = {"version": table.tag, "lanes": len(table)}
+        if self.snapshot_path:
+            try:
+                write_rate_file(table, self.snapshot_path)
+            except OSError as exc:
+                result["snapshot_error"] = str(exc)
+        return result
+
+    def _record(self, source: str, **result) -> dict:
+        self.last_reload = dict(result, source=source,
+                                finished_at=datetime.now(timezone.utc).isoformat())
+        return self.last_reload
+
+    def reload_bytes(self, raw: bytes, source: str, persist: bool = True) -> dict:
+        with self._lock:
+            try:
+                data = parse_rate_sheet(raw)
+                sheet_hash = content_hash_bytes(raw)
+                table = build_rate_table(data, content_hash=sheet_hash)
+                if persist:
+                    self.store.load_data(lambda: data, sheet_hash, source)
+            except Exception as exc:
+                return self._record(source, status="failed", error=str(exc))
+            return self._record(source, status="ok", **self.publish(table))
+
+    def reload_file(self, path: str = RATES_PATH) -> dict:
+        try:
+            with open(path, "rb") as rate_file:
+                raw = rate_file.read()
+        except OSError as exc:
+            return self._record(os.path.basename(path), status="failed", error=str(exc))
+        return self.reload_bytes(raw, os.path.basename(path))
+
+    def reload_database(self) -> dict:
+        with self._lock:
+            try:
+                table = self.store.load_table(primary=True)
+            except Exception as exc:
+                return self._record("database", status="failed", error=str(exc))
+            return self._record("database", status="ok", **self.publish(table))
+
+    def reload_snapshot(self) -> Optional[dict]:
+        """Switch to the snapshot file written by another worker; None if it is already active."""
+        with self._lock:
+            try:
+                table = read_rate_file(self.snapshot_path)
+            except (OSError, ValueError) as exc:
+                return self._record("snapshot", status="failed", error=str(exc))
+            active = get_rate_table()
+            if active is not None and active.tag == table.tag:
+                return None
+            set_rate_table(table)
+            return self._record("snapshot", status="ok", version=table.tag, lanes=len(table))
+
+
+class RateWatcher(threading.Thread):
+    """Polls the rate and fee rules files and the stored content hash, reloading on change."""
+
+    def __init__(self, reloader: RateReloader, path: str = RATES_PATH, interval: float = RATES_WATCH_INTERVAL,
+                 fee_rules_path: str = FEE_RULES_PATH):
+        super().__init__(name="rate-watcher", daemon=True)
+        self.reloader = reloader
+        self.path = path
+        self.fee_rules_path = fee_rules_path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._file_state = self._stat()
+        self._snapshot_state = file_state(reloader.snapshot_path) if reloader.snapshot_path else None
+
+    def _stat(self):
+        state = []
+        for path in (self.path, self.fee_rules_path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                state.append(None)
+            else:
+                state.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(state) if state[0] is not None else None
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def check(self) -> None:
+        if self.reloader.snapshot_path:
+            snapshot_state = file_state(self.reloader.snapshot_path)
+            if snapshot_state is not None and snapshot_state != self._snapshot_state:
+                self._snapshot_state = snapshot_state
+                self.reloader.reload_snapshot()
+        rates_state = self._stat()
+        if rates_state is not None and rates_state != self._file_state:
+            self._file_state = rates_state
+            self.reloader.reload_file(self.path)
+            return
+        active = get_rate_table()
+        stored_hash = self.reloader.store.content_hash()
+        if stored_hash is not None and (active is None or active.content_hash != stored_hash):
+            self.reloader.reload_database()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exc:
+                print(f"Rate watcher check failed: {exc}")
+
+
+rate_reloader = RateReloader()
+
+
+def start_watcher(interval: float = RATES_WATCH_INTERVAL) -> Optional[RateWatcher]:
+    if interval <= 0:
+        return None
+    watcher = RateWatcher(rate_reloader, interval=interval)
+    watcher.start()
+    return watcher
@@ -0,0 +1,29 @@
+"""Fast JSON output for quote responses.
+
+Quotes are built by the controllers from already validated input with
+``model_construct``, so validating them again through ``response_model``
+and encoding with the stdlib ``json`` module is wasted work. Routes return
+``QuoteJSONResponse`` instead, which FastAPI passes through untouched, and
+keep ``response_model`` only for the OpenAPI schema.
+"""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _model_fields(value: Any):
+    # constructed models keep their fields, nested models included, in __dict__
+    if isinstance(value, BaseModel):
+        return value.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_model_fields, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class QuoteJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,16 +1,243 @@
-from fastapi import APIRouter
-from app.controllers import get_shipping_quotes
-from app.schemas import Quote, QuoteRequest
+import json
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from app.controllers import get_cached_shipping_quotes, aiter_batch_quotes, compare_shipping_quotes
+from app.controllers import optimize_shipment, quote_box_totals
+from app import metrics
+from app.audit import quote_audit
+from app.manifest import ManifestTotals, read_manifest
+from app.quote_cache import quote_cache
+from app.rate_engine import ensure_rate_table, ensure_rate_table_async
+from app.rate_store import get_rate_store
+from app.schemas import Quote, QuoteRequest, ShippingTimeRange, CompareRequest, LaneQuotes
+from app.schemas import CheapestChannel, CostCurve, CostCurveRequest, LaneBreakpoints
+from app.schemas import OptimizeRequest, ShipmentPlans
+from app.responses import QuoteJSONResponse, dumps
+from app.streaming import DuplexStreamingResponse, aiter_lines, is_csv, is_ndjson
 from typing import List
 
 router = APIRouter()
 
+# lets downstream caches key quotes on the rate sheet they were priced with
+RATE_VERSION_HEADER = "X-Rate-Version"
+
 
 @router.get("/")
 async def read_root():
     return {"Hello": "World"}
 
 
-@router.post("/v1/quotes", response_model=List[Quote])
-def get_quotes(quote_request: QuoteRequest):
-    return get_shipping_quotes(quote_request)
+@router.post("/v1/quotes", response_model=List[Quote], response_class=QuoteJSONResponse)
+async def get_quotes(quote_request: QuoteRequest):
+    metrics.record_since_start("parse_validate")
+    rate_table = await _rate_table()
+    metrics.set_lane(rate_table, quote_request.starting_country, quote_request.destination_country)
+    quotes = get_cached_shipping_quotes(quote_request, rate_table)
+    quote_audit.record(quote_request, quotes, rate_table.tag)
+    metrics.handler_done()
+    return QuoteJSONResponse(quotes, headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.post("/v1/quotes/compare", response_model=List[LaneQuotes], response_class=QuoteJSONResponse)
+async def compare_quotes(compare_request: CompareRequest):
+    """Quote every route from an origin, to a destination, or both, in one pass."""
+    rate_table = await _rate_table()
+    results = compare_shipping_quotes(compare_request, rate_table)
+    if quote_audit.enabled:
+        for result in results:
+            # logged per route, as the quote request that would have produced it
+            route_request = QuoteRequest.model_construct(
+                starting_country=result.starting_country, destination_country=result.destination_country,
+                boxes=compare_request.boxes, box_columns=compare_request.box_columns)
+            quote_audit.record(route_request, result.quotes, rate_table.tag)
+    return QuoteJSONResponse(results, headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.post("/v1/quotes/optimize", response_model=ShipmentPlans, response_class=QuoteJSONResponse)
+async def optimize_quote(optimize_request: OptimizeRequest):
+    """Cheapest way to split the boxes over the route's channels, and the cheapest within ``max_transit_days``."""
+    rate_table = await _rate_table()
+    metrics.set_lane(rate_table, optimize_request.starting_country, optimize_request.destination_country)
+    # CPU bound for up to the time budget, so it runs off the event loop
+    plans = await run_in_threadpool(optimize_shipment, optimize_request, rate_table)
+    quote_audit.record(optimize_request, plans, rate_table.tag)
+    return QuoteJSONResponse(plans, headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.post("/v1/quotes/manifest", response_model=List[Quote], response_class=QuoteJSONResponse)
+async def get_manifest_quotes(request: Request, starting_country: str, destination_country: str):
+    """Quote a shipment whose boxes are streamed as a CSV or NDJSON manifest.
+
+    The countries are query parameters and the body is the manifest, one box
+    line per line (``Content-Type: text/csv`` with a header row, or
+    ``application/x-ndjson``). Lines are validated and totalled as they
+    arrive, so the manifest is never held in memory; invalid lines are
+    reported with their line number.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not is_ndjson(content_type) and not is_csv(content_type):
+        raise HTTPException(status_code=415, detail="Manifest must be CSV or NDJSON")
+    rate_table = await _rate_table()
+    metrics.set_lane(rate_table, starting_country, destination_country)
+    totals = ManifestTotals(starting_country, rate_table.origin_fees(starting_country))
+    errors = await read_manifest(request.stream(), is_csv(content_type), totals)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    quotes = quote_box_totals(starting_country, destination_country, totals.totals(), rate_table)
+    if quote_audit.enabled:
+        # the manifest can be huge, so its digest and totals are logged instead of its lines
+        quote_audit.record(totals.audit_request(destination_country), quotes, rate_table.tag)
+    return QuoteJSONResponse(quotes, headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    cache_stats = quote_cache.stats()
+    cache_lines = [
+        "# HELP shipping_quote_cache_lookups_total Quote cache lookups by result.",
+        "# TYPE shipping_quote_cache_lookups_total counter",
+    ] + [f'shipping_quote_cache_lookups_total{{result="{result}"}} {cache_stats[result]}'
+         for result in ("hits", "misses", "stale")] + [
+        "# HELP shipping_quote_cache_entries Entries held by the quote cache.",
+        "# TYPE shipping_quote_cache_entries gauge",
+        f"shipping_quote_cache_entries {cache_stats['entries']}",
+        "# HELP shipping_quote_audit_queued Quotes waiting to be written to the audit log.",
+        "# TYPE shipping_quote_audit_queued gauge",
+        f"shipping_quote_audit_queued {quote_audit.queued()}",
+    ]
+    return PlainTextResponse(metrics.render(cache_lines), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/v1/quotes/cache")
+async def get_quote_cache_stats():
+    return quote_cache.stats()
+
+
+@router.post("/v1/quotes/batch", response_class=DuplexStreamingResponse)
+async def get_batch_quotes(request: Request):
+    """Quote many requests at once.
+
+    The body is either a JSON array of quote requests or NDJSON with one quote
+    request per line (``Content-Type: application/x-ndjson``); NDJSON bodies
+    are read incrementally. The response is NDJSON with one line per request,
+    ``{"index": i, "quotes": [...]}`` on success or
+    ``{"index": i, "status_code": ..., "detail": ...}`` on failure.
+    """
+    if is_ndjson(request.headers.get("content-type", "")):
+        quote_requests = _parse_ndjson_requests(request)
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be JSON or NDJSON")
+        quote_requests = _parse_json_requests(items if isinstance(items, list) else [items])
+
+    rate_table = await _rate_table()
+    # requests waiting for their result, so quotes can be audited; bounded by the batch window
+    in_flight = {}
+
+    async def numbered():
+        index = 0
+        async for quote_request in quote_requests:
+            in_flight[index] = quote_request
+            index += 1
+            yield quote_request
+
+    async def encode():
+        async for result in aiter_batch_quotes(numbered(), rate_table):
+            quote_request = in_flight.pop(result["index"])
+            if "quotes" in result:
+                quote_audit.record(quote_request, result["quotes"], rate_table.tag)
+            yield dumps(result) + b"\n"
+
+    return DuplexStreamingResponse(encode(), headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.get("/v1/lanes/{starting_country}/{destination_country}/{shipping_channel}/breakpoints",
+            response_model=LaneBreakpoints)
+async def get_lane_breakpoints(starting_country: str, destination_country: str, shipping_channel: str):
+    lane = await _lane(starting_country, destination_country, shipping_channel)
+    return LaneBreakpoints(
+        starting_country=lane.starting_country,
+        destination_country=lane.destination_country,
+        shipping_channel=lane.shipping_channel,
+        shipping_time_range=ShippingTimeRange(min_days=lane.min_days, max_days=lane.max_days),
+        tiers=lane.breakpoints(),
+    )
+
+
+@router.post("/v1/lanes/{starting_country}/{destination_country}/{shipping_channel}/costs",
+             response_model=CostCurve, response_class=QuoteJSONResponse)
+def get_lane_costs(starting_country: str, destination_country: str, shipping_channel: str,
+                   curve_request: CostCurveRequest):
+    # a plain def, so pricing and encoding a large grid runs in the threadpool, off the event loop
+    rate_table = _rate_table_sync()
+    lane = _find_lane(rate_table, starting_country, destination_country, shipping_channel)
+    if curve_request.weights is not None:
+        weights = np.asarray(curve_request.weights, dtype=np.float64)
+    else:
+        weights = np.linspace(curve_request.start, curve_request.stop, curve_request.num)
+    costs = lane.costs_at(weights)
+    # orjson encodes the arrays as they are, NaN (no tier covers the weight) as null
+    return QuoteJSONResponse({"weights": weights, "shipping_costs": costs},
+                             headers={RATE_VERSION_HEADER: rate_table.tag})
+
+
+@router.get("/v1/lanes/{starting_country}/{destination_country}/cheapest", response_model=CheapestChannel)
+async def get_cheapest_channel(starting_country: str, destination_country: str, weight_kg: float):
+    rate_table = await _rate_table()
+    cheapest = rate_table.cheapest_channel(starting_country, destination_country, weight_kg)
+    if cheapest is None:
+        raise HTTPException(status_code=404, detail="No channel quotes this weight")
+    lane, per_kg_rate = cheapest
+    return CheapestChannel(
+        shipping_channel=lane.shipping_channel,
+        per_kg_rate=per_kg_rate,
+        shipping_cost=weight_kg * per_kg_rate,
+        shipping_time_range=ShippingTimeRange(min_days=lane.min_days, max_days=lane.max_days),
+    )
+
+
+async def _lane(starting_country: str, destination_country: str, shipping_channel: str):
+    return _find_lane(await _rate_table(), starting_country, destination_country, shipping_channel)
+
+
+def _find_lane(rate_table, starting_country: str, destination_country: str, shipping_channel: str):
+    lane = rate_table.lane(starting_country, destination_country, shipping_channel)
+    if lane is None:
+        raise HTTPException(status_code=404, detail="Lane not found")
+    return lane
+
+
+async def _rate_table():
+    try:
+        return await ensure_rate_table_async(get_rate_store())
+    except Exception:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+def _rate_table_sync():
+    # for plain def routes, which run in the threadpool
+    try:
+        return ensure_rate_table(get_rate_store())
+    except Exception:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+async def _parse_ndjson_requests(request: Request):
+    async for _, line in aiter_lines(request.stream()):
+        try:
+            yield QuoteRequest.model_validate_json(line)
+        except ValidationError as exc:
+            yield exc
+
+
+async def _parse_json_requests(items: list):
+    for item in items:
+        try:
+            yield QuoteRequest.model_validate(item)
+        except ValidationError as exc:
+            yield exc
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, model_validator
+from typing import List, Literal, Optional
 
 
 class Box(BaseModel):
@@ -29,7 +29,225 @@ class Quote(BaseModel):
     shipping_time_range: ShippingTimeRange
 
 
+class BoxColumns(BaseModel):
+    """Box lines as parallel arrays, one entry per line."""
+    count: List[int]
+    weight_kg: List[float]
+    length: List[float]
+    width: List[float]
+    height: List[float]
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        if not len(self.count) == len(self.weight_kg) == len(self.length) == len(self.width) == len(self.height):
+            raise ValueError("box columns must all have the same length")
+        return self
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+
+def _require_box_lines(request):
+    if not request.boxes and not request.box_columns:
+        raise ValueError("at least one box line is required, in boxes or box_columns")
+    return request
+
+
 class QuoteRequest(BaseModel):
     starting_country: str
     destination_country: str
-    boxes: List[Box]
+    boxes: List[Box] = []
+    box_columns: Optional[BoxColumns] = None
+
+    @model_validator(mode="after")
+    def check_box_lines(self):
+        return _require_box_lines(self)
+
+
+class CompareRequest(BaseModel):
+    """A quote request where the origin, the destination or both may be left open."""
+    starting_country: Optional[str] = None
+    destination_country: Optional[str] = None
+    boxes: List[Box] = []
+    box_columns: Optional[BoxColumns] = None
+
+    @model_validator(mode="after")
+    def check_box_lines(self):
+        return _require_box_lines(self)
+
+
+class LaneQuotes(BaseModel):
+    starting_country: str
+    destination_country: str
+    quotes: List[Quote]
+
+
+class RateTier(BaseModel):
+    min_weight_kg: float
+    max_weight_kg: float
+    per_kg_rate: float
+
+    @model_validator(mode="after")
+    def check_bounds(self):
+        if not self.min_weight_kg < self.max_weight_kg:
+            raise ValueError("min_weight_kg must be below max_weight_kg")
+        if self.per_kg_rate < 0:
+            raise ValueError("per_kg_rate must not be negative")
+        return self
+
+
+class RateSheetLane(BaseModel):
+    starting_country: str
+    destination_country: str
+    shipping_channel: str
+    shipping_time_range: ShippingTimeRange
+    rates: List[RateTier]
+
+    @model_validator(mode="after")
+    def check_tiers(self):
+        # tiers are min exclusive, max inclusive, so touching bounds are fine
+        tiers = sorted(self.rates, key=lambda tier: tier.min_weight_kg)
+        for lower, upper in zip(tiers, tiers[1:]):
+            if upper.min_weight_kg < lower.max_weight_kg:
+                raise ValueError("rate tiers must not overlap")
+        return self
+
+
+class FeeRule(BaseModel):
+    """One fee of ``data/fee_rules.json``.
+
+    Service fees are charged once per shipment. Oversized and overweight fees
+    are charged per box whose ``field`` is ``op`` ``threshold``. A matching rule
+    stops the rules named in ``overrides`` from charging the same box;
+    otherwise fees stack.
+    """
+    name: str
+    fee: Literal["service", "oversized", "overweight"]
+    # None applies the rule to every origin
+    origins: Optional[List[str]] = None
+    field: Optional[Literal["weight_kg", "max_dimension"]] = None
+    op: Literal[">", ">="] = ">"
+    threshold: Optional[float] = None
+    amount: float
+    overrides: List[str] = []
+
+    @model_validator(mode="after")
+    def check_condition(self):
+        if self.fee == "service":
+            if self.field is not None or self.threshold is not None:
+                raise ValueError("service fees are per shipment and take no condition")
+        elif self.field is None or self.threshold is None:
+            raise ValueError("box fees need a field and a threshold")
+        return self
+
+
+class TierBreakpoint(BaseModel):
+    min_weight_kg: float
+    max_weight_kg: float
+    per_kg_rate: float
+    min_cost: float
+    max_cost: float
+
+
+class LaneBreakpoints(BaseModel):
+    starting_country: str
+    destination_country: str
+    shipping_channel: str
+    shipping_time_range: ShippingTimeRange
+    tiers: List[TierBreakpoint]
+
+
+# most weights priced by one cost curve request
+MAX_COST_CURVE_POINTS = 100_000
+
+
+class CostCurveRequest(BaseModel):
+    """Weights to price, either listed or as ``num`` evenly spaced points from ``start`` to ``stop``."""
+    weights: Optional[List[float]] = None
+    start: Optional[float] = None
+    stop: Optional[float] = None
+    num: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_grid(self):
+        if self.weights is None and None in (self.start, self.stop, self.num):
+            raise ValueError("either weights or start, stop and num are required")
+        if self.num is not None and not 0 < self.num <= MAX_COST_CURVE_POINTS:
+            raise ValueError(f"num must be between 1 and {MAX_COST_CURVE_POINTS}")
+        if self.weights is not None and len(self.weights) > MAX_COST_CURVE_POINTS:
+            raise ValueError(f"at most {MAX_COST_CURVE_POINTS} weights are priced at once")
+        return self
+
+
+class CostCurve(BaseModel):
+    weights: List[float]
+    # None where no tier covers the weight
+    shipping_costs: List[Optional[float]]
+
+
+class CheapestChannel(BaseModel):
+    shipping_channel: str
+    per_kg_rate: float
+    shipping_cost: float
+    shipping_time_range: ShippingTimeRange
+
+
+class TierQuery(BaseModel):
+    starting_country: str
+    destination_country: str
+    shipping_channel: str
+    weight_kg: float
+
+
+class ManifestQuoteRequest(BaseModel):
+    """A manifest quote as the audit log keeps it: the manifest's digest and totals stand in for its boxes."""
+    starting_country: str
+    destination_country: str
+    manifest_sha256: str
+    box_lines: int
+    chargeable_weight_kg: float
+    oversized_fee: float
+    overweight_fee: float
+
+
+class OptimizeRequest(QuoteRequest):
+    # plans whose slowest channel takes longer than this are reported separately
+    max_transit_days: Optional[int] = None
+    time_budget_ms: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_budget(self):
+        if self.time_budget_ms is not None and not 0 < self.time_budget_ms <= 10_000:
+            raise ValueError("time_budget_ms must be between 0 and 10000")
+        return self
+
+
+class BoxAllocation(BaseModel):
+    # position of the box line, counting boxes first and then box_columns
+    line: int
+    count: int
+
+
+class ChannelAllocation(BaseModel):
+    shipping_channel: str
+    chargeable_weight_kg: float
+    per_kg_rate: float
+    shipping_cost: float
+    service_fee: float
+    shipping_time_range: ShippingTimeRange
+    boxes: List[BoxAllocation]
+
+
+class ShipmentPlan(BaseModel):
+    total_cost: float
+    oversized_fee: float
+    overweight_fee: float
+    max_days: int
+    allocations: List[ChannelAllocation]
+
+
+class ShipmentPlans(BaseModel):
+    cheapest: ShipmentPlan
+    within_transit_limit: Optional[ShipmentPlan] = None
+    # False if the time budget ran out before every split was searched
+    complete: bool
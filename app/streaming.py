@@ -0,0 +1,69 @@
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Tuple
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response whose body is produced while the request body is still being read.
+
+    ``StreamingResponse`` watches ``receive`` for a disconnect while it
+    streams, which would steal the request body chunks from a handler that is
+    still consuming them. This variant leaves ``receive`` to the handler and
+    notices disconnects when sending fails.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """Split a streamed body into ``(line_number, line)`` pairs, skipping blank lines.
+
+    Only the current partial line is buffered, so memory stays flat
+    regardless of the size of the body.
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    """Synchronous counterpart of ``aiter_lines``."""
+    buffer = b""
+    line_number = 0
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def is_ndjson(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type in (NDJSON_MEDIA_TYPE, "application/ndjson", "application/jsonlines")
+
+
+def is_csv(content_type: str) -> bool:
+    return content_type.split(";", 1)[0].strip().lower() in (CSV_MEDIA_TYPE, "application/csv")
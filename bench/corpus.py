@@ -0,0 +1,76 @@
+"""Request corpora for the benchmarks: JSONL files and synthetic generators."""
+import json
+import random
+from typing import Iterator, List, Optional
+
+CHANNELS = ("air", "ocean")
+
+
+def read_corpus(path: str) -> Iterator[dict]:
+    """Quote requests from a JSONL file, one ``QuoteRequest`` body per line."""
+    with open(path, "r") as corpus_file:
+        for line in corpus_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_corpus(path: str, quote_requests) -> None:
+    with open(path, "w") as corpus_file:
+        for quote_request in quote_requests:
+            corpus_file.write(json.dumps(quote_request) + "\n")
+
+
+def synthetic_rate_sheet(lanes: int, tiers: int = 6, seed: int = 0) -> List[dict]:
+    """A rate sheet in the ``data/rates (1).json`` layout with ``lanes`` origin countries.
+
+    Every origin ships to ``USA`` by air and ocean; tiers get cheaper per kg
+    as the weight goes up, like the real sheet.
+    """
+    rng = random.Random(seed)
+    sheet = []
+    for lane in range(lanes):
+        origin = "China" if lane == 0 else f"Country{lane:05d}"
+        for channel in CHANNELS:
+            bounds = sorted(rng.sample(range(1, 5000), tiers - 1))
+            edges = [0] + bounds + [10000]
+            base_rate = rng.uniform(3.0, 10.0) if channel == "air" else rng.uniform(0.5, 2.0)
+            sheet.append({
+                "starting_country": origin,
+                "destination_country": "USA",
+                "shipping_channel": channel,
+                "shipping_time_range": {"min_days": 10, "max_days": 20} if channel == "air"
+                else {"min_days": 40, "max_days": 50},
+                "rates": [{"min_weight_kg": low, "max_weight_kg": high,
+                           "per_kg_rate": round(base_rate * (1 - 0.05 * index), 2)}
+                          for index, (low, high) in enumerate(zip(edges, edges[1:]))],
+            })
+    return sheet
+
+
+def synthetic_requests(rate_sheet: List[dict], count: int, boxes: int = 2,
+                       seed: int = 0, origins: Optional[List[str]] = None) -> Iterator[dict]:
+    """``count`` quote requests spread over the lanes of ``rate_sheet``.
+
+    Box weights are kept small enough that the total stays inside the
+    heaviest tier, so every request is quotable by air.
+    """
+    rng = random.Random(seed)
+    if origins is None:
+        origins = sorted({(item["starting_country"], item["destination_country"]) for item in rate_sheet})
+    # chargeable weight per box line, at most 3 boxes per line
+    per_box_limit = 5000.0 / max(boxes, 1)
+    max_weight = min(40.0, per_box_limit / 3)
+    max_side = min(130.0, (per_box_limit * 6000 / 3) ** (1 / 3))
+    for _ in range(count):
+        starting_country, destination_country = rng.choice(origins)
+        yield {
+            "starting_country": starting_country,
+            "destination_country": destination_country,
+            "boxes": [{
+                "count": rng.randint(1, 3),
+                "weight_kg": rng.uniform(max_weight / 10, max_weight),
+                "length": rng.uniform(max_side / 10, max_side),
+                "width": rng.uniform(max_side / 10, max_side),
+                "height": rng.uniform(max_side / 10, max_side),
+            } for _ in range(boxes)],
+        }
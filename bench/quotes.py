@@ -0,0 +1,309 @@
+"""Quote throughput and latency benchmarks.
+
+Replays a request corpus (a JSONL file or one of the synthetic scenarios)
+against one of three targets:
+
+- ``controller``: calls ``get_shipping_quotes`` directly,
+- ``asgi``: sends requests through the FastAPI app in-process,
+- ``http``: sends requests to a running server at ``--url``.
+
+In-process targets load the rate sheet into a throwaway SQLite database
+with the regular loader instead of Postgres, or into the in-memory rate
+store with ``--store memory``. Results (p50/p95/p99
+latency, requests/sec and allocations per quote) are printed and can be
+written as JSON with ``--output`` and checked against an earlier run
+with ``--compare``.
+
+    python -m bench.quotes --scenario many-boxes --target controller --output run.json
+    python -m bench.quotes --corpus quotes.jsonl --target http --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+from bench.corpus import read_corpus, synthetic_rate_sheet, synthetic_requests
+
+RATES_PATH = "data/rates (1).json"
+RESULT_FORMAT = 1
+
+# name -> (lanes in the synthetic sheet or None for the real one, requests, boxes per request, batch size)
+SCENARIOS = {
+    "default": (None, 2000, 2, None),
+    "many-lanes": (2000, 5000, 2, None),
+    "many-boxes": (None, 200, 2000, None),
+    "batch": (200, 20000, 3, 1000),
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, quotes: int, errors: int) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "quotes": quotes,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "quotes_per_s": quotes / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+            "p50": percentile(ordered, 0.50) * 1000,
+            "p95": percentile(ordered, 0.95) * 1000,
+            "p99": percentile(ordered, 0.99) * 1000,
+            "max": ordered[-1] * 1000 if ordered else 0.0,
+        },
+    }
+
+
+def prepare_rates(rate_sheet: Optional[List[dict]], workdir: str, store_name: str = "sqlite"):
+    """Load the sheet into a SQLite or in-memory rate store and install the compiled table."""
+    from app.rate_engine import reload_rate_table
+    from app.rate_store import MemoryRateStore, SQLRateStore
+
+    path = RATES_PATH
+    if rate_sheet is not None:
+        path = os.path.join(workdir, "rates.json")
+        with open(path, "w") as rate_file:
+            json.dump(rate_sheet, rate_file)
+    if store_name == "memory":
+        store = MemoryRateStore(path=None)
+    else:
+        store = SQLRateStore(f"sqlite:///{os.path.join(workdir, 'rates.db')}")
+    store.load_sheet(path)
+    reload_rate_table(store)
+    return store
+
+
+def measure_allocations(run_one: Callable[[dict], int], quote_requests: List[dict]) -> dict:
+    """Peak traced memory and net allocated blocks per quote, over a sample of requests."""
+    tracemalloc.start()
+    peaks = []
+    blocks_before = sys.getallocatedblocks()
+    quotes = 0
+    try:
+        for quote_request in quote_requests:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            quotes += run_one(quote_request)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base)
+    finally:
+        tracemalloc.stop()
+    quotes = max(quotes, 1)
+    return {
+        "sampled_requests": len(quote_requests),
+        "peak_bytes_per_quote": sum(peaks) / quotes,
+        "net_blocks_per_quote": (sys.getallocatedblocks() - blocks_before) / quotes,
+    }
+
+
+def run_controller(quote_requests: List[dict], batch_size: Optional[int]) -> dict:
+    from fastapi import HTTPException
+    from app.controllers import get_shipping_quotes, iter_batch_quotes
+    from app.schemas import QuoteRequest
+
+    def run_one(body: dict) -> int:
+        try:
+            return len(get_shipping_quotes(QuoteRequest.model_validate(body)))
+        except HTTPException:
+            return 0
+
+    def run_batch(bodies: List[dict]) -> int:
+        results = iter_batch_quotes(QuoteRequest.model_validate(body) for body in bodies)
+        return sum(len(result.get("quotes", ())) for result in results)
+
+    latencies = []
+    quotes = errors = 0
+    started = time.perf_counter()
+    if batch_size:
+        for start in range(0, len(quote_requests), batch_size):
+            request_started = time.perf_counter()
+            quotes += run_batch(quote_requests[start:start + batch_size])
+            latencies.append(time.perf_counter() - request_started)
+    else:
+        for body in quote_requests:
+            request_started = time.perf_counter()
+            produced = run_one(body)
+            latencies.append(time.perf_counter() - request_started)
+            quotes += produced
+            errors += produced == 0
+    result = summarize(latencies, time.perf_counter() - started, quotes, errors)
+    result["allocations"] = measure_allocations(run_one, quote_requests[:200])
+    return result
+
+
+async def _run_client(client, quote_requests: List[dict], batch_size: Optional[int], concurrency: int) -> dict:
+    if batch_size:
+        payloads = [("/v1/quotes/batch", quote_requests[start:start + batch_size])
+                    for start in range(0, len(quote_requests), batch_size)]
+    else:
+        payloads = [("/v1/quotes", body) for body in quote_requests]
+
+    latencies = []
+    counts = {"quotes": 0, "errors": 0}
+    queue = iter(payloads)
+
+    async def worker():
+        for path, payload in queue:
+            request_started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            body = response.content
+            latencies.append(time.perf_counter() - request_started)
+            if response.status_code != 200:
+                counts["errors"] += 1
+            elif batch_size:
+                for line in body.splitlines():
+                    result = json.loads(line)
+                    counts["quotes"] += len(result.get("quotes", ()))
+                    counts["errors"] += "quotes" not in result
+            else:
+                counts["quotes"] += len(json.loads(body))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, counts["quotes"], counts["errors"])
+
+
+async def run_asgi(quote_requests: List[dict], batch_size: Optional[int], concurrency: int, store) -> dict:
+    import httpx
+    from app.rate_store import set_rate_store
+
+    previous = set_rate_store(store)
+    try:
+        from main import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await _run_client(client, quote_requests, batch_size, concurrency)
+    finally:
+        set_rate_store(previous)
+
+
+async def run_http(quote_requests: List[dict], batch_size: Optional[int], concurrency: int, url: str) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60.0) as client:
+        return await _run_client(client, quote_requests, batch_size, concurrency)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Regressions of ``current`` against ``baseline``, as human readable lines."""
+    regressions = []
+    for name, result in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        for quantile in ("p50", "p95", "p99"):
+            now, before = result["latency_ms"][quantile], previous["latency_ms"][quantile]
+            if before and now > before * (1 + threshold):
+                regressions.append(f"{name}: {quantile} {before:.3f}ms -> {now:.3f}ms")
+        now, before = result["requests_per_s"], previous["requests_per_s"]
+        if before and now < before * (1 - threshold):
+            regressions.append(f"{name}: requests/s {before:.1f} -> {now:.1f}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark quote latency and throughput.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="default")
+    parser.add_argument("--corpus", help="JSONL file of quote requests, replaces the scenario's requests")
+    parser.add_argument("--requests", type=int, help="override the number of requests")
+    parser.add_argument("--boxes", type=int, help="override the box lines per request")
+    parser.add_argument("--batch-size", type=int, help="send requests through the batch endpoint")
+    parser.add_argument("--target", choices=("controller", "asgi", "http"), default="controller")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--store", choices=("sqlite", "memory"), default="sqlite",
+                        help="rate store of the in-process targets")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+
+    lanes, requests, boxes, batch_size = SCENARIOS[args.scenario]
+    requests = args.requests or requests
+    boxes = args.boxes or boxes
+    batch_size = args.batch_size or batch_size
+
+    # None keeps the real rate sheet
+    rate_sheet = synthetic_rate_sheet(lanes, seed=args.seed) if lanes else None
+    if args.corpus:
+        quote_requests = list(read_corpus(args.corpus))
+    else:
+        if rate_sheet is None:
+            with open(RATES_PATH, "r") as rate_file:
+                lanes_sheet = json.load(rate_file)
+        else:
+            lanes_sheet = rate_sheet
+        quote_requests = list(synthetic_requests(lanes_sheet, requests, boxes, seed=args.seed))
+
+    name = f"{args.corpus or args.scenario}/{args.target}"
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.target == "http":
+            result = asyncio.run(run_http(quote_requests, batch_size, args.concurrency, args.url))
+        else:
+            store = prepare_rates(rate_sheet, workdir, args.store)
+            if args.target == "controller":
+                result = run_controller(quote_requests, batch_size)
+            else:
+                result = asyncio.run(run_asgi(quote_requests, batch_size, args.concurrency, store))
+
+    report = {
+        "format": RESULT_FORMAT,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": {name: dict(result, scenario=args.scenario, target=args.target,
+                               boxes_per_request=boxes, batch_size=batch_size)},
+    }
+
+    latency = result["latency_ms"]
+    print(f"{name}: {result['requests']} requests, {result['errors']} errors, "
+          f"{result['requests_per_s']:.1f} req/s, {result['quotes_per_s']:.1f} quotes/s, "
+          f"p50 {latency['p50']:.3f}ms p95 {latency['p95']:.3f}ms p99 {latency['p99']:.3f}ms")
+    if "allocations" in result:
+        allocations = result["allocations"]
+        print(f"  {allocations['peak_bytes_per_quote']:.0f} peak bytes/quote, "
+              f"{allocations['net_blocks_per_quote']:.2f} net blocks/quote")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Per-quote cost of building and serializing quote responses.
+
+Compares the old path, where quotes are validated pydantic models that
+``response_model`` validates again before the stdlib ``json`` encoder runs,
+with the fast path used by the quote routes: ``model_construct`` plus
+``app.responses.dumps``.
+
+    python -m bench.serialization --quotes 20000 --output serialization.json
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.responses import dumps
+from app.schemas import CostBreakdown, Quote, ShippingTimeRange
+
+
+def validated_quote(index: int) -> Quote:
+    return Quote(
+        shipping_channel="air" if index % 2 else "ocean",
+        total_cost=1000.0 + index,
+        cost_breakdown=CostBreakdown(shipping_cost=700.0 + index, service_fee=300.0,
+                                     oversized_fee=0.0, overweight_fee=0.0),
+        shipping_time_range=ShippingTimeRange(min_days=15, max_days=20),
+    )
+
+
+def constructed_quote(index: int) -> Quote:
+    return Quote.model_construct(
+        shipping_channel="air" if index % 2 else "ocean",
+        total_cost=1000.0 + index,
+        cost_breakdown=CostBreakdown.model_construct(shipping_cost=700.0 + index, service_fee=300.0,
+                                                     oversized_fee=0.0, overweight_fee=0.0),
+        shipping_time_range=ShippingTimeRange.model_construct(min_days=15, max_days=20),
+    )
+
+
+_response_model = TypeAdapter(List[Quote])
+
+
+def validated_path(count: int) -> bytes:
+    quotes = [validated_quote(index) for index in range(count)]
+    # what response_model did: dump, validate again, encode with json
+    content = _response_model.validate_python(jsonable_encoder(quotes))
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(count: int) -> bytes:
+    return dumps([constructed_quote(index) for index in range(count)])
+
+
+def best_of(function, count: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(count)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark quote response serialization.")
+    parser.add_argument("--quotes", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    assert json.loads(validated_path(3)) == json.loads(fast_path(3))
+
+    validated = best_of(validated_path, args.quotes, args.repeat)
+    fast = best_of(fast_path, args.quotes, args.repeat)
+    result = {
+        "quotes": args.quotes,
+        "validated_us_per_quote": validated / args.quotes * 1e6,
+        "fast_us_per_quote": fast / args.quotes * 1e6,
+        "saved_us_per_quote": (validated - fast) / args.quotes * 1e6,
+        "speedup": validated / fast if fast else None,
+    }
+    print(f"validated: {result['validated_us_per_quote']:.2f}us/quote, "
+          f"fast: {result['fast_us_per_quote']:.2f}us/quote, "
+          f"saved {result['saved_us_per_quote']:.2f}us/quote ({result['speedup']:.1f}x)")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,50 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import router
-from app.models import Base
-from app.database import create_database
+from app.admin import is_admin, router as admin_router
+from app.loader import RATES_PATH
+from app.reload import rate_reloader, start_watcher
+from app.audit import quote_audit, start_audit_log
+from app.metrics import MetricsMiddleware, instrument_engine
+from app.profiling import ProfilingMiddleware
+from app.rate_engine import reload_rate_table, set_rate_table
+from app.rate_file import RATES_SNAPSHOT_PATH, load_current_snapshot
+from app.rate_store import get_rate_store
 from populate_db import populate_db
 
 app = FastAPI()
 
 app.include_router(router)
+app.include_router(admin_router)
+# innermost, so reports see the request timings set up by MetricsMiddleware
+app.add_middleware(ProfilingMiddleware, authorize=is_admin)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+for db_engine in get_rate_store().engines():
+    instrument_engine(db_engine)
 
 
 @app.on_event("startup")
 async def startup_event():
-    create_database()
-    populate_db()
+    # a snapshot written by another worker for the current rate files saves the database round trip
+    snapshot = load_current_snapshot(RATES_SNAPSHOT_PATH, RATES_PATH) if RATES_SNAPSHOT_PATH else None
+    if snapshot is not None:
+        set_rate_table(snapshot)
+    else:
+        populate_db()
+        rate_reloader.publish(reload_rate_table(get_rate_store()))
+    start_watcher()
+    start_audit_log(engine=get_rate_store().engine)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    quote_audit.close()
 
 if __name__ == "__main__":
     uvicorn.run(app, port=8000)
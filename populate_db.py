@@ -1,48 +1,11 @@
-import os
-import json
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.models import Base, ShippingRate, Rate
-from app.database import DATABASE_URL
+from app.loader import RATES_PATH
+from app.rate_store import get_rate_store
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-
-def create_database():
-    Base.metadata.create_all(bind=engine)
-
-
-def populate_db():
-    with open('data/rates (1).json', 'r') as json_file:
-        data = json.load(json_file)
-
-    # create_database() # use database.py to create database
-
-    session = SessionLocal()
-    if session.query(ShippingRate).count() > 0:
-        return
-
-    for item in data:
-        shipping_rate = ShippingRate(
-            starting_country=item["starting_country"],
-            destination_country=item["destination_country"],
-            shipping_channel=item["shipping_channel"],
-            min_days=item["shipping_time_range"]["min_days"],
-            max_days=item["shipping_time_range"]["max_days"],
-        )
-
-        for rate_data in item["rates"]:
-            rate = Rate(
-                min_weight_kg=rate_data["min_weight_kg"],
-                max_weight_kg=rate_data["max_weight_kg"],
-                per_kg_rate=rate_data["per_kg_rate"],
-            )
-            shipping_rate.rates.append(rate)
-
-        session.add(shipping_rate)
-
-    session.commit()
+def populate_db(path: str = RATES_PATH, force: bool = False) -> bool:
+    # see app/loader.py for the locking and skip-if-unchanged behaviour; a sheet stored since the
+    # file last changed (uploaded through /v1/admin/rates/reload) is kept rather than reverted
+    return get_rate_store().load_sheet(path, force=force, keep_newer=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+import json
+import threading
+import orjson
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from app.audit import (DatabaseSink, GzipFileSink, QuoteAuditLog, diff_entry, iter_log_files, iter_log_table,
+                       start_audit_log)
+from app.controllers import get_shipping_quotes
+from app.rate_engine import build_rate_table, get_rate_table, set_rate_table
+from app.responses import dumps
+from app.schemas import Box, QuoteRequest
+
+
+def sheet(per_kg_rate):
+    return [{
+        "starting_country": "China", "destination_country": "USA", "shipping_channel": "air",
+        "shipping_time_range": {"min_days": 1, "max_days": 2},
+        "rates": [{"min_weight_kg": 0, "max_weight_kg": 1000, "per_kg_rate": per_kg_rate}],
+    }]
+
+
+def quote_request():
+    return QuoteRequest(starting_country="China", destination_country="USA",
+                        boxes=[Box(count=2, weight_kg=10.0, length=10.0, width=10.0, height=10.0)])
+
+
+def test_write_behind_log_round_trips_and_replays(tmp_path):
+    old_rates = build_rate_table(sheet(2.0))
+    request = quote_request()
+    quotes = get_shipping_quotes(request, old_rates)
+
+    log = QuoteAuditLog(batch_size=2, flush_interval=0.01)
+    log.start(GzipFileSink(str(tmp_path)))
+    for _ in range(3):
+        assert log.record(request, quotes, old_rates.tag)
+    log.close()
+
+    # Test case 1: every entry is written, a file past the rotation size is not appended to
+    GzipFileSink(str(tmp_path / "rotated"), rotate_bytes=1).write([{"n": 1}])
+    rotating = GzipFileSink(str(tmp_path / "rotated"), rotate_bytes=1)
+    rotating.write([{"n": 2}])
+    rotating.write([{"n": 3}])
+    assert len(list((tmp_path / "rotated").iterdir())) == 3
+    assert [entry["n"] for entry in iter_log_files([str(tmp_path / "rotated")])] == [1, 2, 3]
+    entries = list(iter_log_files([str(tmp_path)]))
+    assert len(entries) == 3
+    assert entries[0]["rate_version"] == old_rates.tag
+    assert entries[0]["quotes"][0]["total_cost"] == quotes[0].total_cost
+
+    # Test case 2: replaying against the same rates finds nothing, new rates show the change
+    assert diff_entry(entries[0], old_rates) == []
+    diffs = diff_entry(entries[0], build_rate_table(sheet(3.0)))
+    assert [(diff["shipping_channel"], diff["delta"]) for diff in diffs] == [("air", 20.0)]
+
+
+class BlockedSink:
+    """Takes entries, but only writes them once released."""
+
+    def __init__(self):
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.written = []
+
+    def write(self, entries):
+        self.writing.set()
+        self.release.wait(5)
+        self.written.extend(entries)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    # Test case 1: a log that was never started ignores entries
+    assert not QuoteAuditLog().record(quote_request(), [], "1")
+
+    request = quote_request()
+    sink = BlockedSink()
+    log = QuoteAuditLog(max_queued=2, batch_size=1)
+    log.start(sink)
+    try:
+        # Test case 2: while the writer is stuck, the queue fills up and further entries are dropped
+        assert log.record(request, [], "1")
+        assert sink.writing.wait(5)
+        assert log.record(request, [], "1") and log.record(request, [], "1")
+        assert not log.record(request, [], "1")
+        assert log.queued() == 2
+    finally:
+        sink.release.set()
+        log.close(timeout=5)
+
+    # Test case 3: closing writes out everything that was accepted
+    assert len(sink.written) == 3
+    assert log.queued() == 0 and not log.enabled
+
+
+def test_audit_log_starts_with_a_given_sink():
+    sink = BlockedSink()
+    sink.release.set()
+    log = start_audit_log(sink=sink)
+    try:
+        assert log.enabled
+        rates = build_rate_table(sheet(2.0))
+        assert log.record(quote_request(), get_shipping_quotes(quote_request(), rates), rates.tag)
+    finally:
+        log.close(timeout=5)
+
+    # Test case 1: the entry reaches the sink on close
+    assert [entry["rate_version"] for entry in sink.written] == [rates.tag]
+    assert not log.enabled
+
+
+def test_database_sink_bulk_inserts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}")
+    rates = build_rate_table(sheet(2.0))
+    request = quote_request()
+    quotes = get_shipping_quotes(request, rates)
+    DatabaseSink(engine).write([{"logged_at": 1700000000.0, "rate_version": rates.tag,
+                                 "request": request, "quotes": quotes}] * 2)
+
+    entries = list(iter_log_table(engine))
+    assert len(entries) == 2
+    assert entries[0]["logged_at"] == 1700000000.0
+    assert json.loads(json.dumps(entries[0]["request"]))["boxes"][0]["count"] == 2
+    assert diff_entry(entries[0], rates) == []
+
+
+def test_manifest_and_optimize_quotes_are_logged():
+    from main import app
+
+    rates = build_rate_table(sheet(2.0))
+    previous = get_rate_table()
+    sink = BlockedSink()
+    sink.release.set()
+    set_rate_table(rates)
+    log = start_audit_log(sink=sink)
+    try:
+        client = TestClient(app)
+        manifest = b"count,weight_kg,length,width,height\n2,10,10,10,10\n"
+        assert client.post("/v1/quotes/manifest?starting_country=China&destination_country=USA", content=manifest,
+                           headers={"Content-Type": "text/csv"}).status_code == 200
+        assert client.post("/v1/quotes/optimize", json=quote_request().model_dump()).status_code == 200
+    finally:
+        log.close(timeout=5)
+        set_rate_table(previous)
+    manifest_entry, optimize_entry = [orjson.loads(dumps(entry)) for entry in sink.written]
+
+    # Test case 1: the manifest is logged by its digest and totals, not its lines
+    assert "boxes" not in manifest_entry["request"]
+    assert len(manifest_entry["request"]["manifest_sha256"]) == 64
+    assert manifest_entry["request"]["box_lines"] == 1
+    assert manifest_entry["quotes"][0]["total_cost"] == get_shipping_quotes(quote_request(), rates)[0].total_cost
+
+    # Test case 2: the optimize request is logged with its plans
+    assert optimize_entry["request"]["boxes"][0]["count"] == 2
+    assert optimize_entry["quotes"]["cheapest"]["total_cost"] == manifest_entry["quotes"][0]["total_cost"]
+
+    # Test case 3: replay re-prices the manifest totals and leaves plans alone
+    assert diff_entry(manifest_entry, rates) == []
+    assert [diff["delta"] for diff in diff_entry(manifest_entry, build_rate_table(sheet(3.0)))] == [20.0]
+    assert diff_entry(optimize_entry, build_rate_table(sheet(3.0))) == []
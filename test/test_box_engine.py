@@ -0,0 +1,63 @@
+import random
+import pytest
+from app.schemas import QuoteRequest, Box, BoxColumns
+from app.controllers import calculate_shipping_cost, calculate_box_totals
+from app.box_engine import calculate_box_totals as calculate_column_totals
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+from main import app
+
+
+def random_boxes(n, seed=7):
+    rng = random.Random(seed)
+    return [Box(count=rng.randint(1, 20), weight_kg=rng.uniform(0.1, 60.0),
+                length=rng.uniform(1.0, 150.0), width=rng.uniform(1.0, 150.0),
+                height=rng.choice([rng.uniform(1.0, 150.0), 70.0, 120.0]))
+            for _ in range(n)]
+
+
+@pytest.mark.parametrize("starting_country", ["China", "India", "Vietnam"])
+def test_vectorized_totals_match_scalar_path(starting_country):
+    boxes = random_boxes(5000)
+    weight_list, oversized_fee_list, overweight_fee_list = zip(
+        *[calculate_shipping_cost(box, starting_country) for box in boxes])
+
+    totals = calculate_column_totals(
+        [box.count for box in boxes], [box.weight_kg for box in boxes], [box.length for box in boxes],
+        [box.width for box in boxes], [box.height for box in boxes], starting_country)
+    # bit-for-bit, not approximately
+    assert totals == (sum(weight_list), sum(oversized_fee_list), sum(overweight_fee_list))
+
+
+def test_columnar_request_matches_box_request():
+    boxes = random_boxes(100)
+    columns = BoxColumns(count=[box.count for box in boxes], weight_kg=[box.weight_kg for box in boxes],
+                         length=[box.length for box in boxes], width=[box.width for box in boxes],
+                         height=[box.height for box in boxes])
+    by_box = QuoteRequest(starting_country="India", destination_country="USA", boxes=boxes[:3])
+    by_column = QuoteRequest(starting_country="India", destination_country="USA",
+                             box_columns=BoxColumns(**{field: values[:3] for field, values in columns}))
+    assert calculate_box_totals(by_box) == calculate_box_totals(by_column)
+
+    mixed = QuoteRequest(starting_country="India", destination_country="USA", boxes=boxes[:40],
+                         box_columns=BoxColumns(**{field: values[40:] for field, values in columns}))
+    assert calculate_box_totals(mixed) == calculate_box_totals(
+        QuoteRequest(starting_country="India", destination_country="USA", boxes=boxes))
+
+
+def test_box_columns_must_line_up():
+    with pytest.raises(ValidationError):
+        BoxColumns(count=[1, 2], weight_kg=[1.0], length=[1.0], width=[1.0], height=[1.0])
+
+
+def test_requests_without_box_lines_are_rejected():
+    client = TestClient(app)
+    empty_columns = {"count": [], "weight_kg": [], "length": [], "width": [], "height": []}
+
+    # Test case 1: no boxes at all, or only empty columns, is a client error rather than a failed quote
+    for body in ({}, {"boxes": []}, {"box_columns": empty_columns}):
+        body = {"starting_country": "China", "destination_country": "USA", **body}
+        assert client.post("/v1/quotes", json=body).status_code == 422
+        assert client.post("/v1/quotes/compare", json=body).status_code == 422
+    with pytest.raises(ValidationError):
+        QuoteRequest(starting_country="China", destination_country="USA", box_columns=BoxColumns(**empty_columns))
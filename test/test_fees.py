@@ -0,0 +1,88 @@
+import json
+import random
+import pytest
+from pydantic import ValidationError
+from app.box_engine import calculate_box_totals as calculate_column_totals
+from app.controllers import calculate_shipping_cost, get_shipping_quotes
+from app.fees import load_fee_schedule, parse_fee_rules
+from app.rate_engine import build_rate_table
+from app.schemas import Box, QuoteRequest
+
+RULES = [
+    {"name": "service_mexico", "fee": "service", "origins": ["Mexico"], "amount": 50},
+    {"name": "heavy", "fee": "overweight", "field": "weight_kg", "threshold": 30, "amount": 80},
+    {"name": "heavy_mexico", "fee": "overweight", "origins": ["Mexico"], "field": "weight_kg", "op": ">=",
+     "threshold": 10, "amount": 25, "overrides": ["heavy"]},
+    {"name": "long", "fee": "oversized", "field": "max_dimension", "threshold": 100, "amount": 40},
+    {"name": "long_mexico", "fee": "oversized", "origins": ["Mexico"], "field": "max_dimension",
+     "threshold": 50, "amount": 10},
+]
+
+
+def sheet():
+    return [{
+        "starting_country": "Mexico", "destination_country": "USA", "shipping_channel": "air",
+        "shipping_time_range": {"min_days": 1, "max_days": 2},
+        "rates": [{"min_weight_kg": 0, "max_weight_kg": 100000, "per_kg_rate": 2.0}],
+    }]
+
+
+def test_rules_override_and_stack():
+    fees = parse_fee_rules(json.dumps(RULES).encode())
+    mexico = fees.for_origin("Mexico")
+
+    # Test case 1: the Mexico overweight fee replaces the general one, oversized fees stack
+    box = Box(count=2, weight_kg=40.0, length=120.0, width=1.0, height=1.0)
+    assert calculate_shipping_cost(box, "Mexico", mexico) == (80.0, (40 + 10) * 2, 25 * 2)
+    # Test case 2: other origins only get the rules without origins
+    assert calculate_shipping_cost(box, "Peru", fees.for_origin("Peru")) == (80.0, 40 * 2, 80 * 2)
+    assert mexico.service_fee == 50 and fees.for_origin("Peru").service_fee == 0
+
+    # Test case 3: the vector masks give bit-for-bit the same totals as the scalar rules
+    rng = random.Random(3)
+    boxes = [Box(count=rng.randint(1, 9), weight_kg=rng.choice([rng.uniform(0, 50), 10.0, 30.0]),
+                 length=rng.uniform(1, 150), width=rng.uniform(1, 150), height=rng.choice([50.0, 100.0]))
+             for _ in range(2000)]
+    weight_list, oversized_fee_list, overweight_fee_list = zip(
+        *[calculate_shipping_cost(box, "Mexico", mexico) for box in boxes])
+    totals = calculate_column_totals(
+        [box.count for box in boxes], [box.weight_kg for box in boxes], [box.length for box in boxes],
+        [box.width for box in boxes], [box.height for box in boxes], "Mexico", mexico)
+    assert totals == (sum(weight_list), sum(oversized_fee_list), sum(overweight_fee_list))
+
+
+def test_rules_ship_with_the_rate_table():
+    default = build_rate_table(sheet(), content_hash="a" * 64)
+    custom = build_rate_table(sheet(), content_hash="a" * 64, fees=parse_fee_rules(json.dumps(RULES).encode()))
+    request = QuoteRequest(starting_country="Mexico", destination_country="USA",
+                           boxes=[Box(count=1, weight_kg=20.0, length=60.0, width=1.0, height=1.0)])
+
+    # Test case 1: the same rates price differently under the new rules, and say so in their version
+    assert get_shipping_quotes(request, default)[0].total_cost == 40.0
+    assert get_shipping_quotes(request, custom)[0].total_cost == 40.0 + 50 + 25 + 10
+    assert default.tag != custom.tag
+
+    # Test case 2: the shipped rules file compiles
+    assert load_fee_schedule().for_origin("China").service_fee == 300
+
+
+def test_constants_apply_without_a_rules_file(tmp_path):
+    shipped = load_fee_schedule()
+    fallback = load_fee_schedule(str(tmp_path / "missing.json"))
+
+    # Test case 1: the defaults in app.constants charge what the shipped rules file charges
+    for origin in ("China", "India", "Vietnam", "Mexico"):
+        assert fallback.for_origin(origin).service_fee == shipped.for_origin(origin).service_fee
+        for weight_kg in (14.9, 15.0, 30.0, 30.5):
+            for max_dimension in (70.0, 70.5, 120.0, 121.0):
+                assert (fallback.for_origin(origin).box_fees(weight_kg, max_dimension, 2)
+                        == shipped.for_origin(origin).box_fees(weight_kg, max_dimension, 2))
+
+
+def test_malformed_rules_are_rejected():
+    with pytest.raises(ValueError):
+        parse_fee_rules(json.dumps(RULES + [{"name": "x", "fee": "oversized", "field": "max_dimension",
+                                             "threshold": 1, "amount": 1, "overrides": ["missing"]}]).encode())
+    with pytest.raises(ValidationError):
+        parse_fee_rules(json.dumps([{"name": "x", "fee": "service", "field": "weight_kg", "threshold": 1,
+                                     "amount": 1}]).encode())
@@ -0,0 +1,37 @@
+import json
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from app.loader import load_rate_sheet, RATES_PATH
+from app.models import Rate, RateSheetMeta
+from app.rate_engine import build_rate_table, load_rate_table
+
+
+def test_load_rate_sheet_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rates.db'}")
+
+    # Test case 1: first load fills the tables and matches the source file
+    assert load_rate_sheet(engine, RATES_PATH) is True
+    with open(RATES_PATH, 'r') as json_file:
+        expected = build_rate_table(json.load(json_file))
+    loaded = load_rate_table(sessionmaker(bind=engine)())
+    assert len(loaded) == len(expected)
+    for lane in expected:
+        assert loaded.lane(*lane.key).tiers == lane.tiers
+
+    # Test case 2: same content is skipped
+    assert load_rate_sheet(engine, RATES_PATH) is False
+
+    # Test case 3: changed content replaces the previous sheet in small batches
+    changed = tmp_path / "rates.json"
+    changed.write_text(json.dumps([{
+        "starting_country": "China", "destination_country": "USA", "shipping_channel": "air",
+        "shipping_time_range": {"min_days": 1, "max_days": 2},
+        "rates": [{"min_weight_kg": i, "max_weight_kg": i + 1, "per_kg_rate": 1.0} for i in range(25)],
+    }]))
+    assert load_rate_sheet(engine, str(changed), batch_size=10) is True
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(Rate)).scalar() == 25
+        assert conn.execute(select(RateSheetMeta.source)).scalar() == "rates.json"
+
+    # Test case 4: force reloads unchanged content
+    assert load_rate_sheet(engine, str(changed), force=True) is True
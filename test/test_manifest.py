@@ -0,0 +1,55 @@
+import asyncio
+import random
+from app.controllers import calculate_box_totals
+from app.manifest import ManifestTotals, read_manifest
+from app.rate_engine import origin_fees
+from app.schemas import Box, QuoteRequest
+
+
+async def chunked(body, size=7):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def read(body, is_csv, starting_country="China", window=16):
+    totals = ManifestTotals(starting_country, origin_fees(starting_country), window=window)
+    errors = asyncio.run(read_manifest(chunked(body), is_csv, totals))
+    return totals, errors
+
+
+def test_manifest_totals_match_quote_request():
+    rng = random.Random(3)
+    boxes = [Box(count=rng.randint(1, 5), weight_kg=round(rng.uniform(0.5, 40), 2),
+                 length=round(rng.uniform(5, 150), 1), width=round(rng.uniform(5, 80), 1),
+                 height=round(rng.uniform(5, 80), 1)) for _ in range(100)]
+    expected = calculate_box_totals(QuoteRequest(starting_country="China", destination_country="USA", boxes=boxes))
+
+    # Test case 1: CSV with reordered and extra columns, spread over several windows
+    csv_body = "note,height,width,length,weight_kg,count\n" + "".join(
+        f'"a, b",{box.height},{box.width},{box.length},{box.weight_kg},{box.count}\n' for box in boxes)
+    totals, errors = read(csv_body.encode(), is_csv=True)
+    assert errors == []
+    assert totals.box_lines == 100
+    assert totals.totals() == expected
+
+    # Test case 2: NDJSON, blank lines skipped
+    ndjson_body = "\n\n".join(box.model_dump_json() for box in boxes)
+    totals, errors = read(ndjson_body.encode(), is_csv=False)
+    assert errors == []
+    assert totals.totals() == expected
+
+
+def test_manifest_errors_carry_line_numbers():
+    body = b"count,weight_kg,length,width,height\n1,2,3,4,5\n1.5,2,3,4,5\n\n1,heavy,3,4,5\n1,2,3\n"
+    _, errors = read(body, is_csv=True)
+    assert [error["loc"] for error in errors] == [
+        ["body", "line", 3, "count"], ["body", "line", 5, "weight_kg"],
+        ["body", "line", 6, "width"], ["body", "line", 6, "height"]]
+
+    # Test case 1: a header without the box columns stops the read
+    _, errors = read(b"count,weight\n1,2\n", is_csv=True)
+    assert errors[0]["loc"] == ["body", "line", 1] and "weight_kg" in errors[0]["msg"]
+
+    # Test case 2: an empty manifest has no boxes to quote
+    _, errors = read(b"count,weight_kg,length,width,height\n", is_csv=True)
+    assert errors[0]["msg"] == "manifest has no box lines"
@@ -0,0 +1,69 @@
+from app.metrics import LANE_SECONDS, UNKNOWN_LANE, Histogram, Counter, RequestTimings, _current, set_lane, stage
+from app.controllers import price_lanes
+from app.rate_store import MemoryRateStore
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5.0, "/a")
+    lines = list(histogram.render())
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+
+def test_counter_escapes_labels():
+    counter = Counter("test_total", "Test.", ("exception",))
+    counter.inc('Bad"Name')
+    assert 'test_total{exception="Bad\\"Name"} 1' in list(counter.render())
+
+
+def test_stage_is_a_no_op_outside_requests():
+    with stage("box_fees"):
+        pass
+
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        with stage("box_fees"):
+            pass
+        with stage("box_fees"):
+            pass
+    finally:
+        _current.reset(token)
+    assert list(timings.stages) == ["box_fees"]
+
+
+def test_made_up_countries_share_the_unknown_lane():
+    rate_table = MemoryRateStore().load_table()
+    before = set(LANE_SECONDS._series)
+    for starting_country, destination_country in [("China", "USA"), ("China", "Atlantis"), ("x" * 50, "USA")]:
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            set_lane(rate_table, starting_country, destination_country)
+        finally:
+            _current.reset(token)
+        LANE_SECONDS.observe(0.01, timings.lane)
+
+    # Test case 1: only the real route and the shared unknown label have series
+    assert set(LANE_SECONDS._series) - before <= {("China->USA",), (UNKNOWN_LANE,)}
+    assert ("China->Atlantis",) not in LANE_SECONDS._series
+
+
+def test_pricing_is_timed_apart_from_the_response_model():
+    rate_table = MemoryRateStore().load_table()
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        quotes = price_lanes("China", (50.0, 0.0, 0.0), rate_table.channels("China", "USA"),
+                             rate_table.origin_fees("China"))
+    finally:
+        _current.reset(token)
+
+    # Test case 1: tier lookups and costs count as rate lookup, building the quotes as response model
+    assert quotes
+    assert list(timings.stages) == ["rate_lookup", "response_model"]
@@ -0,0 +1,117 @@
+import os
+import random
+import pytest
+from sqlalchemy import create_engine, exc, insert, inspect, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from app.loader import RATES_PATH, load_rate_data, load_rate_sheet
+from app.migrations import MIGRATIONS, TIER_OVERLAP_CONSTRAINT
+from app.models import Rate, SchemaMigration
+from app.rate_engine import _tier_lookup_query, build_rate_table, lookup_tiers
+from app.rate_store import MemoryRateStore
+
+
+def test_existing_database_is_migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rates.db'}")
+    # the tables as they were created before the lane and tier indexes
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE shipping_rates (id INTEGER PRIMARY KEY, starting_country VARCHAR, "
+                          "destination_country VARCHAR, shipping_channel VARCHAR, min_days INTEGER, max_days INTEGER)"))
+        conn.execute(text("CREATE TABLE rates (id INTEGER PRIMARY KEY, min_weight_kg FLOAT, max_weight_kg FLOAT, "
+                          "per_kg_rate FLOAT, shipping_rate_id INTEGER REFERENCES shipping_rates (id))"))
+
+    assert load_rate_sheet(engine, RATES_PATH)
+    indexes = {index["name"]: index for table in ("shipping_rates", "rates")
+               for index in inspect(engine).get_indexes(table)}
+    assert indexes["ix_shipping_rates_lane"]["column_names"] == [
+        "starting_country", "destination_country", "shipping_channel"]
+    assert indexes["ix_shipping_rates_lane"]["unique"]
+    assert indexes["ix_rates_shipping_rate_id"]["column_names"] == ["shipping_rate_id"]
+
+    # Test case 1: every migration runs once
+    assert load_rate_sheet(engine, RATES_PATH, force=True)
+    with engine.connect() as conn:
+        assert list(conn.execute(select(SchemaMigration.version)).scalars()) == [
+            version for version, _, _ in MIGRATIONS]
+
+
+def test_tier_lookup_matches_the_compiled_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rates.db'}")
+    load_rate_sheet(engine, RATES_PATH)
+    memory = MemoryRateStore()
+    lanes = [lane.key for lane in memory.load_table()]
+    rng = random.Random(7)
+    lookups = [(*rng.choice(lanes), rng.choice([0.0, 0.5, 100.0, 100.5, rng.uniform(0, 3000)]))
+               for _ in range(200)]
+    lookups.append(("China", "Mars", "air", 10.0))
+
+    # Test case 1: one query answers every lookup like LaneRates.per_kg_rate
+    with sessionmaker(bind=engine)() as session:
+        found = lookup_tiers(session, lookups)
+    assert found == memory.lookup_tiers(lookups)
+    assert found[-1] is None and any(tier is not None for tier in found)
+
+    # Test case 2: on Postgres the weight is matched against the range column
+    sql = str(_tier_lookup_query(lookups[:2], postgres=True).compile(dialect=postgresql.dialect()))
+    assert "rates.weight_range @> CAST(wanted.weight_kg AS FLOAT)" in sql
+
+
+# a scratch Postgres database; its public schema is dropped and recreated
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def postgres_engine():
+    if not TEST_POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    engine = create_engine(TEST_POSTGRES_URL)
+    try:
+        engine.connect().close()
+    except exc.OperationalError:
+        pytest.skip("Postgres is unavailable")
+    # start from an empty database, so the migrations run from scratch
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    yield engine
+    engine.dispose()
+
+
+def test_postgres_tier_lookup_matches_float_bounds(postgres_engine):
+    # 10.000000000000002 and 10.000000000000004 are adjacent floats that round to the same numeric
+    bound = 10.000000000000002
+    sheet = [{"starting_country": "China", "destination_country": "USA", "shipping_channel": "air",
+              "shipping_time_range": {"min_days": 1, "max_days": 2},
+              "rates": [{"min_weight_kg": 0, "max_weight_kg": bound, "per_kg_rate": 5.0},
+                        {"min_weight_kg": bound, "max_weight_kg": 20, "per_kg_rate": 4.0}]}]
+    load_rate_data(postgres_engine, lambda: sheet, "float-bounds", "test", force=True)
+    lane = build_rate_table(sheet).lane("China", "USA", "air")
+    weights = [bound, 10.000000000000004, 10.0, 20.0, 20.000000000000004]
+
+    # Test case 1: Postgres picks the tier LaneRates.per_kg_rate picks at and around a bound
+    with sessionmaker(bind=postgres_engine)() as session:
+        found = lookup_tiers(session, [("China", "USA", "air", weight) for weight in weights])
+    assert found == [lane.tier_at(weight) for weight in weights]
+    assert found[1].per_kg_rate == 4.0
+
+
+def test_postgres_rejects_overlapping_tiers(postgres_engine):
+    assert load_rate_sheet(postgres_engine, RATES_PATH)
+    with postgres_engine.connect() as conn:
+        assert list(conn.execute(select(SchemaMigration.version)).scalars()) == [
+            version for version, _, _ in MIGRATIONS]
+        tier = conn.execute(select(Rate.shipping_rate_id, Rate.min_weight_kg, Rate.max_weight_kg)).first()
+
+    # Test case 1: a tier overlapping another tier of its lane is refused by the exclusion constraint
+    with pytest.raises(exc.IntegrityError, match=TIER_OVERLAP_CONSTRAINT):
+        with postgres_engine.begin() as conn:
+            conn.execute(insert(Rate).values(shipping_rate_id=tier.shipping_rate_id, per_kg_rate=1.0,
+                                             min_weight_kg=tier.min_weight_kg,
+                                             max_weight_kg=(tier.min_weight_kg + tier.max_weight_kg) / 2))
+
+    # Test case 2: a tier starting where another ends does not overlap it
+    with postgres_engine.begin() as conn:
+        conn.execute(insert(Rate).values(shipping_rate_id=tier.shipping_rate_id, per_kg_rate=1.0,
+                                         min_weight_kg=1e9, max_weight_kg=2e9))
+        conn.execute(insert(Rate).values(shipping_rate_id=tier.shipping_rate_id, per_kg_rate=1.0,
+                                         min_weight_kg=2e9, max_weight_kg=3e9))
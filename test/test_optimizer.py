@@ -0,0 +1,127 @@
+import itertools
+import random
+import pytest
+from fastapi import HTTPException
+from app import optimizer
+from app.controllers import box_line_columns, get_shipping_quotes, optimize_shipment
+from app.rate_engine import build_rate_table
+from app.schemas import OptimizeRequest, QuoteRequest
+
+
+def lane(channel, tiers, max_days):
+    return {
+        "starting_country": "Testland", "destination_country": "USA", "shipping_channel": channel,
+        "shipping_time_range": {"min_days": max_days - 5, "max_days": max_days},
+        "rates": [{"min_weight_kg": low, "max_weight_kg": high, "per_kg_rate": rate} for low, high, rate in tiers],
+    }
+
+
+@pytest.fixture
+def rate_table():
+    return build_rate_table([
+        lane("air", [(0, 50, 10.0), (50, 120, 6.0), (120, 10000, 5.0)], 10),
+        lane("ocean", [(30, 80, 4.0), (80, 10000, 3.5)], 40),
+    ])
+
+
+def brute_force(rate_table, boxes):
+    best = None
+    for split in itertools.product(*[range(box["count"] + 1) for box in boxes]):
+        by_air = sum(taken * box["weight_kg"] for taken, box in zip(split, boxes))
+        by_ocean = sum((box["count"] - taken) * box["weight_kg"] for taken, box in zip(split, boxes))
+        cost = 0.0
+        for channel, weight in (("air", by_air), ("ocean", by_ocean)):
+            rate = rate_table.lane("Testland", "USA", channel).per_kg_rate(weight) if weight else 0.0
+            if rate is None:
+                break
+            cost += weight * rate
+        else:
+            best = cost if best is None else min(best, cost)
+    return best
+
+
+def test_optimizer_matches_brute_force(rate_table):
+    for seed in range(20):
+        rng = random.Random(seed)
+        boxes = [{"count": rng.randint(1, 3), "weight_kg": round(rng.uniform(1, 30), 1),
+                  "length": 10, "width": 10, "height": 10} for _ in range(4)]
+        plans = optimize_shipment(OptimizeRequest(starting_country="Testland", destination_country="USA",
+                                                  boxes=boxes), rate_table)
+        assert plans.complete
+        assert plans.cheapest.total_cost == pytest.approx(brute_force(rate_table, boxes))
+
+
+def test_split_when_no_channel_carries_everything_and_transit_limit(rate_table):
+    boxes = [{"count": 1, "weight_kg": 24, "length": 10, "width": 10, "height": 10},
+             {"count": 1, "weight_kg": 20, "length": 10, "width": 10, "height": 10}]
+    small = build_rate_table([lane("air", [(0, 25, 10.0)], 10), lane("ocean", [(15, 25, 4.0)], 40)])
+    plans = optimize_shipment(OptimizeRequest(starting_country="Testland", destination_country="USA",
+                                              boxes=boxes, max_transit_days=20), small)
+
+    # Test case 1: 44 kg fits neither channel, the cheaper split sends the heavier box by ocean
+    assert plans.cheapest.total_cost == pytest.approx(20 * 10.0 + 24 * 4.0)
+    assert sorted((allocation.shipping_channel, [box.line for box in allocation.boxes])
+                  for allocation in plans.cheapest.allocations) == [("air", [1]), ("ocean", [0])]
+    assert plans.within_transit_limit is None
+
+    # Test case 2: within 20 days only air qualifies, priced exactly as get_shipping_quotes does
+    plans = optimize_shipment(OptimizeRequest(starting_country="Testland", destination_country="USA",
+                                              boxes=boxes, max_transit_days=20), rate_table)
+    quotes = get_shipping_quotes(QuoteRequest(starting_country="Testland", destination_country="USA",
+                                              boxes=boxes), rate_table)
+    assert plans.within_transit_limit.max_days == 10
+    assert plans.within_transit_limit.total_cost == next(
+        quote.total_cost for quote in quotes if quote.shipping_channel == "air")
+
+
+def test_many_lines_within_budget(rate_table):
+    rng = random.Random(5)
+    boxes = [{"count": rng.randint(1, 4), "weight_kg": rng.uniform(1, 30), "length": rng.uniform(10, 60),
+              "width": rng.uniform(10, 60), "height": rng.uniform(10, 60)} for _ in range(400)]
+    request = OptimizeRequest(starting_country="Testland", destination_country="USA", boxes=boxes,
+                              time_budget_ms=5000)
+    plans = optimize_shipment(request, rate_table)
+
+    # Test case 1: the shipment is too heavy for one channel but can be split
+    assert plans.complete
+    assert len(plans.cheapest.allocations) == 2
+    assert all(allocation.chargeable_weight_kg <= 10000 for allocation in plans.cheapest.allocations)
+    assert sum(box.count for allocation in plans.cheapest.allocations
+               for box in allocation.boxes) == sum(box["count"] for box in boxes)
+
+    # Test case 2: running out of budget is reported, not turned into a wrong answer
+    with pytest.raises(HTTPException) as error:
+        optimize_shipment(request.model_copy(update={"time_budget_ms": 1e-6}), rate_table)
+    assert error.value.status_code == 404
+
+
+def test_time_budget_bounds_the_whole_search():
+    rate_table = build_rate_table([lane("air", [(0, 120, 6.0), (120, 1e6, 5.0)], 10),
+                                   lane("ocean", [(0, 80, 4.0), (80, 1e6, 3.5)], 40)])
+    rng = random.Random(8)
+    boxes = [{"count": rng.randint(1, 4), "weight_kg": rng.uniform(1, 30), "length": rng.uniform(10, 60),
+              "width": rng.uniform(10, 60), "height": rng.uniform(10, 60)} for _ in range(8000)]
+    request = OptimizeRequest(starting_country="Testland", destination_country="USA", boxes=boxes,
+                              time_budget_ms=20)
+
+    # Test case 1: the search stops early and still returns the best plan found
+    plans = optimize_shipment(request, rate_table)
+    assert not plans.complete
+    assert plans.cheapest.total_cost <= min(
+        quote.total_cost for quote in get_shipping_quotes(QuoteRequest(**request.model_dump(
+            include={"starting_country", "destination_country", "boxes"})), rate_table))
+
+    # Test case 2: rebuilding a split from the grid stops at the deadline too
+    _, _, weights = optimizer.chunk_box_lines(*box_line_columns(request), "Testland")
+    sums = optimizer.SubsetSums(weights, float(weights.sum()), deadline=float("inf"))
+    sums.deadline = 0.0
+    with pytest.raises(optimizer.BudgetExceeded):
+        sums.subset(int(sums.reachable[len(sums.reachable) // 2]))
+
+    # Test case 3: budgets above the server maximum are lowered to it
+    budgets = []
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(optimizer, "plan_shipment", lambda *args: budgets.append(args[-1]) or (None, None, True))
+        with pytest.raises(HTTPException):
+            optimize_shipment(request.model_copy(update={"time_budget_ms": 10_000}), rate_table)
+    assert budgets == [optimizer.OPTIMIZER_MAX_TIME_BUDGET_MS]
@@ -0,0 +1,66 @@
+import asyncio
+import cProfile
+import pstats
+import threading
+from app.profiling import ProfilingMiddleware, RequestSamples, SlowRequestLog, StackSampler
+from app.profiling import profile_report, profile_requested
+from app.schemas import Box
+
+
+def scope(headers=(), query=b""):
+    return {"type": "http", "method": "POST", "path": "/v1/quotes", "headers": list(headers), "query_string": query}
+
+
+def test_profile_flag_and_report():
+    # Test case 1: the flag is read from the header or the query string
+    assert profile_requested(scope([(b"x-profile", b"1")]))
+    assert profile_requested(scope(query=b"a=1&profile=true"))
+    assert not profile_requested(scope(query=b"profile=0"))
+    assert not profile_requested(scope([(b"x-profile", b"no")], b"profile=1"))
+
+    # Test case 2: self time is split by where the code lives
+    profiler = cProfile.Profile()
+    profiler.enable()
+    Box.model_validate({"count": 1, "weight_kg": 1, "length": 1, "width": 1, "height": 1})
+    profiler.disable()
+    report = profile_report(pstats.Stats(profiler), 0.01)
+    assert report["self_seconds"]["pydantic"] > 0
+    assert report["functions"] and report["stages"] == {}
+
+
+def test_profiling_needs_an_admin():
+    sent = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("not called")
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = ProfilingMiddleware(app, authorize=lambda token: token == "s3cret")
+    asyncio.run(middleware(scope([(b"x-profile", b"1"), (b"x-admin-token", b"wrong")]), None, send))
+    assert sent[0]["status"] == 403
+
+
+def test_slow_requests_keep_their_samples():
+    log = SlowRequestLog(threshold_ms=1, size=2)
+
+    async def slow_request():
+        sampler = StackSampler(asyncio.get_running_loop(), threading.get_ident(), 1)
+        samples = sampler.active[asyncio.current_task()] = RequestSamples("POST", "/v1/quotes")
+        # sampled from another thread while this task runs
+        worker = threading.Thread(target=sampler.sample)
+        worker.start()
+        while worker.is_alive():
+            pass
+        return samples
+
+    samples = asyncio.run(slow_request())
+    assert sum(samples.stacks.values()) == 1
+    assert "test.test_profiling:slow_request" in next(iter(samples.stacks))
+
+    # Test case 1: the ring buffer keeps the newest entries, newest first
+    for elapsed in (0.1, 0.2, 0.3):
+        log.add(samples, elapsed, "200")
+    assert [entry["elapsed_seconds"] for entry in log.entries()] == [0.3, 0.2]
+    assert log.entries()[0]["stacks"][0]["samples"] == 1
@@ -0,0 +1,52 @@
+import pytest
+from app.schemas import QuoteRequest, Box
+from app.quote_cache import QuoteCache, canonical_key
+
+
+def test_canonical_key_ignores_order_and_line_splits():
+    a = Box(count=2, weight_kg=10.0, length=1.0, width=2.0, height=3.0)
+    b = Box(count=1, weight_kg=5.0, length=4.0, width=5.0, height=6.0)
+    split = Box(count=1, weight_kg=10.0, length=1.0, width=2.0, height=3.0)
+    key = canonical_key(QuoteRequest(starting_country="China", destination_country="USA", boxes=[a, b]))
+    assert key == canonical_key(QuoteRequest(starting_country="China", destination_country="USA", boxes=[b, a]))
+    assert key == canonical_key(QuoteRequest(starting_country="China", destination_country="USA",
+                                             boxes=[split, b, split]))
+    assert key != canonical_key(QuoteRequest(starting_country="India", destination_country="USA", boxes=[a, b]))
+
+
+def test_lru_and_ttl_eviction():
+    now = [0.0]
+    cache = QuoteCache(max_entries=2, ttl=10.0, clock=lambda: now[0])
+    assert cache.get_or_compute("a", 1, lambda: "A") == "A"
+    assert cache.get_or_compute("b", 1, lambda: "B") == "B"
+    assert cache.get_or_compute("a", 1, lambda: "stale") == "A"
+    # "b" is the least recently used
+    cache.get_or_compute("c", 1, lambda: "C")
+    assert cache.get_or_compute("b", 1, lambda: "B2") == "B2"
+    assert cache.evictions == 2
+
+    now[0] = 11.0
+    assert cache.get_or_compute("b", 1, lambda: "B3") == "B3"
+    assert cache.expirations == 1
+
+
+def test_new_rate_version_invalidates():
+    cache = QuoteCache(max_entries=10, ttl=60.0)
+    cache.get_or_compute("a", 1, lambda: "old")
+    assert cache.get_or_compute("a", 2, lambda: "new") == "new"
+    assert cache.stats()["invalidations"] == 1
+    assert len(cache) == 1
+
+    # Test case 1: a request still holding the old table neither rolls the cache back nor reads it
+    assert cache.get_or_compute("a", 1, lambda: "old") == "old"
+    assert cache.get_or_compute("a", 2, lambda: "recomputed") == "new"
+    assert cache.stats()["rate_version"] == 2
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stale == 1
+
+
+def test_errors_are_not_cached():
+    cache = QuoteCache(max_entries=10, ttl=60.0)
+    with pytest.raises(ValueError):
+        cache.get_or_compute("k", 1, lambda: (_ for _ in ()).throw(ValueError()))
+    assert cache.get_or_compute("k", 1, lambda: "ok") == "ok"
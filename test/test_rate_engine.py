@@ -0,0 +1,164 @@
+import json
+import pytest
+from app.schemas import QuoteRequest, Box
+from app.controllers import get_shipping_quotes
+from app.rate_engine import build_rate_table, RateTable, LaneRates, Tier, set_rate_table, get_rate_table
+
+
+@pytest.fixture
+def rate_table():
+    with open('data/rates (1).json', 'r') as json_file:
+        return build_rate_table(json.load(json_file))
+
+
+def test_lane_tier_lookup(rate_table):
+    lane = rate_table.lane("China", "USA", "air")
+    # rates are min exclusive, max inclusive
+    assert lane.per_kg_rate(0.0) is None
+    assert lane.per_kg_rate(0.5) == 5.0
+    assert lane.per_kg_rate(20.0) == 5.0
+    assert lane.per_kg_rate(20.01) == 4.5
+    assert lane.per_kg_rate(10000.0) == 3.5
+    assert lane.per_kg_rate(10000.01) is None
+
+    ocean = rate_table.lane("China", "USA", "ocean")
+    assert ocean.per_kg_rate(100.0) is None
+    assert ocean.per_kg_rate(100.5) == 1.0
+
+    assert rate_table.lane("Vietnam", "USA", "ocean") is None
+
+
+def test_unsorted_tiers_with_gap():
+    lane = LaneRates("A", "B", "air", 1, 2, [
+        Tier(50, 100, 2.0),
+        Tier(0, 10, 3.0),
+    ])
+    assert lane.per_kg_rate(5) == 3.0
+    assert lane.per_kg_rate(30) is None
+    assert lane.per_kg_rate(75) == 2.0
+
+
+def test_get_shipping_quotes_from_rate_table(rate_table):
+    quote_request = QuoteRequest(
+        starting_country="China",
+        destination_country="USA",
+        boxes=[
+            Box(count=2, weight_kg=100, length=1.0, width=1.0, height=1.0),
+            Box(count=1, weight_kg=100, length=5.0, width=5.0, height=5.0),
+        ],
+    )
+    quotes = get_shipping_quotes(quote_request, rate_table)
+    assert [quote.shipping_channel for quote in quotes] == ["air", "ocean"]
+    assert quotes[0].total_cost == 1590.0
+    assert quotes[1].total_cost == 840.0
+    assert quotes[1].shipping_time_range.min_days == 45
+
+
+def test_set_rate_table_swaps_version(rate_table):
+    previous = get_rate_table()
+    try:
+        empty = set_rate_table(RateTable([]))
+        assert get_rate_table() is empty
+        assert empty.version > rate_table.version
+    finally:
+        set_rate_table(previous)
+
+
+def test_iter_batch_quotes_reports_errors_per_item(rate_table):
+    from app.controllers import iter_batch_quotes
+    good = QuoteRequest(starting_country="China", destination_country="USA",
+                        boxes=[Box(count=1, weight_kg=200, length=1.0, width=1.0, height=1.0)])
+    too_heavy = QuoteRequest(starting_country="China", destination_country="USA",
+                             boxes=[Box(count=1, weight_kg=100000.0, length=1.0, width=1.0, height=1.0)])
+    india = QuoteRequest(starting_country="India", destination_country="USA",
+                         boxes=[Box(count=1, weight_kg=5, length=1.0, width=1.0, height=1.0)])
+    results = sorted(iter_batch_quotes([good, too_heavy, india, ValueError("bad line")], rate_table, window=2),
+                     key=lambda result: result["index"])
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert len(results[0]["quotes"]) == 2
+    assert results[1]["status_code"] == 500
+    assert results[2]["quotes"][0].shipping_channel == "air"
+    assert results[3]["status_code"] == 500
+
+
+def test_cost_curve_matches_scalar_lookup(rate_table):
+    import numpy as np
+    weights = np.concatenate([np.linspace(-1, 10001, 2001), [0.0, 20.0, 40.0, 100.0, 10000.0]])
+    for lane in rate_table:
+        costs = lane.costs_at(weights)
+        for weight, cost in zip(weights.tolist(), costs.tolist()):
+            rate = lane.per_kg_rate(weight)
+            if rate is None:
+                assert cost != cost
+            else:
+                assert cost == weight * rate
+
+    overlapping = LaneRates("A", "B", "air", 1, 2, [Tier(0, 100, 2.0), Tier(50, 60, 3.0)])
+    assert overlapping.costs_at([55.0, 80.0]).tolist() == [55.0 * overlapping.per_kg_rate(55.0), 160.0]
+
+
+def test_cost_curve_route(rate_table):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    previous = get_rate_table()
+    set_rate_table(rate_table)
+    try:
+        client = TestClient(app)
+        url = "/v1/lanes/China/USA/air/costs"
+        response = client.post(url, json={"weights": [0.0, 50.0]})
+
+        # Test case 1: costs come back as JSON, null where no tier covers the weight
+        assert response.json() == {"weights": [0.0, 50.0], "shipping_costs": [None, 50.0 * 4.0]}
+        assert response.headers["X-Rate-Version"] == rate_table.tag
+        grid = client.post(url, json={"start": 1, "stop": 100, "num": 100}).json()
+        assert grid["shipping_costs"][-1] == 100.0 * rate_table.lane("China", "USA", "air").per_kg_rate(100.0)
+
+        # Test case 2: grids over the point cap are refused
+        assert client.post(url, json={"start": 0, "stop": 1, "num": 100_001}).status_code == 422
+        assert client.post(url, json={"weights": [1.0] * 100_001}).status_code == 422
+        assert client.post("/v1/lanes/China/Mars/air/costs", json={"weights": [1.0]}).status_code == 404
+    finally:
+        set_rate_table(previous)
+
+
+def test_cheapest_channel(rate_table):
+    lane, rate = rate_table.cheapest_channel("China", "USA", 150.0)
+    assert (lane.shipping_channel, rate) == ("ocean", 1.0)
+    lane, rate = rate_table.cheapest_channel("China", "USA", 50.0)
+    assert (lane.shipping_channel, rate) == ("air", 4.0)
+    assert rate_table.cheapest_channel("China", "USA", 50000.0) is None
+
+
+def test_quotes_every_channel_of_a_lane(rate_table):
+    sheet = [
+        {"starting_country": "China", "destination_country": "Germany", "shipping_channel": channel,
+         "shipping_time_range": {"min_days": days, "max_days": days + 5},
+         "rates": [{"min_weight_kg": 0, "max_weight_kg": 1000, "per_kg_rate": rate}]}
+        for channel, days, rate in (("air", 5, 6.0), ("rail", 20, 3.0), ("ocean", 40, 1.0))
+    ]
+    table = build_rate_table(sheet)
+    quote_request = QuoteRequest(starting_country="China", destination_country="Germany",
+                                 boxes=[Box(count=1, weight_kg=10, length=1.0, width=1.0, height=1.0)])
+    quotes = get_shipping_quotes(quote_request, table)
+    assert [quote.shipping_channel for quote in quotes] == ["air", "rail", "ocean"]
+    assert [quote.cost_breakdown.shipping_cost for quote in quotes] == [60.0, 30.0, 10.0]
+
+    # lanes without an ocean channel still get their air quote
+    vietnam = QuoteRequest(starting_country="Vietnam", destination_country="USA",
+                           boxes=[Box(count=1, weight_kg=10, length=1.0, width=1.0, height=1.0)])
+    assert [quote.shipping_channel for quote in get_shipping_quotes(vietnam, rate_table)] == ["air"]
+
+
+def test_compare_any_origin(rate_table):
+    from app.controllers import compare_shipping_quotes
+    from app.schemas import CompareRequest
+    compare_request = CompareRequest(destination_country="USA",
+                                     boxes=[Box(count=1, weight_kg=200, length=1.0, width=1.0, height=1.0)])
+    results = compare_shipping_quotes(compare_request, rate_table)
+    assert [result.starting_country for result in results] == ["China", "India", "Vietnam"]
+    china = get_shipping_quotes(QuoteRequest(starting_country="China", destination_country="USA",
+                                             boxes=compare_request.boxes), rate_table)
+    assert results[0].quotes == china
+    assert compare_shipping_quotes(CompareRequest(starting_country="Mars", boxes=compare_request.boxes),
+                                   rate_table) == []
@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pytest
+from app.controllers import get_shipping_quotes
+from app.loader import RATES_PATH, content_hash
+from app.rate_engine import build_rate_table, get_rate_table, set_rate_table
+from app.rate_file import (RateFileError, encode_rate_table, file_state, load_current_snapshot, read_rate_file,
+                           write_rate_file)
+from app.reload import RateReloader
+from app.schemas import Box, QuoteRequest
+
+
+@pytest.fixture
+def rate_table():
+    with open(RATES_PATH, "r") as json_file:
+        return build_rate_table(json.load(json_file), content_hash=content_hash(RATES_PATH))
+
+
+def test_round_trip_through_mapped_file(rate_table, tmp_path):
+    path = str(tmp_path / "rates.bin")
+    write_rate_file(rate_table, path)
+    mapped = read_rate_file(path)
+
+    # Test case 1: same lanes, fees and version, with tiers read in place from the mapping
+    assert mapped.tag == rate_table.tag
+    assert [lane.key for lane in mapped] == [lane.key for lane in rate_table]
+    lane = mapped.lane("China", "USA", "air")
+    assert lane.tiers == rate_table.lane("China", "USA", "air").tiers
+    assert lane.per_kg_rate(50) == rate_table.lane("China", "USA", "air").per_kg_rate(50)
+
+    # Test case 2: the lane owns no tier data, it only holds read-only views into the mapping
+    for tiers in (lane.min_weights, lane.max_weights, lane.per_kg_rates):
+        assert isinstance(tiers, np.ndarray)
+        assert not tiers.flags.owndata and not tiers.flags.writeable
+    # scalar lookups answer in plain floats, not numpy scalars
+    assert type(lane.per_kg_rate(50)) is float
+    assert all(type(bound) is float for bound in lane.tier_at(50))
+
+    # Test case 3: quotes are identical
+    request = QuoteRequest(starting_country="India", destination_country="USA",
+                           boxes=[Box(count=3, weight_kg=17.5, length=130.0, width=20.0, height=20.0)])
+    assert get_shipping_quotes(request, mapped) == get_shipping_quotes(request, rate_table)
+
+    # Test case 4: a snapshot only counts as current while the rate file is unchanged
+    assert load_current_snapshot(path, RATES_PATH).tag == rate_table.tag
+    other = tmp_path / "other.json"
+    other.write_text("[]")
+    assert load_current_snapshot(path, str(other)) is None
+
+
+def test_corrupt_files_are_rejected(rate_table, tmp_path):
+    data = bytearray(encode_rate_table(rate_table))
+    path = tmp_path / "rates.bin"
+
+    for broken, message in ((data[:-8], "truncated"), (data[:-1] + bytes([data[-1] ^ 1]), "checksum"),
+                            (data[:8] + (2).to_bytes(4, "little") + data[12:], "version")):
+        path.write_bytes(bytes(broken))
+        with pytest.raises(RateFileError, match=message):
+            read_rate_file(str(path))
+
+
+def test_workers_switch_to_a_replaced_snapshot(rate_table, tmp_path):
+    path = str(tmp_path / "rates.bin")
+    writer = RateReloader(snapshot_path=path)
+    reader = RateReloader(snapshot_path=path)
+    previous = get_rate_table()
+    try:
+        writer.publish(rate_table)
+        before = file_state(path)
+
+        # Test case 1: the snapshot of the active table is not loaded again
+        assert reader.reload_snapshot() is None
+
+        # Test case 2: a new version replaces the file and other workers pick it up
+        cheaper = json.loads(open(RATES_PATH).read())
+        cheaper[0]["rates"][0]["per_kg_rate"] = 1.0
+        writer.publish(build_rate_table(cheaper, content_hash="b" * 64))
+        set_rate_table(rate_table)
+        assert file_state(path) != before
+        assert reader.reload_snapshot()["status"] == "ok"
+        assert get_rate_table().lane("China", "USA", "air").per_kg_rate(10) == 1.0
+    finally:
+        set_rate_table(previous)
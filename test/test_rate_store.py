@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from sqlalchemy import exc
+from app import metrics
+from app.loader import RATES_PATH
+from app.rate_store import MemoryRateStore, RateStore, SQLRateStore
+
+
+def test_memory_store_starts_from_the_rate_file():
+    store = MemoryRateStore()
+    table = store.load_table()
+    assert table.lane("China", "USA", "air").per_kg_rate(50) == 4.0
+    assert store.content_hash() == table.content_hash
+
+    # Test case 1: the same sheet is not stored twice
+    assert not store.load_sheet(RATES_PATH)
+    assert store.load_sheet(RATES_PATH, force=True)
+
+
+def test_backends_must_implement_the_whole_interface():
+    class TablesOnly(RateStore):
+        def load_table(self, primary=False):
+            return MemoryRateStore().load_table()
+
+    # Test case 1: a backend missing methods fails when it is created, not on first use
+    with pytest.raises(TypeError, match="lookup_tiers"):
+        TablesOnly()
+
+
+def test_reads_fail_over_from_a_broken_replica(tmp_path):
+    broken = f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    store = SQLRateStore(f"sqlite:///{tmp_path / 'primary.db'}", [broken], retry_seconds=60)
+    store.load_sheet(RATES_PATH)
+    failovers = metrics.DB_READ_FAILOVERS._values.get((store.replicas[0].name,), 0)
+
+    # Test case 1: the replica fails, the primary answers and the replica is skipped afterwards
+    assert store.read_order() == [store.replicas[0], store.primary]
+    assert store.load_table().lane("China", "USA", "air").per_kg_rate(50) == 4.0
+    assert store.read_order() == [store.primary]
+    assert metrics.DB_READ_FAILOVERS._values[(store.replicas[0].name,)] == failovers + 1
+    assert store.status()["replicas"] == [{"name": store.replicas[0].name, "healthy": False}]
+
+    # Test case 2: async reads fail over the same way once the replica is due for a retry
+    store.replicas[0].down_until = 0.0
+    table = asyncio.run(store.load_table_async())
+    assert table.content_hash == store.content_hash()
+    assert store.read_order() == [store.primary]
+
+
+def test_query_errors_do_not_fail_over(tmp_path):
+    store = SQLRateStore(f"sqlite:///{tmp_path / 'primary.db'}", [f"sqlite:///{tmp_path / 'replica.db'}"])
+
+    def bad_query(session):
+        raise exc.ProgrammingError("SELECT", {}, Exception("syntax error"))
+
+    # Test case 1: a bug in the query is raised from the replica, which stays in rotation
+    with pytest.raises(exc.ProgrammingError):
+        store._read(bad_query)
+    assert store.status()["replicas"][0]["healthy"]
+
+
+def test_admin_looks_up_stored_tiers(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app import admin
+    from app.rate_store import get_rate_store, set_rate_store
+    from main import app
+
+    store = SQLRateStore(f"sqlite:///{tmp_path / 'rates.db'}")
+    store.load_sheet(RATES_PATH)
+    previous = get_rate_store()
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret")
+    set_rate_store(store)
+    try:
+        client = TestClient(app)
+        queries = [{"starting_country": "China", "destination_country": "USA", "shipping_channel": "air",
+                    "weight_kg": 50},
+                   {"starting_country": "China", "destination_country": "Mars", "shipping_channel": "air",
+                    "weight_kg": 50}]
+
+        # Test case 1: each lookup gets its stored tier, or null when no tier covers it
+        response = client.post("/v1/admin/rates/tiers", json=queries, headers={"X-Admin-Token": "s3cret"})
+        assert response.status_code == 200
+        assert response.json()[0]["per_kg_rate"] == 4.0 and response.json()[1] is None
+
+        # Test case 2: too many lookups at once are refused
+        monkeypatch.setattr(admin, "MAX_TIER_LOOKUPS", 1)
+        response = client.post("/v1/admin/rates/tiers", json=queries, headers={"X-Admin-Token": "s3cret"})
+        assert response.status_code == 422
+    finally:
+        set_rate_store(previous)
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+from app.loader import RATES_PATH
+from app.rate_engine import get_rate_table, set_rate_table
+from app.rate_store import SQLRateStore
+from app.reload import RateReloader, RateWatcher
+
+
+def lane(per_kg_rate):
+    return {
+        "starting_country": "China", "destination_country": "USA", "shipping_channel": "air",
+        "shipping_time_range": {"min_days": 1, "max_days": 2},
+        "rates": [{"min_weight_kg": 0, "max_weight_kg": 100, "per_kg_rate": per_kg_rate}],
+    }
+
+
+def test_reload_swaps_table_and_keeps_old_one_on_bad_sheet(tmp_path):
+    store = SQLRateStore(f"sqlite:///{tmp_path / 'rates.db'}")
+    reloader = RateReloader(store)
+    previous = get_rate_table()
+    try:
+        # Test case 1: valid sheet is swapped in with a content based version
+        result = reloader.reload_file(RATES_PATH)
+        assert result["status"] == "ok"
+        active = get_rate_table()
+        assert active.tag == result["version"]
+        assert active.lane("China", "USA", "air").per_kg_rate(50) == 4.0
+
+        # Test case 2: overlapping tiers are rejected and the active table stays
+        bad = lane(1.0)
+        bad["rates"].append({"min_weight_kg": 50, "max_weight_kg": 200, "per_kg_rate": 1.0})
+        result = reloader.reload_bytes(json.dumps([bad]).encode(), "upload")
+        assert result["status"] == "failed"
+        assert get_rate_table() is active
+
+        # Test case 3: a reload done elsewhere is picked up from the stored hash
+        RateReloader(store).reload_bytes(json.dumps([lane(2.0)]).encode(), "upload")
+        set_rate_table(active)
+        RateWatcher(reloader, path=str(tmp_path / "missing.json"), interval=1).check()
+        assert get_rate_table().lane("China", "USA", "air").per_kg_rate(50) == 2.0
+        assert reloader.last_reload["source"] == "database"
+    finally:
+        set_rate_table(previous)
+
+
+def test_restart_keeps_an_uploaded_sheet(tmp_path):
+    path = str(tmp_path / "rates.json")
+    shutil.copy(RATES_PATH, path)
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    store = SQLRateStore(f"sqlite:///{tmp_path / 'rates.db'}")
+    assert store.load_sheet(path, keep_newer=True)
+    previous = get_rate_table()
+    try:
+        uploaded = RateReloader(store, snapshot_path="").reload_bytes(json.dumps([lane(2.0)]).encode(), "upload")
+    finally:
+        set_rate_table(previous)
+
+    # Test case 1: the startup load leaves the sheet uploaded since the file last changed
+    assert not store.load_sheet(path, keep_newer=True)
+    assert store.load_table().tag == uploaded["version"]
+
+    # Test case 2: a rate file changed after the upload is loaded over it
+    os.utime(path)
+    assert store.load_sheet(path, keep_newer=True)
+    assert store.load_table().lane("China", "USA", "air").per_kg_rate(50) == 4.0